@@ -0,0 +1,145 @@
+'''
+This package contains benchmarks for playtag.
+
+Run it with:
+
+    python -m playtag.bench [<name>...] [<option>=<value>...]
+
+Benchmarks are selected by name prefix (e.g. 'compile' runs all the
+compile benchmarks); with no names, all of them are run.  Options:
+
+    BENCH_OUTPUT=<file>   -- write the results as JSON to this file
+    BENCH_COMPARE=<file>  -- compare against the JSON from a previous run
+    BENCH_REPEAT=<n>      -- number of timing repeats (the best is used)
+    BENCH_QUICK=1         -- use smaller sizes, for a fast sanity check
+
+Everything runs against the simulated cable (see cables/sim), so no
+hardware is required.  The JSON results record the git commit of the
+tree, so that runs from different commits can be compared.
+
+Each benchmark is a generator function that is registered with the
+benchmark decorator.  It is passed a Bench object, and yields result
+dicts from Bench.measure().
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import os
+import sys
+import time
+import json
+import platform
+import subprocess
+
+benchmarks = []
+
+def benchmark(func):
+    ''' Decorator to register a benchmark.  The name of the
+        benchmark is the name of the function.
+    '''
+    benchmarks.append(func)
+    return func
+
+class BenchDefaults(object):
+    BENCH_OUTPUT = None
+    BENCH_COMPARE = None
+    BENCH_REPEAT = 5
+    BENCH_QUICK = False
+
+
+class Bench(object):
+    ''' Passed to each benchmark, to give it access to
+        options and to time things.
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.repeat = max(config.BENCH_REPEAT, 1)
+        self.quick = bool(config.BENCH_QUICK)
+
+    def sizes(self, full, quick):
+        return quick if self.quick else full
+
+    def measure(self, name, func, number=1, units=None, count=None, timer=time.perf_counter):
+        ''' Call func number times in a row, repeat that, and
+            return a result dict for the best repeat.  If units
+            and count are given, count is the number of units
+            (e.g. bytes) processed by each call, and the result
+            includes a throughput.
+        '''
+        times = []
+        for i in range(self.repeat):
+            start = timer()
+            for j in range(number):
+                func()
+            times.append((timer() - start) / number)
+        times.sort()
+        result = dict(name=name, seconds=times[0], median=times[len(times) // 2],
+                      repeat=self.repeat, number=number)
+        if units is not None:
+            result['units'] = units
+            result['count'] = count
+            result['per_second'] = count / times[0] if times[0] else None
+        return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(__file__),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def format_result(result):
+    seconds = result['seconds']
+    if seconds is None:
+        return '%-44s %s' % (result['name'], result.get('error', 'failed'))
+    text = '%-44s %12.3f us' % (result['name'], seconds * 1e6)
+    if result.get('per_second'):
+        text += '  %12.0f %s/s' % (result['per_second'], result['units'])
+    return text
+
+def run(config, names=()):
+    ''' Run the selected benchmarks, print the results,
+        and return the results as a dict.
+    '''
+    from . import templates, cables   # Register the benchmarks
+
+    config.add_defaults(BenchDefaults)
+    bench = Bench(config)
+    selected = [x for x in benchmarks if not names or x.__name__.startswith(tuple(names))]
+    if not selected:
+        config.error('No benchmarks match %s; available benchmarks are:\n    %s' %
+                     (' '.join(names), '\n    '.join(x.__name__ for x in benchmarks)))
+    previous = {}
+    if config.BENCH_COMPARE:
+        with open(config.BENCH_COMPARE, 'rt') as f:
+            previous = dict((x['name'], x) for x in json.load(f)['results'])
+    results = []
+    for func in selected:
+        try:
+            for result in func(bench):
+                results.append(result)
+                text = format_result(result)
+                old = previous.get(result['name'])
+                if old is not None and old['seconds'] and result['seconds']:
+                    text += '  (%0.2fx)' % (old['seconds'] / result['seconds'])
+                print(text)
+                sys.stdout.flush()
+        except Exception as exc:
+            result = dict(name=func.__name__, seconds=None, error='%s: %s' % (type(exc).__name__, exc))
+            results.append(result)
+            print(format_result(result))
+    info = dict(
+        commit=git_commit(),
+        time=time.strftime('%Y-%m-%d %H:%M:%S'),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        quick=bench.quick,
+        results=results,
+    )
+    if config.BENCH_OUTPUT:
+        with open(config.BENCH_OUTPUT, 'wt') as f:
+            json.dump(info, f, indent=1)
+    return info
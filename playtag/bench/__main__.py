@@ -0,0 +1,6 @@
+from ..lib.userconfig import UserConfig
+from . import run
+
+config = UserConfig()
+args, options = config.readargs()
+run(config, args)
@@ -0,0 +1,159 @@
+'''
+End-to-end benchmarks against the simulated cable:  chain
+discovery, memory bus reads, and XVC shifts over loopback.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import socket
+import threading
+
+from . import benchmark
+from .templates import field_template, field_data, sim_config
+from ..jtag.discover import Chain
+from ..fpga.fpgabus import BusDriver, OneBus
+from ..lib.bus32 import Bus32
+from ..cables import sim, xvc
+
+class Bus32Driver(object):
+    ''' Adapts one BusDriver memory space to the Bus32 driver interface.
+    '''
+    big_endian = False
+    addr_align = 256
+    max_bytes = 65536
+
+    def __init__(self, busdriver, space):
+        self.busdriver = busdriver
+        self.space = space
+
+    def readsingle(self, addr, size):
+        return self.busdriver[False, size, 1]([self.space, addr])
+
+    def readmultiple(self, addr, length):
+        return self.busdriver.readmultiple(self.space, addr, length, 4)
+
+    def writesingle(self, addr, size, value):
+        self.busdriver.writesingle(self.space, addr, value, size)
+
+    def writemultiple(self, addr, data, offset, length):
+        self.busdriver.writemultiple(self.space, addr, data[offset:offset + length], 4)
+
+
+class XvcServer(threading.Thread):
+    ''' A minimal XVC server on the loopback interface,
+        which shifts data through a simulated chain.
+    '''
+    daemon = True
+    maxbits = xvc.maxbits
+
+    def __init__(self, chain):
+        threading.Thread.__init__(self)
+        self.chain = chain
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.start()
+
+    def run(self):
+        while True:
+            sock, address = self.listener.accept()
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self.serve, args=(sock,), daemon=True).start()
+
+    def serve(self, sock):
+        with sock:
+            self.shift_commands(sock)
+
+    def shift_commands(self, sock):
+        data = bytearray()
+        clock = self.chain.clock
+        while True:
+            if len(data) < 10 and not data.startswith(b'getinfo:'):
+                received = sock.recv(65536)
+                if not received:
+                    return
+                data += received
+                continue
+            if data.startswith(b'getinfo:'):
+                sock.sendall(b'xvcServer_v1.0:%d\n' % (self.maxbits // 8))
+                del data[:8]
+                continue
+            if data.startswith(b'settck:'):
+                if len(data) < 11:
+                    data += sock.recv(65536)
+                    continue
+                sock.sendall(data[7:11])
+                del data[:11]
+                continue
+            assert data.startswith(b'shift:'), bytes(data[:10])
+            numbits = int.from_bytes(data[6:10], 'little')
+            numbytes = (numbits + 7) // 8
+            end = 10 + 2 * numbytes
+            while len(data) < end:
+                received = sock.recv(65536)
+                if not received:
+                    return
+                data += received
+            tms = int.from_bytes(data[10:10 + numbytes], 'little')
+            tdi = int.from_bytes(data[10 + numbytes:end], 'little')
+            del data[:end]
+            sock.sendall(clock(tms, tdi, numbits).to_bytes(numbytes, 'little'))
+
+
+@benchmark
+def discover_chain(bench):
+    ''' Chain discovery on the simulated cable, for each FTDI engine.
+    '''
+    for engine in ('strings', 'binary', 'bytes'):
+        yield bench.measure('discover.%s' % engine,
+                            lambda: Chain(sim.Jtagger(sim_config(engine))))
+
+@benchmark
+def bus_reads(bench):
+    ''' Block reads through fpgabus on the simulated cable.
+    '''
+    cable = sim.Jtagger(sim_config('bytes'))
+    busdriver = BusDriver(cable)
+    onebus = OneBus(busdriver, 0, 65536, 4)
+    bus32 = Bus32(Bus32Driver(busdriver, 0))
+    for length in bench.sizes((1, 256, 16384), (1, 256)):
+        yield bench.measure('bus.busdriver.read_%d' % length,
+                            lambda: list(busdriver.readmultiple(0, 0, length, 4)),
+                            units='bytes', count=4 * length)
+        out = bytearray(4 * length)
+        yield bench.measure('bus.busdriver.readinto_%d' % length,
+                            lambda: busdriver.readmultiple(0, 0, length, 4, out),
+                            units='bytes', count=4 * length)
+        yield bench.measure('bus.onebus.read_%d' % length,
+                            lambda: onebus[0:length * 4:4],
+                            units='bytes', count=4 * length)
+        yield bench.measure('bus.bus32.read_%d' % length,
+                            lambda: bus32.read(0, length),
+                            units='bytes', count=4 * length)
+
+@benchmark
+def xvc_shifts(bench):
+    ''' Round trips to an XVC server over loopback.
+    '''
+    server = XvcServer(sim.make_chain(sim_config(None, SIM_MEMORY_SIZE=65536,
+                                                 SIM_IR_LENGTH=6)))
+    for engine in ('bytes', 'ints', 'binary'):
+        config = sim_config(None, CABLE_NAME='127.0.0.1:%d' % server.port,
+                            XVC_TEMPLATE_ENGINE=engine)
+        cable = xvc.Jtagger(config)
+        busdriver = BusDriver(cable)
+        for length in bench.sizes((256, 16384), (256,)):
+            yield bench.measure('xvc.%s.busread_%d' % (engine, length),
+                                lambda: list(busdriver.readmultiple(0, 0, length, 4)),
+                                units='bytes', count=4 * length)
+        # The TAP is left in shift_dr by BusDriver
+        for numfields in bench.sizes((1, 256), (1,)):
+            template = field_template(cable, numfields)
+            data = field_data(numfields)
+            def func():
+                result = template(data)
+                if result is not None:
+                    list(result)
+            yield bench.measure('xvc.%s.fields_%d' % (engine, numfields), func,
+                                number=bench.sizes(100, 10), units='fields', count=numfields)
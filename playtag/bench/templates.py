@@ -0,0 +1,135 @@
+'''
+Benchmarks for template construction, compilation, and application.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import random
+
+from . import benchmark
+from ..jtag.template import JtagTemplate, TDIVariable
+from ..jtag.states import states
+from ..fpga.fpgabus import BusDriver
+from ..iotemplate.stringconvert import TemplateStrings
+from ..iotemplate.intconvert import TemplateInts
+from ..cables.xvc import XvcBinTemplate
+from ..cables.ftdi.mpsse_template import MpsseTemplate, MpsseBinTemplate, MpsseBytesTemplate
+from ..cables.sim import Jtagger as SimJtagger
+from ..cables.sim.mpsse import SimFtdiDevice
+
+engines = (
+    ('strings', TemplateStrings),
+    ('ints', TemplateInts),
+    ('xvc_binary', XvcBinTemplate),
+    ('mpsse_strings', MpsseTemplate),
+    ('mpsse_binary', MpsseBinTemplate),
+    ('mpsse_bytes', MpsseBytesTemplate),
+)
+
+class TemplateBus(BusDriver):
+    ''' A BusDriver that only builds templates; it
+        does not look at the JTAG chain.
+    '''
+    def __init__(self, jtagrw):
+        self.jtagrw = jtagrw
+
+def field_template(cable, numfields, width=32):
+    ''' A template in shift_dr that alternately writes and
+        reads numfields variable fields.
+    '''
+    template = JtagTemplate(cable, 'fields_%d' % numfields, startstate=states.shift_dr)
+    var = TDIVariable()
+    for i in range(numfields):
+        if i & 1:
+            template.readd(width, tdi=var, adv=False)
+        else:
+            template.writed(width, var, adv=False)
+    return template
+
+def bus_template(length, size=4):
+    ''' Return the BusDriver template to read length items.
+        (For long reads, BusDriver wraps the template in a
+        function, so we dig it out of the closure.)
+    '''
+    template = TemplateBus(None)[False, size, length]
+    if not isinstance(template, JtagTemplate):
+        code = template.__code__
+        template = template.__closure__[code.co_freevars.index('cmd')].cell_contents
+    return template
+
+def field_data(numfields, width=32):
+    rnd = random.Random(numfields)
+    return [rnd.getrandbits(width) for i in range(numfields)]
+
+
+class NullDevice(SimFtdiDevice):
+    ''' An FTDI device that discards everything written to it,
+        and reads zeros, to measure host-side overhead only.
+    '''
+    def Write(self, ref, numbytes, countref):
+        countref._obj.value = numbytes
+
+    def Read(self, ref, numbytes, countref):
+        countref._obj.value = numbytes
+
+class NullJtagger(SimJtagger):
+    def device_class(self, config):
+        SimJtagger.device_class(self, config)
+        return NullDevice(config, self.chain)
+
+def sim_config(engine, **kwds):
+    from ..lib.userconfig import UserConfig
+    config = UserConfig()
+    config.CABLE_NAME = 'nexys_video'
+    config.FTDI_TEMPLATE_ENGINE = engine
+    vars(config).update(kwds)
+    return config
+
+
+@benchmark
+def build_templates(bench):
+    ''' Build templates of various sizes.
+    '''
+    for numfields in bench.sizes((16, 256, 4096), (16, 256)):
+        yield bench.measure('build.fields_%d' % numfields,
+                            lambda: field_template(None, numfields),
+                            units='fields', count=numfields)
+    for length in bench.sizes((16, 1024, 16384), (16, 1024)):
+        yield bench.measure('build.busread_%d' % length,
+                            lambda: TemplateBus(None)[False, 4, length],
+                            units='words', count=length)
+
+@benchmark
+def compile_templates(bench):
+    ''' Compile templates with each template engine.
+    '''
+    sizes = bench.sizes((16, 256, 4096), (16, 256))
+    templates = [('fields_%d' % x, field_template(None, x)) for x in sizes]
+    for length in bench.sizes((16, 1024, 16384), (16, 1024)):
+        templates.append(('busread_%d' % length, bus_template(length)))
+    for engine_name, engine in engines:
+        for template_name, template in templates:
+            name = 'compile.%s.%s' % (engine_name, template_name)
+            try:
+                yield bench.measure(name, lambda: engine(template).get_xfer_func(),
+                                    units='clocks', count=len(template))
+            except Exception as exc:
+                yield dict(name=name, seconds=None, error='%s: %s' % (type(exc).__name__, exc))
+
+@benchmark
+def apply_templates(bench):
+    ''' Per-call overhead of applying a compiled template, with
+        a cable that does no I/O, for each FTDI template engine.
+    '''
+    for engine in ('strings', 'binary', 'bytes'):
+        cable = NullJtagger(sim_config(engine))
+        for numfields in bench.sizes((1, 16, 256), (1, 16)):
+            template = field_template(cable, numfields)
+            data = field_data(numfields)
+            def func():
+                result = template(data)
+                if result is not None:
+                    list(result)
+            func()
+            yield bench.measure('apply.%s.fields_%d' % (engine, numfields), func,
+                                number=bench.sizes(200, 20), units='fields', count=numfields)
@@ -32,14 +32,22 @@ LPDWORD = FT.LPDWORD
 CHAR = FT.CHAR
 
 class SysInfo(list):
+    error = None
+
     def __init__(self):
         if FT.loaded:
-            numdevs = DWORD()
-            FT.CreateDeviceInfoList(FT.byref(numdevs))
-            devlist = (FT.DEVICE_LIST_INFO_NODE * (numdevs.value))()
-            FT.GetDeviceInfoList(devlist, numdevs)
-            self[:] = devlist
-            assert len(self) == numdevs.value
+            # Do not exit on import if the driver cannot enumerate
+            # devices (e.g. no USB subsystem); just report no devices.
+            try:
+                numdevs = DWORD()
+                FT.CreateDeviceInfoList(FT.byref(numdevs))
+                devlist = (FT.DEVICE_LIST_INFO_NODE * (numdevs.value))()
+                FT.GetDeviceInfoList(devlist, numdevs)
+            except SystemExit as exc:
+                self.error = str(exc)
+            else:
+                self[:] = devlist
+                assert len(self) == numdevs.value
         self.addstrings()
 
     def addstrings(self):
@@ -58,6 +66,8 @@ class SysInfo(list):
                 result.append('        %s = %s' % (name, repr(str(x))))
         if not result:
             result.append("\nNo devices found" if FT.loaded else "\nCould not find FTDI DLL")
+            if self.error:
+                result.append(self.error)
         result.append('')
         return '\n'.join(result)
 
@@ -101,6 +111,12 @@ class FtdiDefaults(object):
     FTDI_ADAPTIVE_CLOCKING = False
     FTDI_LOOPBACK_TEST = False
     FTDI_DEBUG = False
+    FTDI_TEMPLATE_ENGINE = 'bytes'  # or 'binary' or 'strings'
+    FTDI_PIPELINE_SIZE = 16384  # Bytes per pipelined write; 0 to disable
+    FTDI_COALESCE_WRITES = True # Queue writes until a read is needed
+    FTDI_FLUSH_TIMEOUT = 10     # Milliseconds before queued writes are sent; 0 to disable
+    FTDI_READER_THREAD = False  # Read from the device in a background thread
+    FTDI_READER_BUFFER = 1 << 20    # Size of the reader thread's ring buffer
 
 class FtdiDevice(FT):
     Commands = Commands
@@ -109,6 +125,7 @@ class FtdiDevice(FT):
         config.add_defaults(FtdiDefaults)
         self.debug = config.FTDI_DEBUG and open(config.FTDI_DEBUG, 'wt') or test
         index = self.index = info.find(config.CABLE_NAME)
+        self.hispeed = bool(info[index].Flags & 2)
         self.Open(index, self.byref(self))
         self.init_buffers(config.FTDI_USB_IN_SIZE, config.FTDI_USB_OUT_SIZE)
         self.isopen = True
@@ -150,38 +167,52 @@ class FtdiDevice(FT):
     def set_gpio_mask(self, mask=0):
         self.output_mask = mask
 
-    def write_gpio(self, value=None, wr_gpio=Commands.wr_gpio):
+    def gpio_commands(self, value=None, wr_gpio=Commands.wr_gpio):
+        ''' Return the MPSSE commands to write the GPIO pins.
+        '''
         if value is not None:
             self._current_gpio = value
         else:
             value = self._current_gpio
-        self.writebytes(
+        return bytes((
             wr_gpio[0], value & 0xFF, self.output_mask & 0xFF,
             wr_gpio[1], value >> 8, self.output_mask >> 8,
-        )
+        ))
+
+    def write_gpio(self, value=None):
+        self.writebytes(*self.gpio_commands(value))
 
     def read_gpio(self, rd_gpio=Commands.rd_gpio):
         self.writebytes(rd_gpio[0], rd_gpio[1])
         x = self.readbytes(2)
         return x[0] | (x[1] << 8)
 
-    def setspeed(self, speed=6e6, adaptive=False, loopback=False):
-        hispeed = bool(info[self.index].Flags & 2)
+    def speed_commands(self, speed=6e6, adaptive=False, loopback=False):
+        ''' Return the MPSSE commands to set up the clock.
+        '''
         adaptive = adaptive and Commands.enable_adaptive_clocking or Commands.disable_adaptive_clocking
         loopback = loopback and Commands.loopback_en or Commands.loopback_dis
-        if hispeed:
-            self.writebytes(Commands.disable_clk_div5, Commands.disable_three_phase, adaptive, loopback)
+        cmds = []
+        if self.hispeed:
+            cmds += Commands.disable_clk_div5, Commands.disable_three_phase, adaptive, loopback
             base = 30e6
         else:
             base = 6e6
         div = min(max(int(base / speed - 1), 0), 65535)
-        self.writebytes(Commands.set_divisor, div & 0xFF, div >> 8)
+        cmds += Commands.set_divisor, div & 0xFF, div >> 8
+        return bytes(cmds)
+
+    def setspeed(self, speed=6e6, adaptive=False, loopback=False):
+        self.writebytes(*self.speed_commands(speed, adaptive, loopback))
 
     def writebytes(self, *bytes):
         wbuffer = self.wbuffer
         length = self.wlength
         if bytes:
             newlen = length + len(bytes)
+            if newlen > len(wbuffer):
+                self.flush()
+                length, newlen = 0, len(bytes)
             wbuffer[length:newlen] = bytes
             self.wlength = newlen
             return
@@ -195,6 +226,11 @@ class FtdiDevice(FT):
             raise SystemExit("Expected to write %d bytes; only wrote %d" % (length, transferred.value))
         self.wlength = 0
 
+    def flush(self):
+        ''' Write any bytes buffered by writebytes()
+        '''
+        self.writebytes()
+
     def readintobuffer(self, length, bufinfo, send_immediate=Commands.send_immediate):
         self.writebytes(send_immediate)
         self.writebytes()
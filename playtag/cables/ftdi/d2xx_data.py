@@ -1,7 +1,18 @@
 import itertools
-from ctypes import c_ulonglong, byref
+import contextlib
+import threading
+import atexit
+import bisect
+import sys
+from ctypes import c_ulonglong, c_ubyte, byref
 from .d2xx import FtdiDevice
-from .mpsse_template import MpsseTemplate
+from .mpsse_template import MpsseTemplate, MpsseBinTemplate, MpsseBytesTemplate
+from .mpsse_template import MpsseHiSpeedTemplate, MpsseHiSpeedBinTemplate, MpsseHiSpeedBytesTemplate
+from .mpsse_commands import Commands
+from ...iotemplate.deferred import DeferredTdo
+from ...iotemplate.diskcache import TemplateCache
+from ...lib import instrument
+from .d2xx_reader import RingReader
 import time
 
 '''
@@ -13,56 +24,341 @@ License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.t
 
 def debug_dump(f, title, data, numbytes):
     print(title, end='', file=f)
-    for i in range(numbytes):
-        print('%02x' % ((data[i//8] >> ((i % 8) * 8)) & 0xFF), end='', file=f)
-    print('', file=f)
+    print(bytes(memoryview(data).cast('B')[:numbytes]).hex(), file=f)
 
 class Jtagger(MpsseTemplate.mix_me_in()):
 
+    engines = dict(strings=MpsseTemplate, binary=MpsseBinTemplate, bytes=MpsseBytesTemplate)
+    hispeed_engines = dict(strings=MpsseHiSpeedTemplate, binary=MpsseHiSpeedBinTemplate,
+                           bytes=MpsseHiSpeedBytesTemplate)
+    device_class = FtdiDevice   # Replaced by the simulator cable
+
     def __init__(self, config, maxbits=2**22):
-        driver = FtdiDevice(config)
-        driver.setspeed(15e6)
+        self.driver = driver = self.device_class(config)
+        engines = self.hispeed_engines if driver.hispeed else self.engines
+        engine = engines.get(config.FTDI_TEMPLATE_ENGINE)
+        if engine is None:
+            config.error('Invalid FTDI_TEMPLATE_ENGINE %s; expected one of %s' %
+                         (repr(config.FTDI_TEMPLATE_ENGINE), ', '.join(sorted(self.engines))))
+        self.engine = engine
+        self.template_cache = TemplateCache.from_config(config)
         size = (maxbits + 63) // 64
         source = (size * 2 * c_ulonglong)()  # Both TMS and TDI go here
         dest = (size * c_ulonglong)()
         count = driver.DWORD()
-        self.wparams = driver.Write, len(source) * 64, source, byref(source), count, byref(count), driver.debug
+        write = driver.Write
+        profiler = instrument.from_config(config)
+        if profiler is not None:
+            write = profiler.wrap_io('write', write, lambda args: args[1])
+            self.read_into = profiler.wrap_io('read', self.read_into, lambda args: args[1] - args[0])
+        self.wparams = write, len(source) * 64, source, byref(source), count, byref(count), driver.debug
         self.rparams = driver.Read, len(dest) * 64, dest, byref(dest)
+        self.rbytes = (len(dest) * 8 * c_ubyte).from_buffer(dest)
+        self.wview = memoryview(source).cast('B')
+        self.rview = memoryview(dest).cast('B')
+        self.maxwrite = min(config.FTDI_USB_OUT_SIZE, len(self.wview))
+        self.maxread = min(config.FTDI_USB_IN_SIZE, len(self.rview))
+        self.pipeline_size = config.FTDI_PIPELINE_SIZE
+        self.stream_chunksize = self.maxread    # For jtag.stream
+        self.batching = 0
+        self.pending = bytearray()
+        self.pending_reads = []
+        self.pending_readlen = 0
+        self.pending_boundaries = []
+        self.coalesce = config.FTDI_COALESCE_WRITES
+        self.flush_timeout = config.FTDI_FLUSH_TIMEOUT / 1000.0
+        self.flush_timer = None
+        self.lock = threading.RLock()
+        self.reader = None
+        if config.FTDI_READER_THREAD:
+            self.reader = RingReader(driver.Read, config.FTDI_READER_BUFFER, self.maxread)
+        self.setspeed(15e6)
+        atexit.register(self.close)
+
+    def write_gpio(self, value=None):
+        '''  Write the GPIO pins.  The commands are queued like
+             any other write, so they reach the chip in order
+             with the JTAG commands.
+        '''
+        self.xfer_bytes(self.driver.gpio_commands(value), 0, None)
+
+    def setspeed(self, speed=6e6, adaptive=False, loopback=False):
+        '''  Set the JTAG clock speed, in order with the JTAG commands.
+        '''
+        self.xfer_bytes(self.driver.speed_commands(speed, adaptive, loopback), 0, None)
+
+    def make_template(self, base_template):
+        if self.template_cache is not None:
+            return self.template_cache.compile(self, self.engine, base_template)
+        return self.engine(base_template).get_xfer_func()
+
+    def xfer_buffer(self, source, numbytes, rcvbytes):
+        '''  Passed a ctypes object containing the MPSSE command
+             stream, and the number of bytes to write and read.
+             Returns a byte array containing the read data.
+        '''
+        if not rcvbytes and self.coalesce:
+            self.queue_write(memoryview(source).cast('B')[:numbytes])
+            return
+        with self.lock:
+            if self.pending:
+                self.flush()
+            write, sourcelen, _, _, count, countref, debug = self.wparams
+            if debug:
+                debug_dump(debug, 'xmt', source, numbytes)
+            write(byref(source), numbytes, countref)
+            assert count.value == numbytes
+            if not rcvbytes:
+                return
+            assert rcvbytes * 8 <= self.rparams[1], (rcvbytes, self.rparams[1])
+            self.expect(rcvbytes)
+            self.read_into(0, rcvbytes)
+            return self.rbytes
+
+    @contextlib.contextmanager
+    def batch(self):
+        '''  Context manager for batched template execution.
+             Templates compiled with the bytes engine that are
+             called inside the batch are queued, and their
+             MPSSE command streams are sent together with as
+             few USB transfers as the buffer sizes allow.
+             Templates that read TDO return DeferredTdo objects,
+             which flush the queue if used before the batch ends.
+             Batches may be nested; the queue is flushed when
+             the outermost batch ends.
+        '''
+        with self.lock:
+            self.batching += 1
+            try:
+                yield self
+            finally:
+                self.batching -= 1
+                if not self.batching:
+                    self.flush()
+
+    def flush(self, send_immediate=Commands.send_immediate):
+        '''  Send all queued commands, and resolve all
+             the DeferredTdo objects for them.
+        '''
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            cmds, readlen, reads = self.pending, self.pending_readlen, self.pending_reads
+            if not cmds:
+                return
+            boundaries = self.pending_boundaries
+            self.pending = bytearray()
+            self.pending_readlen = 0
+            self.pending_reads = []
+            self.pending_boundaries = []
+            if readlen:
+                cmds.append(send_immediate)
+            data = self.xfer_bytes_now(cmds, readlen, boundaries)
+            for start, end, decode, result in reads:
+                result.resolve(decode(data[start:end]))
+
+    def queue_write(self, cmds, boundaries=()):
+        '''  Add a command stream that does not read anything
+             to the queue.  It will be sent when data must be
+             read, when the queue fills up, when flush() is
+             called, or when FTDI_FLUSH_TIMEOUT expires.
+        '''
+        with self.lock:
+            self.queue_bytes(cmds, 0, None, boundaries)
+            if self.flush_timeout and self.flush_timer is None and not self.batching:
+                self.flush_timer = timer = threading.Timer(self.flush_timeout, self.flush)
+                timer.daemon = True
+                timer.start()
+
+    def queue_bytes(self, cmds, rcvbytes, decode, boundaries, send_immediate=Commands.send_immediate):
+        '''  Add an MPSSE command stream to the queue.
+        '''
+        if rcvbytes and cmds[-1] == send_immediate:
+            cmds = memoryview(cmds)[:-1]
+        if (len(self.pending) + len(cmds) >= self.maxwrite or
+                self.pending_readlen + rcvbytes > self.maxread):
+            self.flush()
+        offset = len(self.pending)
+        start = self.pending_readlen
+        self.pending += cmds
+        self.pending_readlen = end = start + rcvbytes
+        if len(cmds) > self.pipeline_size:
+            self.pending_boundaries.extend((x + offset, y + start) for (x, y) in boundaries)
+        self.pending_boundaries.append((len(self.pending), end))
+        if decode is not None:
+            result = DeferredTdo(self.flush)
+            self.pending_reads.append((start, end, decode, result))
+            return result
+
+    def xfer_bytes(self, cmds, rcvbytes, decode, boundaries=()):
+        '''  Passed the MPSSE command stream as bytes, the number
+             of bytes to read, a function to decode the read
+             data (or None if no TDO data is required), and
+             a list of (cmd_offset, read_offset) command boundaries.
+             Returns the decoded data, or a DeferredTdo object
+             if batching.
+        '''
+        if not rcvbytes and self.coalesce and not self.batching:
+            return self.queue_write(cmds, boundaries)
+        with self.lock:
+            if self.batching:
+                return self.queue_bytes(cmds, rcvbytes, decode, boundaries)
+            if self.pending:
+                # Send the queued writes along with this read
+                result = self.queue_bytes(cmds, rcvbytes, decode, boundaries)
+                self.flush()
+                if result is not None:
+                    return result.get_result()
+            data = self.xfer_bytes_now(cmds, rcvbytes, boundaries)
+            if decode is not None:
+                return decode(data)
+
+    def xfer_bytes_now(self, cmds, rcvbytes, boundaries=()):
+        '''  Passed the MPSSE command stream as bytes, the number
+             of bytes to read, and the command boundaries.
+             Returns a memoryview of the read data.
+        '''
+        numbytes = len(cmds)
+        if not numbytes:
+            return
+        if boundaries and numbytes > self.pipeline_size > 0:
+            return self.xfer_pipelined(cmds, rcvbytes, boundaries)
+        write, sourcelen, _, sourceref, count, countref, debug = self.wparams
+        assert numbytes * 8 <= sourcelen, (numbytes, sourcelen)
+        self.wview[:numbytes] = cmds
+        if debug:
+            debug_dump(debug, 'xmt', cmds, numbytes)
+        write(sourceref, numbytes, countref)
+        assert count.value == numbytes
+        if not rcvbytes:
+            return
+        assert rcvbytes * 8 <= self.rparams[1], (rcvbytes, self.rparams[1])
+        self.expect(rcvbytes)
+        self.read_into(0, rcvbytes)
+        return self.rview[:rcvbytes]
+
+    def split_chunks(self, numbytes, rcvbytes, boundaries,
+                     bisect=bisect.bisect_right, maxsize=sys.maxsize):
+        '''  Split a command stream at command boundaries into
+             chunks of about pipeline_size bytes.  Yields
+             (start, end, read_start, read_end) for each chunk.
+        '''
+        chunksize = self.pipeline_size
+        last = boundaries[-1][0]
+        start = readstart = 0
+        while start < numbytes:
+            index = bisect(boundaries, (start + chunksize, maxsize))
+            if index and boundaries[index - 1][0] > start:
+                end, readend = boundaries[index - 1]
+            else:
+                end, readend = boundaries[index]   # Single command bigger than chunksize
+            if end >= last:
+                end, readend = numbytes, rcvbytes
+            yield start, end, readstart, readend
+            start, readstart = end, readend
+
+    def xfer_pipelined(self, cmds, rcvbytes, boundaries, send_immediate=Commands.send_immediate):
+        '''  Transfer a long command stream in chunks.  Each chunk
+             is written before the data for the previous chunk is
+             read, so that the FTDI chip always has commands queued
+             while we are waiting on the read.  Data is read into
+             the receive buffer in order.  (FT_Write does not return
+             until the driver has the data, so the write buffer can
+             be reused for the next chunk.)
+        '''
+        write, sourcelen, _, sourceref, count, countref, debug = self.wparams
+        read, destlen, dest, destref = self.rparams
+        assert rcvbytes * 8 <= destlen, (rcvbytes, destlen)
+        wview = self.wview
+        previous = None
+        for start, end, readstart, readend in self.split_chunks(len(cmds), rcvbytes, boundaries):
+            numbytes = end - start
+            wview[:numbytes] = cmds[start:end]
+            if readend > readstart and end < len(cmds):
+                wview[numbytes] = send_immediate
+                numbytes += 1
+            if debug:
+                debug_dump(debug, 'xmt', wview, numbytes)
+            write(sourceref, numbytes, countref)
+            assert count.value == numbytes
+            if readend > readstart:
+                self.expect(readend - readstart)
+            if previous is not None:
+                self.read_into(*previous)
+                previous = None
+            if readend > readstart:
+                previous = readstart, readend
+        if previous is not None:
+            self.read_into(*previous)
+        return self.rview[:rcvbytes]
+
+    def expect(self, numbytes):
+        '''  Called after writing commands that will return
+             numbytes, so that the reader thread (if any)
+             can start reading them.
+        '''
+        if self.reader is not None:
+            self.reader.expect(numbytes)
 
-    def __call__(self, sendstr, numbits, rcvlen, formatter = '{0:064b}'.format,
+    def read_into(self, start, end):
+        '''  Read data into the receive buffer at the given location.
+        '''
+        _, _, _, _, count, countref, debug = self.wparams
+        numbytes = end - start
+        if self.reader is not None:
+            self.reader.read_into(self.rview[start:end])
+        else:
+            read, destlen, dest, destref = self.rparams
+            read(byref((c_ubyte * numbytes).from_buffer(dest, start)), numbytes, countref)
+            assert count.value == numbytes
+        if debug:
+            debug_dump(debug, 'rcv', self.rview[start:end], numbytes)
+
+    def close(self):
+        '''  Send any queued commands, and stop the reader thread.
+        '''
+        self.flush()
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader = None
+
+    def __call__(self, sendstr, numbits, rcvlen,
                           int=int, len=len, join=''.join, tee=itertools.tee,
                           chain=itertools.chain, zip=zip, xrange=range):
-        '''  Passed tms/tdi info.  Returns tdo.
-             All these are strings of '0' and '1'.
+        '''  Passed the command stream as strings of '0' and '1'.
              First bit sent is the last bit in the string...
+             Returns a memoryview of the rcvlen bits read back,
+             which is only valid until the next transfer.
         '''
         if not numbits:
             return
         sendstr = join(sendstr)
         assert len(sendstr) == numbits
-        write, sourcelen, source, sourceref, count, countref, debug = self.wparams
         assert not numbits & 7
         numbytes = (numbits + 7) // 8
-        numints = (numbytes + 7) // 8
-        start, stop = tee(xrange(numbits - 64, 0, -64))
-        slices = zip(chain(start, (None,)), chain((None,), stop))
-        source[:numints] = [int(sendstr[x:y],2) for x,y in slices]
-        if debug:
-            debug_dump(debug, 'xmt', source, numbytes)
-        write(sourceref, numbytes, countref)
-        assert count.value == numbytes
-        if not rcvlen:
+        if not rcvlen and self.coalesce:
+            self.queue_write(int(sendstr, 2).to_bytes(numbytes, 'little'))
             return
-        numbits = rcvlen
-        assert not numbits & 7
-        read, destlen, dest, destref = self.rparams
-        assert numbits <= destlen, (numbits, destlen)
-        numbytes = (numbits + 7) // 8
-        numints = (numbytes + 7) // 8
-        read(destref, numbytes, countref)
-        if debug:
-            debug_dump(debug, 'rcv', dest, numbytes)
-        assert count.value == numbytes
-        allbits = [formatter(x) for x in reversed(dest[:numints])]
-        allbits[0] = allbits[0][numints * 64 - numbits:]
-        return allbits
+        with self.lock:
+            if self.pending:
+                self.flush()
+            write, sourcelen, source, sourceref, count, countref, debug = self.wparams
+            numints = (numbytes + 7) // 8
+            start, stop = tee(xrange(numbits - 64, 0, -64))
+            slices = zip(chain(start, (None,)), chain((None,), stop))
+            source[:numints] = [int(sendstr[x:y],2) for x,y in slices]
+            if debug:
+                debug_dump(debug, 'xmt', source, numbytes)
+            write(sourceref, numbytes, countref)
+            assert count.value == numbytes
+            if not rcvlen:
+                return
+            numbits = rcvlen
+            assert not numbits & 7
+            read, destlen, dest, destref = self.rparams
+            assert numbits <= destlen, (numbits, destlen)
+            numbytes = numbits // 8
+            self.expect(numbytes)
+            self.read_into(0, numbytes)
+            return self.rview[:numbytes]
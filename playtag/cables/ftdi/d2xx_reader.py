@@ -0,0 +1,113 @@
+'''
+Background reader for the FTDI D2XX driver.
+
+Normally, the Jtagger reads the reply to a command stream with a
+blocking FT_Read of exactly the expected size, after it has written
+the commands.  When FTDI_READER_THREAD is set, a RingReader thread
+is used instead.  The Jtagger tells the reader how many bytes to
+expect as soon as it has written the commands, and the thread drains
+the device into a ring buffer while Python gets on with something
+else (such as writing the next chunk of a pipelined transfer).
+Consumers wait until enough bytes are available, and copy them out.
+
+The thread spends its time in FT_Read, which is a ctypes call and
+so does not hold the GIL.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import threading
+from ctypes import c_ubyte, c_uint, byref
+
+
+class RingReader(object):
+    ''' Reads expected data from the device into a ring buffer.
+
+        All counts are totals since the reader was created:
+
+            requested -- bytes the device has been asked for
+            received -- bytes read into the ring
+            consumed -- bytes copied out of the ring
+    '''
+
+    def __init__(self, read, size=1 << 20, chunksize=65536):
+        self.read = read
+        self.size = size
+        self.chunksize = chunksize
+        self.ring = (c_ubyte * size)()
+        self.view = memoryview(self.ring).cast('B')
+        self.requested = self.received = self.consumed = 0
+        self.error = None
+        self.running = True
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name='ftdi-reader', daemon=True)
+        self.thread.start()
+
+    def expect(self, numbytes):
+        ''' Tell the reader that commands have been written
+            that will return numbytes from the device.
+        '''
+        with self.condition:
+            self.requested += numbytes
+            self.condition.notify_all()
+
+    def run(self):
+        condition = self.condition
+        size = self.size
+        count = c_uint()
+        countref = byref(count)
+        while True:
+            with condition:
+                while self.running and (self.requested == self.received or
+                                        self.received - self.consumed == size):
+                    condition.wait()
+                if not self.running:
+                    return
+                start = self.received % size
+                numbytes = min(self.requested - self.received, self.chunksize,
+                               size - start, size - (self.received - self.consumed))
+            dest = (c_ubyte * numbytes).from_buffer(self.ring, start)
+            try:
+                self.read(byref(dest), numbytes, countref)
+            except BaseException as exc:
+                with condition:
+                    self.error = exc
+                    self.running = False
+                    condition.notify_all()
+                return
+            with condition:
+                self.received += count.value
+                condition.notify_all()
+
+    def read_into(self, dest):
+        ''' Wait for len(dest) bytes, and copy them into dest.
+            The data is copied as it arrives, so dest may be
+            bigger than the ring.
+        '''
+        condition = self.condition
+        view = self.view
+        size = self.size
+        offset = 0
+        total = len(dest)
+        while offset < total:
+            with condition:
+                while self.received == self.consumed:
+                    if self.error is not None:
+                        raise SystemExit('FTDI reader failed: %s' % self.error)
+                    if not self.running:
+                        raise SystemExit('FTDI reader stopped with %d bytes still expected' %
+                                         (total - offset))
+                    condition.wait()
+                start = self.consumed % size
+                numbytes = min(self.received - self.consumed, total - offset, size - start)
+            dest[offset:offset + numbytes] = view[start:start + numbytes]
+            offset += numbytes
+            with condition:
+                self.consumed += numbytes
+                condition.notify_all()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
@@ -48,5 +48,9 @@ class Commands(object):
     disable_three_phase = HexByte(0x8d)
     disable_adaptive_clocking = HexByte(0x97)
 
+    # Clock without data transfer; only on the high speed parts
+    clock_bits = HexByte(0x8e)
+    clock_bytes = HexByte(0x8f)
+
 if __name__ == '__main__':
     print([(x, getattr(Commands, x)) for x in dir(Commands) if not x.startswith('_')])
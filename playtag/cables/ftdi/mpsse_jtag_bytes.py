@@ -0,0 +1,406 @@
+'''
+This module contains code to map JTAG TMS/TDI/TDO template integers into
+FTDI MPSSE commands.
+
+This module emits the MPSSE command stream directly into a bytearray
+when the template is compiled.  It also records where variable TDI
+data must be spliced into the command stream, and where TDO data
+will be found in the bytes read back from the device, so that
+applying a template is just a few buffer writes and a single FT_Write.
+(mpsse_jtag_commands uses this module, and converts the result into
+strings for the string-based template engines.)
+
+The commands are chosen by a shortest path search (see Scheduler),
+to minimize the number of bytes sent to and received from the device.
+
+All integers have the first bit in time in the least significant bit.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import re
+import heapq
+import bisect
+
+from .mpsse_commands import Commands
+
+
+def bitmask(offset, numbits):
+    return ((1 << numbits) - 1) << offset
+
+
+class MpsseCommandStream(object):
+    ''' Builds an MPSSE command stream.  After building:
+
+            cmds -- bytearray with all the constant command data
+            patches -- list of (start, end, offset, numbits) for
+                       data fields that have variable TDI bits.
+                       cmds[start:end] must be replaced with numbits
+                       of TDI data starting at TDI bit offset.
+            tms_patches -- list of (index, offset) for TMS commands
+                           that send a variable TDI bit.  Bit 7 of
+                           cmds[index] must be set to TDI bit offset.
+            reads -- list of (start, end, shift, offset, numbits) for
+                     each command that reads TDO data.  The read data
+                     is found by shifting right the bytes at
+                     [start:end] in the read buffer, and goes to
+                     TDO bit offset.
+            readlen -- number of bytes the device will return
+            boundaries -- list of (cmd_offset, read_offset) at the
+                          end of every command, so that the command
+                          stream can be split into chunks for
+                          pipelined transfers
+    '''
+    inputs = 'numbits', 'tms', 'tdi', 'tdi_var', 'tdi_dontcare', 'tdo_mask'
+
+    def __init__(self, numbits, tms, tdi, tdi_var, tdi_dontcare, tdo_mask):
+        self.numbits = numbits
+        self.tms = tms
+        self.tdi = tdi
+        self.tdi_var = tdi_var
+        self.tdi_dontcare = tdi_dontcare
+        self.tdo_mask = tdo_mask
+        self.tdi_write = bitmask(0, numbits) & ~tdi_dontcare
+        self.cmds = bytearray()
+        self.patches = []
+        self.tms_patches = []
+        self.reads = []
+        self.readlen = 0
+        self.boundaries = []
+
+    def add_boundary(self):
+        self.boundaries.append((len(self.cmds), self.readlen))
+
+    def add_read(self, numbytes, shift, offset, numbits):
+        start = self.readlen
+        self.readlen = end = start + numbytes
+        self.reads.append((start, end, shift, offset, numbits))
+
+    def add_data(self, offset, numbits):
+        ''' Add the TDI data for a data command.
+        '''
+        cmds = self.cmds
+        start = len(cmds)
+        numbytes = (numbits + 7) // 8
+        cmds += (self.tdi >> offset & bitmask(0, numbits)).to_bytes(numbytes, 'little')
+        if self.tdi_var & bitmask(offset, numbits):
+            self.patches.append((start, start + numbytes, offset, numbits))
+
+    def data(self, offset, numbits):
+        ''' Add data commands for numbits of data with TMS low.
+        '''
+        mask = bitmask(offset, numbits)
+        read = self.tdo_mask & mask
+        write = self.tdi_write & mask
+        if not read:
+            write = mask   # Need a command that does something
+            cmd_bytes, cmd_bits = Commands.tdi_wr, Commands.tdi_wr_bits
+        elif not write:
+            cmd_bytes, cmd_bits = Commands.tdo_rd, Commands.tdo_rd_bits
+        else:
+            cmd_bytes, cmd_bits = Commands.tdi_tdo, Commands.tdi_tdo_bits
+        cmds = self.cmds
+        numbytes, numbits = divmod(numbits, 8)
+        if numbytes == 1 and not numbits:
+            numbytes, numbits = 0, 8  # Shorter command in bit mode
+        while numbytes:
+            chunk = min(numbytes, 65536)
+            cmds.append(cmd_bytes)
+            cmds += (chunk - 1).to_bytes(2, 'little')
+            if write:
+                self.add_data(offset, chunk * 8)
+            if read:
+                self.add_read(chunk, 0, offset, chunk * 8)
+            self.add_boundary()
+            offset += chunk * 8
+            numbytes -= chunk
+        if numbits:
+            cmds.append(cmd_bits)
+            cmds.append(numbits - 1)
+            if write:
+                self.add_data(offset, numbits)
+            if read:
+                self.add_read(1, 8 - numbits, offset, numbits)
+            self.add_boundary()
+
+    def clocks(self, offset, numbits):
+        ''' Add clock-only commands for numbits, with the
+            TMS and TDI pins unchanged and no data read.
+        '''
+        cmds = self.cmds
+        numbytes, numbits = divmod(numbits, 8)
+        if numbytes == 1 and not numbits:
+            numbytes, numbits = 0, 8  # Shorter command in bit mode
+        while numbytes:
+            chunk = min(numbytes, 65536)
+            cmds.append(Commands.clock_bytes)
+            cmds += (chunk - 1).to_bytes(2, 'little')
+            self.add_boundary()
+            numbytes -= chunk
+        if numbits:
+            cmds.append(Commands.clock_bits)
+            cmds.append(numbits - 1)
+            self.add_boundary()
+
+    def tms_cmd(self, offset, numbits, tdi_value):
+        ''' Add a TMS command for numbits starting at offset.
+        '''
+        cmds = self.cmds
+        mask = bitmask(offset, numbits)
+        cmds.append(Commands.tms_rd_bits if self.tdo_mask & mask else Commands.tms_wr_bits)
+        cmds.append(numbits - 1)
+        value = self.tms >> offset & bitmask(0, numbits)
+        if tdi_value is not None:
+            tdi_offset, tdi_bit = tdi_value
+            if tdi_offset is not None:
+                self.tms_patches.append((len(cmds), tdi_offset))
+            elif tdi_bit:
+                value |= 0x80
+        cmds.append(value)
+        if self.tdo_mask & mask:
+            self.add_read(1, 8 - numbits, offset, numbits)
+        self.add_boundary()
+
+
+def bit_runs(value, numbits):
+    ''' Return a list of the starts and a list of the
+        ends of all the runs of one bits in value.
+    '''
+    starts, ends = [], []
+    for match in re.finditer('1+', format(value, '0%db' % numbits)[::-1]):
+        starts.append(match.start())
+        ends.append(match.end())
+    return starts, ends
+
+def any_bits(runs, start, end, bisect=bisect.bisect_right):
+    ''' Return True if any bits in [start, end) are set,
+        given the runs from bit_runs.
+    '''
+    starts, ends = runs
+    index = bisect(ends, start)
+    return index < len(starts) and starts[index] < end
+
+def next_bit(runs, offset, numbits, bisect=bisect.bisect_right):
+    ''' Return the position of the first set bit at or
+        after offset (numbits if there are none),
+        given the runs from bit_runs.
+    '''
+    starts, ends = runs
+    index = bisect(ends, offset)
+    if index == len(starts):
+        return numbits
+    return max(starts[index], offset)
+
+def next_zero(runs, offset, bisect=bisect.bisect_right):
+    ''' Return the position of the first clear bit at or
+        after offset, given the runs from bit_runs.
+    '''
+    starts, ends = runs
+    index = bisect(ends, offset)
+    if index < len(starts) and starts[index] <= offset:
+        return ends[index]
+    return offset
+
+
+class Scheduler(object):
+    ''' Finds the cheapest sequence of commands for a stream.
+
+        The cost of a command is the number of bytes it writes
+        to and reads from the device, and ties are broken by
+        the number of commands.
+
+        This is a shortest path search over (offset, tms_pin),
+        where tms_pin is the state of the TMS pin before the bit
+        at offset (it must be low for data commands).  All commands
+        move forward, so positions are simply finished in order.
+        Only positions that might start a useful command are ever
+        visited, so the middle of a long data run costs nothing.
+
+        The template data is looked up from bytes and from lists
+        of runs, because shifting big integers around for every
+        position would make long templates quadratic.
+
+        If clock_only is set, the clock-only commands of the high
+        speed parts are used where TMS does not change and
+        there is no TDI or TDO data (e.g. waiting in run/idle).
+    '''
+
+    # Data commands are only split where the read/write pattern
+    # stays the same for at least this many bits on one side,
+    # which is about where the bytes saved can pay for the extra
+    # command headers.
+    min_split = 48
+
+    def __init__(self, stream, clock_only=False):
+        self.stream = stream
+        self.clock_only = clock_only
+        numbits = self.numbits = stream.numbits
+        numbytes = (numbits + 7) // 8 + 1
+        self.tms = stream.tms.to_bytes(numbytes, 'little')
+        self.tdi = stream.tdi.to_bytes(numbytes, 'little')
+        self.tdi_var = stream.tdi_var.to_bytes(numbytes, 'little')
+        self.tdi_dontcare = (stream.tdi_dontcare & bitmask(0, numbits)).to_bytes(numbytes, 'little')
+        self.tms_runs = bit_runs(stream.tms, numbits)
+        self.write_runs = bit_runs(stream.tdi_write, numbits)
+        self.read_runs = bit_runs(stream.tdo_mask, numbits)
+        edges = sorted(set(self.write_runs[0] + self.write_runs[1] +
+                           self.read_runs[0] + self.read_runs[1] + [0, numbits]))
+        min_split = self.min_split
+        self.edges = [y for (x, y, z) in zip(edges, edges[1:], edges[2:])
+                      if y - x >= min_split or z - y >= min_split]
+
+    def window(self, data, offset, from_bytes=int.from_bytes):
+        ''' Return 7 bits of data starting at offset.
+        '''
+        index = offset >> 3
+        return from_bytes(data[index:index + 2], 'little') >> (offset & 7) & 0x7f
+
+    def clocks_end(self, offset, pin):
+        ''' Return where a clock-only command starting at offset
+            must end, because TMS changes from the pin value, or
+            there is TDI or TDO data.
+        '''
+        numbits = self.numbits
+        if pin:
+            end = next_zero(self.tms_runs, offset)
+        else:
+            end = next_bit(self.tms_runs, offset, numbits)
+        end = min(end, next_bit(self.write_runs, offset, numbits))
+        return min(end, next_bit(self.read_runs, offset, numbits))
+
+    def clocks_cost(self, numbits):
+        ''' Return the number of bytes written by the
+            clock-only commands for numbits.
+        '''
+        numbytes, numbits = divmod(numbits, 8)
+        if numbytes == 1 and not numbits:
+            numbytes, numbits = 0, 8
+        return (numbytes + 65535) // 65536 * 3 + (numbits and 2)
+
+    def data_cost(self, offset, numbits):
+        ''' Return the number of bytes written and read by the
+            data commands for numbits of data with TMS low.
+        '''
+        end = offset + numbits
+        payload = any_bits(self.write_runs, offset, end) + any_bits(self.read_runs, offset, end) or 1
+        numbytes, numbits = divmod(numbits, 8)
+        if numbytes == 1 and not numbits:
+            numbytes, numbits = 0, 8
+        cost = numbytes * payload + (numbytes + 65535) // 65536 * 3
+        if numbits:
+            cost += 2 + payload
+        return cost
+
+    def data_stops(self, offset, end):
+        ''' Return the places where a data command starting at
+            offset might usefully stop, given that TMS is low
+            until end.  These are near the end (to leave a few bits
+            for a following TMS command), and near the next place
+            where the data changes between read/write/both (to
+            avoid sending or receiving bytes that are not needed).
+        '''
+        stops = set(range(max(end - 7, offset + 1), end + 1))
+        edges = self.edges
+        index = bisect.bisect_right(edges, offset)
+        if index < len(edges) and edges[index] < end:
+            edge = edges[index]
+            align = (edge - offset) % 8
+            stops.update(x for x in (edge, edge - align, edge - align + 8) if offset < x < end)
+        return stops
+
+    def tms_choices(self, offset):
+        ''' Yield (numbits, tms, tdi_value) for each TMS command
+            that could start at offset.  TMS commands can send up
+            to 7 bits, but only with a single TDI value, which is
+            (offset, None) for a variable bit, (None, bit) for
+            a constant bit, or None if TDI is don't care.
+        '''
+        window = self.window
+        tms = window(self.tms, offset)
+        tdi = window(self.tdi, offset)
+        tdi_var = window(self.tdi_var, offset)
+        tdi_dontcare = window(self.tdi_dontcare, offset)
+        tdi_value = None
+        for index in range(min(7, self.numbits - offset)):
+            bit = 1 << index
+            if tdi_var & bit:
+                if tdi_value is not None:
+                    return
+                tdi_value = offset + index, None
+            elif not tdi_dontcare & bit:
+                value = None, bool(tdi & bit)
+                if tdi_value is None:
+                    tdi_value = value
+                elif tdi_value != value:
+                    return
+            yield index + 1, tms & (bit * 2 - 1), tdi_value
+
+    def __call__(self, heappush=heapq.heappush, heappop=heapq.heappop):
+        ''' Return a list of (method, args) that will add
+            the commands to the stream.
+        '''
+        stream = self.stream
+        numbits = self.numbits
+        tms_runs = self.tms_runs
+        read_runs = self.read_runs
+        clock_only = self.clock_only
+        best = {(0, 0): ((0, 0), None, None)}
+        pending = [(0, 0)]
+
+        def add(key, cost, prev, step):
+            old = best.get(key)
+            if old is None:
+                heappush(pending, key)
+            elif old[0] <= cost:
+                return
+            best[key] = cost, prev, step
+
+        while pending:
+            key = heappop(pending)
+            offset, pin = key
+            if offset == numbits:
+                continue
+            numbytes, numcmds = best[key][0]
+            numcmds += 1
+            if not pin:
+                end = next_bit(tms_runs, offset, numbits)
+                if end > offset:
+                    for stop in self.data_stops(offset, end):
+                        cost = numbytes + self.data_cost(offset, stop - offset), numcmds
+                        add((stop, 0), cost, key, (stream.data, (offset, stop - offset)))
+            if clock_only:
+                end = self.clocks_end(offset, pin)
+                for stop in range(max(end - 7, offset + 1), end + 1):
+                    cost = numbytes + self.clocks_cost(stop - offset), numcmds
+                    add((stop, pin), cost, key, (stream.clocks, (offset, stop - offset)))
+            for length, tms, tdi_value in self.tms_choices(offset):
+                if tms or pin:   # Otherwise, a data command is as good
+                    stop = offset + length
+                    cost = numbytes + 3 + any_bits(read_runs, offset, stop), numcmds
+                    add((stop, tms >> (length - 1)), cost, key,
+                        (stream.tms_cmd, (offset, length, tdi_value)))
+
+        key = min((x for x in best if x[0] == numbits), key=lambda x: best[x][0])
+        steps = []
+        while True:
+            cost, key, step = best[key]
+            if step is None:
+                break
+            steps.append(step)
+        steps.reverse()
+        return steps
+
+
+def mpsse_jtag_bytes(numbits, tms, tdi, tdi_var, tdi_dontcare, tdo_mask, clock_only=False,
+                     stream=MpsseCommandStream):
+    ''' Return an MpsseCommandStream object for the given data.
+        The TMS pin is assumed to be low at the start.
+        clock_only enables the clock-only commands, which
+        are only available on the high speed parts.
+    '''
+    stream = stream(numbits, tms, tdi, tdi_var, tdi_dontcare, tdo_mask)
+    for method, args in Scheduler(stream, clock_only)():
+        method(*args)
+    if stream.readlen:
+        stream.cmds.append(Commands.send_immediate)
+    return stream
@@ -5,25 +5,166 @@ FTDI MPSSE commands.
 Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
 License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
 '''
+import re
+
 from .mpsse_jtag_commands import mpsse_jtag_commands
+from .mpsse_jtag_bytes import mpsse_jtag_bytes, bitmask, MpsseCommandStream
 from ...iotemplate.stringconvert import TemplateStrings
+from ...iotemplate.binconvert import BinTemplate
+from ...iotemplate import codegen
+from ...iotemplate.intconvert import TemplateInts, field_mask, TdoFields, read_converter
 
 class MpsseTemplate(TemplateStrings):
 
+    clock_only = False  # Set for the high speed parts
+
+    def get_tdo_extractor(self):
+        ''' The driver returns a memoryview of the bytes it read,
+            rather than strings.  Build a plan from the 'x' runs
+            in the TDO string (which is reversed, so the first bit
+            read is at the end), and use it to pull the TDO data
+            directly out of the read buffer.
+        '''
+        reads = []
+        offset = 0
+        for match in re.finditer('x+', self.tdo_xstring[::-1]):
+            start, end = match.span()
+            numbits = end - start
+            reads.append((start >> 3, (end + 7) >> 3, start & 7, offset, numbits))
+            offset += numbits
+        converter = read_converter(reads)
+        tdo_fields = TdoFields(self.tdo_bits)
+        return lambda data: tdo_fields(converter(data))
+
     def get_xfer_func(self):
-        info = mpsse_jtag_commands(self.tms_string, self.tdi_xstring, self.tdo_xstring)
+        info = mpsse_jtag_commands(self.tms_string, self.tdi_xstring, self.tdo_xstring, self.clock_only)
         self.tdi_xstring, self.tdo_xstring = info
         tditostr = self.get_tdi_combiner()
         tdo_length = len(self.tdo_xstring)
         tdi_length = len(self.tdi_xstring)
 
         if self.tdo_bits:
-            tdofromstr = self.get_tdo_extractor()
+            tdo_extractor = self.get_tdo_extractor()
             def func(driver, tdi_array):
-                tdostr = driver(tditostr(tdi_array), tdi_length, tdo_length)
-                return tdofromstr(tdostr)
+                return tdo_extractor(driver(tditostr(tdi_array), tdi_length, tdo_length))
         else:
             def func(driver, tdi_array):
                 driver(tditostr(tdi_array), tdi_length, tdo_length)
         vars(self).clear()
         return func
+
+class MpsseBytesTemplate(TemplateInts):
+    ''' Maps JTAG integers directly into an MPSSE command
+        byte stream, with a list of places to splice in
+        variable TDI data, and a list of places to find
+        TDO data in the bytes read back from the device.
+    '''
+    cache_version = 2
+    clock_only = False  # Set for the high speed parts
+
+    def get_cache_state(self):
+        ''' Include the MPSSE command stream in the cached data.
+            The stream's input integers are not needed after
+            it is built, so they are not saved.
+        '''
+        commands = self.get_commands()
+        for name in MpsseCommandStream.inputs:
+            delattr(commands, name)
+        state = TemplateInts.get_cache_state(self)
+        state['commands'] = commands
+        return state
+
+    def get_commands(self):
+        commands = vars(self).pop('commands', None)
+        if commands is not None:
+            return commands
+        return mpsse_jtag_bytes(self.transaction_bit_length, self.tms, self.tdi_const,
+                                field_mask(self.tdi_splice), self.tdi_dontcare,
+                                field_mask(self.tdo_gather), self.clock_only)
+
+    def get_cmd_builder(self, commands, bytearray=bytearray, from_bytes=int.from_bytes):
+        ''' Return a function that takes the TDI integer from the
+            combiner and returns the MPSSE command stream.
+        '''
+        template = bytes(commands.cmds)
+        numbytes = (self.transaction_bit_length + 7) // 8 + 1
+        patches = [(start, end, offset >> 3, (offset + numbits + 7) // 8, offset & 7, bitmask(0, numbits))
+                       for (start, end, offset, numbits) in commands.patches]
+        tms_patches = [(index, offset >> 3, offset & 7) for (index, offset) in commands.tms_patches]
+        if not patches and not tms_patches:
+            return lambda tdi: template
+        if len(patches) + len(tms_patches) <= codegen.maxterms:
+            lines = [
+                'def cmd_builder(tdi, bytearray=bytearray, from_bytes=from_bytes):',
+                "    tdi = tdi.to_bytes(%d, 'little')" % numbytes,
+                '    cmds = bytearray(template)',
+            ]
+            for start, end, first, last, shift, mask in patches:
+                if end == start + 1 and last == first + 1:
+                    lines.append('    cmds[%d] = tdi[%d] >> %d & %#x' % (start, first, shift, mask))
+                else:
+                    lines.append("    cmds[%d:%d] = (from_bytes(tdi[%d:%d], 'little') >> %d & %#x).to_bytes(%d, 'little')" %
+                                 (start, end, first, last, shift, mask, end - start))
+            for index, byte, shift in tms_patches:
+                lines.append('    cmds[%d] |= (tdi[%d] >> %d & 1) << 7' % (index, byte, shift))
+            lines.append('    return cmds')
+            return codegen.make_function('cmd_builder', lines, dict(template=template, from_bytes=from_bytes))
+
+        def cmd_builder(tdi):
+            tdi = tdi.to_bytes(numbytes, 'little')
+            cmds = bytearray(template)
+            for start, end, first, last, shift, mask in patches:
+                cmds[start:end] = (from_bytes(tdi[first:last], 'little') >> shift & mask).to_bytes(end - start, 'little')
+            for index, byte, shift in tms_patches:
+                cmds[index] |= (tdi[byte] >> shift & 1) << 7
+            return cmds
+        return cmd_builder
+
+    def get_read_converter(self, commands):
+        ''' Return a function that takes the bytes read from the
+            device and returns a TDO integer, for the extractor.
+        '''
+        return read_converter(commands.reads)
+
+    def get_xfer_func(self):
+        commands = self.get_commands()
+        tdi_combiner = self.get_tdi_combiner()
+        cmd_builder = self.get_cmd_builder(commands)
+        readlen = commands.readlen
+        boundaries = commands.boundaries
+
+        if self.tdo_bits:
+            tdo_extractor = self.get_tdo_extractor()
+            read_converter = self.get_read_converter(commands)
+            def decode(data):
+                return tdo_extractor(read_converter(data))
+        else:
+            decode = None
+
+        def func(driver, tdi_array):
+            return driver.xfer_bytes(cmd_builder(tdi_combiner(tdi_array)), readlen, decode, boundaries)
+        vars(self).clear()
+        return func
+
+class MpsseBinTemplate(BinTemplate):
+    ''' Maps JTAG strings into FTDI MPSSE commands, and then
+        uses ctypes structures to build the command buffer
+        and to extract TDO data from the read buffer.
+    '''
+    clock_only = False  # Set for the high speed parts
+
+    def customize_template(self):
+        info = mpsse_jtag_commands(self.tms_string, self.tdi_xstring, self.tdo_xstring, self.clock_only)
+        self.tdi_xstring, self.tdo_xstring = info
+
+# The high speed parts (FT2232H, FT4232H, FT232H) can clock
+# without transferring data, e.g. for long waits in run/idle.
+
+class MpsseHiSpeedTemplate(MpsseTemplate):
+    clock_only = True
+
+class MpsseHiSpeedBinTemplate(MpsseBinTemplate):
+    clock_only = True
+
+class MpsseHiSpeedBytesTemplate(MpsseBytesTemplate):
+    clock_only = True
@@ -0,0 +1,81 @@
+'''
+This package provides a simulated cable.  It uses the FTDI cable's
+Jtagger (and template engines) unchanged, but replaces the FTDI device
+with a software model of the MPSSE engine driving a simulated JTAG
+chain.  This allows the host side code to be exercised, benchmarked
+and tested without any hardware.
+
+The cable name describes the chain, as a comma-separated list of
+devices in order from TDI to TDO.  Each device may be:
+
+    nexys_video   -- an XC7A200T with the USER4 memory bus from
+                     fpga/nexys_video loaded (see membus.py)
+    bypass        -- a device with no IDCODE register
+    <idcode>      -- a device with the given IDCODE (e.g. 0x13636093)
+
+The IR length of an IDCODE device is looked up in the BSDL database;
+if the part is unknown, SIM_IR_LENGTH is used.  SIM_IR_LENGTH is
+also used for bypass devices.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+from ..ftdi import d2xx_data
+from .mpsse import SimFtdiDevice
+from .tap import TapChain, JtagDevice
+from .membus import MemoryBus
+
+class SimDefaults(object):
+    SIM_IR_LENGTH = 6
+    SIM_MEMORY_SIZE = 65536     # Bytes per USER4 memory space
+
+def nexys_video(config):
+    ''' XC7A200T with the USER4 memory bus.
+    '''
+    return JtagDevice(6, 0b010001, 0x13636093, 0b001001,
+                      {0b100011: MemoryBus(config.SIM_MEMORY_SIZE)})
+
+def bypass(config):
+    return JtagDevice(config.SIM_IR_LENGTH)
+
+def idcode_device(config, idcode):
+    from ...bsdl.lookup import PartInfo
+    irlen = len(PartInfo(idcode).ir_capture or '') or config.SIM_IR_LENGTH
+    return JtagDevice(irlen, 1, idcode)
+
+parts = dict(nexys_video=nexys_video, bypass=bypass)
+
+def make_chain(config):
+    devices = []
+    for name in str(config.CABLE_NAME).split(','):
+        name = name.strip().lower()
+        part = parts.get(name)
+        if part is not None:
+            devices.append(part(config))
+            continue
+        try:
+            idcode = int(name, 0)
+        except ValueError:
+            config.error('Unknown simulated device %s' % repr(name))
+        devices.append(idcode_device(config, idcode))
+    return TapChain(devices)
+
+class Jtagger(d2xx_data.Jtagger):
+    ''' The d2xx_data Jtagger, with a simulated FTDI device.
+        The device (and through it, the simulated chain) is
+        available as the sim attribute.
+    '''
+    def device_class(self, config):
+        config.add_defaults(SimDefaults)
+        self.chain = make_chain(config)
+        self.sim = SimFtdiDevice(config, self.chain)
+        return self.sim
+
+def showdevs():
+    print('''
+The sim cable driver requires a comma-separated list of simulated
+devices, in order from TDI to TDO.  Each device may be one of:
+
+    %s
+    or a hex IDCODE (e.g. 0x13636093)
+''' % ', '.join(sorted(parts)))
@@ -0,0 +1,154 @@
+'''
+This module contains a model of the USER4 memory bus in
+fpga/nexys_video/rtl (tb_jtag_if.sv and tb_ctl.sv), which
+is driven by playtag.fpga.fpgabus.BusDriver.
+
+The model is functional rather than cycle-accurate.  The command
+stream is a sequence of bytes, LSB first.  Ones are ignored between
+commands, and a command starts with a zero bit:
+
+    - Command byte:  bit 0 is the start bit (0), bits 3:1 select
+                     the memory space, and bits 7:4 are 0 for a
+                     read or 1 for a write
+    - Address, 4 bytes, LSB first
+    - Count (0 means 256 bytes)
+    - For a write, count bytes of data
+
+For a read, the data bytes are returned on TDO while the host shifts
+in the count bytes that follow the command.  All other TDO bits are
+ones.  Capturing the data register (i.e. reselecting it) aborts any
+command in progress, like jtag_inactive in the RTL.
+
+Each memory space is a bytearray; addresses wrap around its size.
+The RTL's quirk of writing the same word twice when crossing a
+256 byte boundary is not modeled.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+from ...iotemplate.intconvert import join_bits
+
+MEMORY_SIZE = 65536     # Default bytes per memory space
+NUM_SPACES = 8
+
+
+class MemoryBus(object):
+    ''' The USER4 data register, with up to 8 memory spaces.
+    '''
+
+    def __init__(self, memory_size=MEMORY_SIZE):
+        self.spaces = [bytearray(memory_size) for i in range(NUM_SPACES)]
+        self.capture()
+
+    def capture(self):
+        self.hunting = True
+        self.header = bytearray()
+        self.partial = 0        # Bits received for the current byte
+        self.partial_bits = 0
+        self.response = 0xFF    # TDO for the current byte
+        self.count = 0          # Data bytes remaining in the command
+
+    def update(self):
+        pass
+
+    def read(self, space, address, numbytes):
+        memory = self.spaces[space]
+        address %= len(memory)
+        data = memory[address:address + numbytes]
+        while len(data) < numbytes:
+            data += memory[:numbytes - len(data)]
+        return bytes(data)
+
+    def write(self, space, address, data):
+        memory = self.spaces[space]
+        while data:
+            address %= len(memory)
+            chunk = data[:len(memory) - address]
+            memory[address:address + len(chunk)] = chunk
+            address += len(chunk)
+            data = data[len(chunk):]
+
+    def byte_done(self, value):
+        ''' Process a complete byte from the host, and set up
+            the response for the next byte.
+        '''
+        self.response = 0xFF
+        if self.count:
+            self.data_bytes(bytes([value]))
+            return
+        header = self.header
+        header.append(value)
+        if len(header) == 1 and value & 0xE1:
+            header.clear()      # Bad command; hunt for another
+            self.hunting = True
+        elif len(header) == 6:
+            self.start_data()
+
+    def start_data(self):
+        ''' The header is complete.  Set up the data phase.
+        '''
+        header = self.header
+        self.space = header[0] >> 1 & 7
+        self.writing = bool(header[0] & 0x10)
+        self.address = int.from_bytes(header[1:5], 'little')
+        self.count = header[5] or 256
+        header.clear()
+        if not self.writing:
+            self.response = self.read(self.space, self.address, 1)[0]
+
+    def data_bytes(self, data):
+        ''' Process some data bytes from the host (which must not be
+            more than the remaining count), and return the TDO bytes.
+        '''
+        numbytes = len(data)
+        self.count -= numbytes
+        address = self.address
+        self.address += numbytes
+        if self.writing:
+            self.write(self.space, address, data)
+            result = b'\xff' * numbytes
+        else:
+            result = self.read(self.space, address, numbytes)
+        if self.count:
+            if not self.writing:
+                self.response = self.read(self.space, self.address, 1)[0]
+        else:
+            self.hunting = True
+        return result
+
+    def shift(self, tdi, numbits, join_bits=join_bits):
+        ''' Shift numbits of tdi through the register,
+            and return the TDO bits.
+        '''
+        result = []
+        offset = 0
+        while offset < numbits:
+            remaining = numbits - offset
+            if self.hunting:
+                # Skip ones until we find a start bit
+                zeros = ~(tdi >> offset) & ((1 << remaining) - 1)
+                skip = (zeros & -zeros).bit_length() - 1 if zeros else remaining
+                if skip:
+                    result.append(((1 << skip) - 1, skip))
+                    offset += skip
+                if zeros:
+                    self.hunting = False
+                continue
+            if not self.partial_bits and self.count and remaining >= 8:
+                # Byte-aligned data phase; do as many bytes as we can
+                numbytes = min(self.count, remaining // 8)
+                data = (tdi >> offset & ((1 << (8 * numbytes)) - 1)).to_bytes(numbytes, 'little')
+                result.append((int.from_bytes(self.data_bytes(data), 'little'), 8 * numbytes))
+                offset += 8 * numbytes
+                continue
+            numbits_now = min(8 - self.partial_bits, remaining)
+            mask = (1 << numbits_now) - 1
+            result.append((self.response >> self.partial_bits & mask, numbits_now))
+            self.partial |= (tdi >> offset & mask) << self.partial_bits
+            self.partial_bits += numbits_now
+            offset += numbits_now
+            if self.partial_bits == 8:
+                value = self.partial
+                self.partial = self.partial_bits = 0
+                self.byte_done(value)
+        return join_bits(result)
@@ -0,0 +1,175 @@
+'''
+This module contains a software model of an FTDI MPSSE engine
+connected to a simulated JTAG chain, and a replacement for the
+d2xx FtdiDevice class that uses it.
+
+The MPSSE model interprets the command bytes that are written to
+it, and queues any bytes that the commands read, just like the
+FTDI chip.  It supports the LSB-first JTAG data and TMS commands
+in mpsse_commands.Commands, clock-only commands, GPIO commands,
+and the commands used to set up the chip.  Unknown commands are
+answered with 0xFA followed by the command, as on the real chip.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+from ctypes import c_uint, byref
+
+from ..ftdi.d2xx import FtdiDefaults, FtdiDevice
+from ..ftdi.mpsse_commands import Commands
+
+# Number of bytes in each non-data command, including the opcode
+command_lengths = {
+    0x80: 3, 0x81: 1, 0x82: 3, 0x83: 1, 0x84: 1, 0x85: 1, 0x86: 3, 0x87: 1,
+    0x88: 1, 0x89: 1, 0x8a: 1, 0x8b: 1, 0x8c: 1, 0x8d: 1, 0x8e: 2, 0x8f: 3,
+    0x94: 1, 0x95: 1, 0x96: 1, 0x97: 1, 0x9c: 3, 0x9d: 3, 0x9e: 3,
+}
+
+
+class MpsseSim(object):
+    ''' Interprets a stream of MPSSE commands.
+
+            chain -- the TapChain that the JTAG pins drive
+            output -- bytearray of data waiting to be read
+            tms, tdi -- current state of the TMS and TDI pins
+            gpio -- current value of the GPIO pins
+            written -- total number of command bytes processed
+    '''
+
+    def __init__(self, chain):
+        self.chain = chain
+        self.output = bytearray()
+        self.pending = bytearray()
+        self.tms = 1
+        self.tdi = 0
+        self.gpio = 0
+        self.written = 0
+
+    def write(self, data):
+        ''' Process command bytes.  A command that is split across
+            calls is kept until the rest of it arrives.
+        '''
+        self.written += len(data)
+        if self.pending:
+            data = self.pending + data
+        data = memoryview(data)
+        offset = 0
+        while offset < len(data):
+            length = self.command(data, offset)
+            if not length:
+                break
+            offset += length
+        self.pending = bytearray(data[offset:])
+
+    def command(self, data, offset):
+        ''' Process the command at offset, and return its length,
+            or 0 if the command is incomplete.
+        '''
+        opcode = data[offset]
+        available = len(data) - offset
+        if opcode < 0x80:
+            return self.jtag_command(data, offset, opcode, available)
+        length = command_lengths.get(opcode, 1)
+        if length > available:
+            return 0
+        if opcode in (0x80, 0x82):
+            shift = 0 if opcode == 0x80 else 8
+            self.gpio = self.gpio & ~(0xFF << shift) | data[offset + 1] << shift
+        elif opcode in (0x81, 0x83):
+            self.output.append(self.gpio >> (0 if opcode == 0x81 else 8) & 0xFF)
+        elif opcode == 0x8e:
+            self.clock_only(data[offset + 1] + 1)
+        elif opcode == 0x8f:
+            self.clock_only(8 * (int.from_bytes(data[offset + 1:offset + 3], 'little') + 1))
+        elif opcode not in command_lengths:
+            self.output += bytes((0xFA, opcode))
+        return length
+
+    def clock_only(self, numbits):
+        tms = self.tms and (1 << numbits) - 1
+        tdi = self.tdi and (1 << numbits) - 1
+        self.chain.clock(tms, tdi, numbits)
+
+    def jtag_command(self, data, offset, opcode, available):
+        ''' Process a data or TMS shift command.
+        '''
+        if not opcode & Commands._lsb_first:
+            raise ValueError('MSB first MPSSE command 0x%02x is not supported' % opcode)
+        writing = opcode & Commands._tdi_wr
+        reading = opcode & Commands._tdo_rd
+        if opcode & Commands._tms_wr:
+            if available < 3:
+                return 0
+            value = data[offset + 2]
+            numbits = data[offset + 1] + 1
+            tdi = value >> 7
+            self.tdi = tdi
+            tms = value & ((1 << numbits) - 1)
+            tdo = self.chain.clock(tms, tdi and (1 << numbits) - 1, numbits)
+            self.tms = tms >> (numbits - 1) & 1
+            if reading:
+                self.output.append(tdo << (8 - numbits) & 0xFF)
+            return 3
+        if opcode & Commands._bitmode:
+            length = 2 + bool(writing)
+            if available < length:
+                return 0
+            numbits = data[offset + 1] + 1
+            numbytes = 1
+            tdi = data[offset + 2] if writing else 0
+        else:
+            if available < 3:
+                return 0
+            numbytes = int.from_bytes(data[offset + 1:offset + 3], 'little') + 1
+            numbits = 8 * numbytes
+            length = 3 + (numbytes if writing else 0)
+            if available < length:
+                return 0
+            tdi = int.from_bytes(data[offset + 3:offset + length], 'little') if writing else 0
+        if writing:
+            self.tdi = tdi >> (numbits - 1) & 1
+        else:
+            tdi = self.tdi and (1 << numbits) - 1
+        tms = self.tms and (1 << numbits) - 1
+        tdo = self.chain.clock(tms, tdi & ((1 << numbits) - 1), numbits)
+        if reading:
+            if numbits < 8:
+                tdo = tdo << (8 - numbits) & 0xFF
+            self.output += tdo.to_bytes(numbytes, 'little')
+        return length
+
+
+class SimFtdiDevice(object):
+    ''' Replaces d2xx.FtdiDevice for the d2xx_data Jtagger.
+        Only the methods that the Jtagger uses are provided.
+    '''
+    DWORD = c_uint
+    byref = staticmethod(byref)
+    hispeed = True
+
+    def __init__(self, config, chain):
+        config.add_defaults(FtdiDefaults)
+        self.debug = config.FTDI_DEBUG and open(config.FTDI_DEBUG, 'wt')
+        self.mpsse = MpsseSim(chain)
+        self.speed = config.FTDI_JTAG_FREQ
+        self.output_mask = config.FTDI_GPIO_MASK
+        self._current_gpio = config.FTDI_GPIO_OUT
+
+    gpio_commands = FtdiDevice.gpio_commands
+
+    def speed_commands(self, speed=6e6, adaptive=False, loopback=False):
+        self.speed = speed
+        return FtdiDevice.speed_commands(self, speed, adaptive, loopback)
+
+    def Write(self, ref, numbytes, countref):
+        self.mpsse.write(memoryview(ref._obj).cast('B')[:numbytes])
+        countref._obj.value = numbytes
+
+    def Read(self, ref, numbytes, countref):
+        output = self.mpsse.output
+        if len(output) < numbytes:
+            raise SystemExit('Simulated FTDI read of %d bytes; only %d available' %
+                             (numbytes, len(output)))
+        memoryview(ref._obj).cast('B')[:numbytes] = output[:numbytes]
+        del output[:numbytes]
+        countref._obj.value = numbytes
@@ -0,0 +1,169 @@
+'''
+This module contains a software model of a JTAG chain.
+
+The TAP controller uses the state transitions from jtag.states,
+and each device in the chain has an instruction register and a
+set of data registers that are selected by the instruction.
+
+Registers are shifted with integers, where bit 0 is the first bit
+in time (the bit closest to TDO), so that long shifts are done
+with a few integer operations rather than one operation per bit.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+from ...jtag.states import states
+from ...iotemplate.intconvert import join_bits
+
+
+class ShiftRegister(object):
+    ''' A fixed-length JTAG data or instruction register.
+
+            length -- number of bits in the register
+            capture_value -- value loaded on capture
+            value -- current contents of the register
+    '''
+
+    def __init__(self, length, capture_value=0):
+        self.length = length
+        self.capture_value = capture_value
+        self.value = capture_value
+
+    def capture(self):
+        self.value = self.capture_value
+
+    def shift(self, tdi, numbits):
+        ''' Shift numbits of tdi into the register, and
+            return the numbits that are shifted out.
+        '''
+        length = self.length
+        combined = self.value | tdi << length
+        self.value = combined >> numbits
+        return combined & ((1 << numbits) - 1)
+
+    def update(self):
+        pass
+
+
+class JtagDevice(object):
+    ''' A device in the JTAG chain.
+
+            irlen -- length of the instruction register
+            ir_capture -- value captured into the IR
+            idcode -- value of the ID code register, or None
+                      if the device only has a BYPASS register
+            idcode_instr -- instruction that selects the ID code
+            registers -- a dictionary of additional data registers,
+                         indexed by instruction
+
+        Instructions that are not in the dictionary select BYPASS.
+        Reset selects IDCODE, or BYPASS if the device has no idcode.
+    '''
+
+    def __init__(self, irlen, ir_capture=1, idcode=None, idcode_instr=1, registers=None):
+        self.ir = ShiftRegister(irlen, ir_capture)
+        self.bypass = ShiftRegister(1)
+        self.registers = dict(registers or {})
+        self.reset_instr = (1 << irlen) - 1
+        self.idcode = idcode
+        if idcode is not None:
+            self.registers[idcode_instr] = ShiftRegister(32, idcode)
+            self.reset_instr = idcode_instr
+        self.reset()
+
+    def __repr__(self):
+        if self.idcode is None:
+            return '<JtagDevice irlen=%d>' % self.ir.length
+        return '<JtagDevice irlen=%d idcode=0x%08x>' % (self.ir.length, self.idcode)
+
+    def reset(self):
+        self.instruction = self.reset_instr
+        self.dr = self.registers.get(self.instruction, self.bypass)
+
+    def update_ir(self):
+        self.instruction = self.ir.value
+        self.dr = self.registers.get(self.instruction, self.bypass)
+
+
+class TapChain(object):
+    ''' A chain of JTAG devices, in order from TDI to TDO,
+        sharing a TAP controller state.
+
+        tdo_idle is the value of TDO when the chain is
+        not shifting.
+    '''
+    tdo_idle = 1
+
+    def __init__(self, devices):
+        self.devices = list(devices)
+        self.state = states.reset
+        self.clocks = 0
+
+    def enter(self, state):
+        ''' Perform the actions for a state transition.
+            (Capture and update happen on different clock
+            edges on a real device, but nothing can observe
+            the difference.)
+        '''
+        self.state = state
+        if state == states.capture_dr:
+            for device in self.devices:
+                device.dr.capture()
+        elif state == states.capture_ir:
+            for device in self.devices:
+                device.ir.capture()
+        elif state == states.update_dr:
+            for device in self.devices:
+                device.dr.update()
+        elif state == states.update_ir:
+            for device in self.devices:
+                device.update_ir()
+        elif state == states.reset:
+            for device in self.devices:
+                device.reset()
+
+    def shift(self, tdi, numbits):
+        ''' Clock numbits through the current shift state with TMS low.
+            Returns TDO.
+        '''
+        self.clocks += numbits
+        if self.state == states.shift_dr:
+            for device in self.devices:
+                tdi = device.dr.shift(tdi, numbits)
+        else:
+            for device in self.devices:
+                tdi = device.ir.shift(tdi, numbits)
+        return tdi
+
+    def clock(self, tms, tdi, numbits):
+        ''' Clock numbits through the chain.  tms and tdi are
+            integers with the first bit in the LSB.  Returns TDO.
+            Runs of clocks that do not change the state are
+            handled together.
+        '''
+        result = []
+        offset = 0
+        while offset < numbits:
+            state = self.state
+            value = tms >> offset & 1
+            nextstate = state[value]
+            if nextstate == state:
+                remaining = tms >> offset
+                if value:
+                    remaining = ~remaining
+                if remaining:
+                    count = min((remaining & -remaining).bit_length() - 1, numbits - offset)
+                else:
+                    count = numbits - offset
+            else:
+                count = 1
+            if state.shifting:
+                tdo = self.shift(tdi >> offset & ((1 << count) - 1), count)
+            else:
+                self.clocks += count
+                tdo = self.tdo_idle and (1 << count) - 1
+            result.append((tdo, count))
+            offset += count
+            if nextstate != state or nextstate == states.reset:
+                self.enter(nextstate)
+        return join_bits(result)
@@ -6,16 +6,23 @@ License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.t
 '''
 import sys
 import socket
-import array
+import collections
+import contextlib
 
-from ..iotemplate.stringconvert import TemplateStrings
+from ..iotemplate.intconvert import TemplateInts, TdoFields, read_converter
+from ..iotemplate.binconvert import BinTemplate
+from ..iotemplate.diskcache import TemplateCache
+from ..iotemplate.deferred import DeferredTdo
+from ..lib import instrument
 
 # Initial version.  Make it work at all, then make it faster...
-# (Most obvious optimization is to use 64 bit ints rather than chars)
-# Also could maybe pipeline.
+# Templates are applied as integers, so no strings are created.
+# Up to XVC_WINDOW shift commands are kept in flight.
 
 test = __name__ == '__main__'
-profile = False
+
+# Default bits per shift command, until we ask the server (getinfo:)
+maxbits = 120000
 
 class XvcDefaults(object):
     def __init__(self, cable_name):
@@ -24,13 +31,128 @@ class XvcDefaults(object):
             raise SystemExit('Invalid cable name: %s' % ' '.join(cable_name))
         self.XVC_HOST_NAME = 'localhost' if not cable_name else cable_name[0]
         self.XVC_PORT_NUM = 2542 if len(cable_name) < 2 else int(cable_name[1])
+        self.XVC_TEMPLATE_ENGINE = 'bytes'  # or 'ints', or 'binary' for ctypes structures
+        self.XVC_WINDOW = 4     # Maximum number of shift commands awaiting replies
+        self.XVC_MAX_BITS = 0   # Limit on bits per shift command (0 to use the server's limit)
+        self.XVC_JTAG_FREQ = 0  # TCK frequency to request from the server (0 to leave it alone)
+
+def tobits(data):
+    ''' Return a byte string as a string of '0' and '1',
+        with the first byte at the end of the string.
+    '''
+    return ''.join('{:08b}'.format(x) for x in reversed(data))
+
+class XvcBinTemplate(BinTemplate):
+    ''' Builds complete XVC shift commands (header, TMS and TDI)
+        when the template is compiled, so that only the variable
+        TDI bits are filled in when the template is applied.
+        Templates longer than maxbits become multiple commands.
+    '''
+    maxbits = maxbits   # Set by the Jtagger to the negotiated size
+
+    def customize_template(self):
+        maxbits = self.maxbits
+        tms, tdi, tdo = self.tms_string, self.tdi_xstring, self.tdo_xstring
+        total = len(tms)
+        commands = []
+        replies = []
+        for offset in range(0, total, maxbits):
+            numbits = min(maxbits, total - offset)
+            end = total - offset
+            start = end - numbits
+            padding = -numbits % 8
+            header = tobits(b'shift:' + numbits.to_bytes(4, 'little'))
+            commands.append(padding * '0' + tdi[start:end] +
+                            padding * '0' + tms[start:end] + header)
+            replies.append(padding * '*' + tdo[start:end])
+        commands.reverse()
+        replies.reverse()
+        self.tdi_xstring = ''.join(commands)
+        self.tdo_xstring = ''.join(replies)
+
+class XvcBytesTemplate(TemplateInts):
+    ''' Builds complete XVC shift commands (header, TMS, and the
+        constant TDI) as bytes when the template is compiled.  Each
+        compiled template owns its command buffer, and applying the
+        template just splices the TDI bytes into it, sends it, and
+        extracts TDO from the replies the driver received in place.
+        Templates longer than maxbits become multiple commands.
+    '''
+    maxbits = maxbits   # Set by the Jtagger to the negotiated size
+
+    def get_commands(self):
+        ''' Return the command buffer, a list of (start, end, first, last)
+            locations where TDI bytes [first:last] go in the buffer, and
+            a list of (end, numchars) for sending each command.
+        '''
+        maxbits = self.maxbits
+        total = self.transaction_bit_length
+        numchars = (total + 7) // 8
+        tms = self.tms.to_bytes(numchars, 'little')
+        tdi = self.tdi_const.to_bytes(numchars, 'little')
+        cmds = bytearray()
+        splices = []
+        commands = []
+        for offset in range(0, total, maxbits):
+            numbits = min(maxbits, total - offset)
+            first = offset // 8
+            last = first + (numbits + 7) // 8
+            cmds += b'shift:'
+            cmds += numbits.to_bytes(4, 'little')
+            cmds += tms[first:last]
+            splices.append((len(cmds), len(cmds) + last - first, first, last))
+            cmds += tdi[first:last]
+            commands.append((len(cmds), last - first))
+        return cmds, splices, commands
+
+    def get_xfer_func(self):
+        cmds, splices, commands = self.get_commands()
+        view = memoryview(cmds)
+        numchars = (self.transaction_bit_length + 7) // 8
+        tdi_combiner = self.get_tdi_combiner() if self.tdi_splice else None
+
+        if self.tdo_bits:
+            reads = []
+            position = 0
+            for offset, numbits in self.tdo_gather:
+                reads.append((offset >> 3, (offset + numbits + 7) >> 3, offset & 7, position, numbits))
+                position += numbits
+            converter = read_converter(reads)
+            tdo_fields = TdoFields(self.tdo_bits)
+            def decode(data):
+                return tdo_fields(converter(data))
+        else:
+            decode = None
+
+        def func(driver, tdi_array):
+            if tdi_combiner is not None:
+                tdi = tdi_combiner(tdi_array).to_bytes(numchars, 'little')
+                for start, end, first, last in splices:
+                    cmds[start:end] = tdi[first:last]
+            return driver.xfer_bytes(view, commands, numchars, decode)
+        vars(self).clear()
+        return func
 
-class Jtagger(TemplateStrings.mix_me_in()):
+class Jtagger(TemplateInts.mix_me_in()):
     sock = None
-    maxbits = 120000 # Match other end for now; dynamically determine later
+    close_timeout = 2.0     # Seconds to wait for outstanding replies when closing
+    maxbits = maxbits
+    stream_chunksize = maxbits // 8    # For jtag.stream
+    engines = dict(ints=TemplateInts, binary=XvcBinTemplate, bytes=XvcBytesTemplate)
 
     def __init__(self, config):
         config.add_defaults(XvcDefaults(config.CABLE_NAME))
+        self.engine = self.engines.get(config.XVC_TEMPLATE_ENGINE)
+        if self.engine is None:
+            config.error('XVC_TEMPLATE_ENGINE must be one of %s' %
+                         ', '.join(sorted(self.engines)))
+        self.template_cache = TemplateCache.from_config(config)
+        self.rcvbuf = bytearray()
+        self.window = max(config.XVC_WINDOW, 1)
+        self.inflight = collections.deque()
+        self.pending = 0    # Reply bytes in flight
+        self.batching = 0
+        self.speed = None
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         # Ask the network driver to send packets and acks immediately
         sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
@@ -43,60 +165,227 @@ class Jtagger(TemplateStrings.mix_me_in()):
         except ConnectionRefusedError:
             raise SystemExit('\nConnection refused -- exiting.\n')
         self.sock = sock
+        self.sendall = sock.sendall
+        self.maxpending = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        profiler = instrument.from_config(config)
+        if profiler is not None:
+            self.sendall = profiler.wrap_io('write', self.sendall, lambda args: len(args[0]))
+            self.recv_into = profiler.wrap_io('read', self.recv_into, lambda args: len(args[0]))
+        self.negotiate(config)
+
+    def negotiate(self, config):
+        ''' Ask the server for its maximum vector size, and size our
+            shift commands to match.  The size is in bytes, so maxbits
+            is always a multiple of 8, which lets the bytes engine
+            split templates on byte boundaries.  Then set the TCK
+            frequency, if requested.
+        '''
+        self.sendall(b'getinfo:')
+        info = b''
+        while not info.endswith(b'\n'):
+            received = self.sock.recv(64)
+            if not received:
+                raise SystemExit('Remote socket closed')
+            info += received
+        version, _, vectorlen = info.strip().partition(b':')
+        if not version.startswith(b'xvcServer_v1.') or not vectorlen.isdigit():
+            raise SystemExit('Unexpected reply to XVC getinfo: %r' % info)
+        maxbits = int(vectorlen) * 8
+        if config.XVC_MAX_BITS:
+            maxbits = min(maxbits, config.XVC_MAX_BITS // 8 * 8)
+        if maxbits < 8:
+            raise SystemExit('XVC server vector size is too small: %r' % info)
+        print('%s: maximum shift of %d bits' % (version.decode(), maxbits))
+        self.maxbits = maxbits
+        self.stream_chunksize = maxbits // 8
+        self.discard = memoryview(bytearray(maxbits // 8))
+        if hasattr(self.engine, 'maxbits'):
+            self.engine = type(self.engine.__name__, (self.engine,), dict(maxbits=maxbits))
+        if config.XVC_JTAG_FREQ:
+            speed = self.setspeed(config.XVC_JTAG_FREQ)
+            print('TCK frequency %g Hz (requested %g Hz)' % (speed, config.XVC_JTAG_FREQ))
 
     def __del__(self):
-        sock, self.sock = self.sock, None
+        sock = self.sock
         if sock is not None:
-            sock.close()
+            # Closing with unread replies resets the connection,
+            # which might lose commands the server has not read.
+            # Don't wait forever for a server that has stopped.
+            try:
+                sock.settimeout(self.close_timeout)
+                self.flush()
+            except (OSError, SystemExit):
+                pass
+            finally:
+                self.sock = None
+                sock.close()
 
     def getspeed(self):
-        return 1000000
+        ''' Return the TCK frequency reported by the server
+            when it was last set, or None if it has not been set.
+        '''
+        return self.speed
 
     def setspeed(self, newspeed):
-        return 1000000
+        ''' Ask the server for a TCK frequency (settck:), and
+            return the frequency it actually set.
+        '''
+        period = max(int(round(1e9 / newspeed)), 1)
+        reply = bytearray(4)
+        self.send_command(b'settck:' + period.to_bytes(4, 'little'), memoryview(reply))
+        self.flush()
+        self.speed = 1e9 / max(int.from_bytes(reply, 'little'), 1)
+        return self.speed
 
-    def __call__(self, tms, tdi, usetdo):
-        '''  Passed tms, tdi.  Returns tdo.
-             All these are strings of '0' and '1'.
-             First bit sent is the last bit in the string...
+    def make_template(self, base_template):
+        if self.template_cache is not None:
+            return self.template_cache.compile(self, self.engine, base_template)
+        return self.engine(base_template).get_xfer_func()
+
+    def recv_into(self, view):
+        ''' Fill a memoryview with data from the socket.
         '''
-        numbits = len(tms)
-        if not numbits:
-            return
-        if numbits > self.maxbits:
-            return self.assemble_chunks(tms, tdi, usetdo)
-        assert numbits == len(tdi)
-        numchars = (numbits + 7) // 8
-        cmd = b'shift:%s%s%s' % (
-            numbits.to_bytes(4, 'little'),
-            int(tms,2).to_bytes(numchars, 'little'),
-            int(tdi,2).to_bytes(numchars, 'little'))
-        self.sock.sendall(cmd)
-        data = array.array('B')
-        while len(data) < numchars:
-            newdata = self.sock.recv(min(4096, numchars - len(data)))
-            if not newdata:
+        recv_into = self.sock.recv_into
+        while view:
+            received = recv_into(view)
+            if not received:
                 raise SystemExit('Remote socket closed')
-            data.frombytes(newdata)
+            view = view[received:]
 
-        if usetdo:
-            data = '{0:0b}'.format(int.from_bytes(data, 'little'))
-            if len(data) < numbits:
-                data = (numbits - len(data)) * '0' + data
-            elif len(data) > numbits:
-                data = data[len(data)-numbits:]
-            return data
-
-    def assemble_chunks(self, tms, tdi, usetdo):
-        '''  Too long to do in a single transaction,
-             so do multiple transactions.
+    def get_rcvbuf(self, numbytes):
+        ''' Return a memoryview of numbytes of the receive buffer,
+            which is reused (and grown as needed) for every transfer.
         '''
-        chunksize = self.maxbits
-        result = []
-        for offset in reversed(range(0, len(tms), chunksize)):
-            result.append(self(tms[offset:offset+chunksize], tdi[offset:offset+chunksize], usetdo))
+        if len(self.rcvbuf) < numbytes:
+            self.rcvbuf = bytearray(numbytes)
+        return memoryview(self.rcvbuf)[:numbytes]
+
+    def send_command(self, command, reply, done=None):
+        ''' Send a shift command.  Its reply will be received into
+            reply, and then done() (if given) will be called.
+            The server replies in order, so up to window commands
+            are kept in flight, and we only wait for a reply when
+            the window is full, or when the data is needed.
+
+            The unread replies must also fit in the socket receive
+            buffer, or the server could block sending a reply while
+            we block sending a (long) command to it.
+        '''
+        inflight = self.inflight
+        while inflight and (len(inflight) >= self.window or
+                            self.pending + len(reply) > self.maxpending):
+            self.receive_reply()
+        self.sendall(command)
+        inflight.append((reply, done))
+        self.pending += len(reply)
+
+    def receive_reply(self):
+        reply, done = self.inflight.popleft()
+        self.recv_into(reply)
+        self.pending -= len(reply)
+        if done is not None:
+            done()
+
+    def flush(self):
+        ''' Receive the replies for all commands in flight.
+        '''
+        while self.inflight:
+            self.receive_reply()
+
+    @contextlib.contextmanager
+    def batch(self):
+        ''' Context manager for batched template execution.
+            Inside the batch, templates compiled with the bytes
+            engine do not wait for their replies, so commands
+            from successive templates stay in flight together.
+            Templates that read TDO return DeferredTdo objects,
+            which wait for the replies if used before the batch
+            ends.  Batches may be nested.
+        '''
+        self.batching += 1
+        try:
+            yield self
+        finally:
+            self.batching -= 1
+            if not self.batching:
+                self.flush()
+
+    def xfer_bytes(self, cmds, commands, rcvbytes, decode):
+        ''' Send a buffer of complete shift commands built by
+            XvcBytesTemplate.  commands is a list of (end, numchars)
+            for each command.  Returns decode(replies), or a
+            DeferredTdo object if batching.
+
+            If decode is None, the replies are not needed, so
+            the commands are left in flight, and their replies
+            are discarded when later commands need the window.
+        '''
+        done = result = None
+        if decode is None:
+            replies = self.discard
+        elif self.batching:
+            replies = memoryview(bytearray(rcvbytes))
+            result = DeferredTdo(self.flush)
+            done = lambda: result.resolve(decode(replies))
+        else:
+            replies = self.get_rcvbuf(rcvbytes)
+        send_command = self.send_command
+        last = len(commands) - 1
+        start = offset = 0
+        for index, (end, numchars) in enumerate(commands):
+            send_command(cmds[start:end], replies[offset:offset + numchars],
+                         done if index == last else None)
+            start = end
+            if decode is not None:
+                offset += numchars
+        if result is None and decode is not None:
+            self.flush()
+            return decode(replies)
+        return result
+
+    def xfer_buffer(self, source, numbytes, rcvbytes):
+        ''' Send a buffer of complete shift commands built by
+            XvcBinTemplate, and return a buffer containing all
+            the replies, or None if rcvbytes is 0 (in which case
+            the replies are discarded, as for xfer_bytes).
+        '''
+        commands = memoryview(source).cast('B')[:numbytes]
+        replies = self.get_rcvbuf(rcvbytes) if rcvbytes else self.discard
+        offset = 0
+        while offset < numbytes:
+            numchars = (int.from_bytes(commands[offset+6:offset+10], 'little') + 7) // 8
+            end = offset + 10 + 2 * numchars
+            self.send_command(commands[offset:end], replies[:numchars])
+            offset = end
+            if rcvbytes:
+                replies = replies[numchars:]
+        if rcvbytes:
+            self.flush()
+            return self.rcvbuf
+
+    def __call__(self, tms, tdi, numbits, usetdo):
+        '''  Passed tms, tdi integers and the number of bits.  Returns tdo.
+             The first bit sent is the least significant bit.
+             Scans longer than maxbits are sent as multiple
+             commands, which are kept in flight together.
+        '''
+        if not numbits:
+            return
+        numchars = (numbits + 7) // 8
+        tms = tms.to_bytes(numchars, 'little')
+        tdi = tdi.to_bytes(numchars, 'little')
+        data = self.get_rcvbuf(numchars) if usetdo else None
+        chunkchars = self.maxbits // 8
+        for first in range(0, numchars, chunkchars):
+            last = min(first + chunkchars, numchars)
+            length = min(self.maxbits, numbits - 8 * first)
+            reply = data[first:last] if usetdo else self.discard[:last - first]
+            self.send_command(b'shift:%s%s%s' % (length.to_bytes(4, 'little'),
+                                                 tms[first:last], tdi[first:last]),
+                              reply)
         if usetdo:
-            return ''.join(reversed(result))
+            self.flush()
+            return int.from_bytes(data, 'little') & ((1 << numbits) - 1)
 
 def showdevs():
     print('''
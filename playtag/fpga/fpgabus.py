@@ -16,6 +16,7 @@ It is pretty basic and could probably use some work.
 from ..jtag.discover import Chain
 from ..jtag.template import JtagTemplate, TDIVariable
 from ..jtag.states import states
+from ..iotemplate import packed_stream, tdi_stream, tdo_into
 
 class BusDriver(dict):
     ''' The BusDriver class enables reading to and writing from the Artix FPGA
@@ -123,13 +124,26 @@ class BusDriver(dict):
         self[key] = do_loops
         return do_loops
 
-    def readmultiple(self, space, addr, length, size=1):
-        return self[False, size, length]([space, addr])
+    def readmultiple(self, space, addr, length, size=1, out=None):
+        ''' Returns an iterator over the values read, or if out
+            is given, stores them into it (e.g. a bytearray,
+            array.array or NumPy array; see tdo_into) and returns it.
+        '''
+        result = self[False, size, length]([space, addr])
+        if out is None:
+            return result
+        tdo_into(result, packed_stream(out, size))
+        return out
 
     def readsingle(self, space, addr, size=1):
         return next(self[False, size, 1]([space, addr]))
 
     def writemultiple(self, space, addr, value, size=1):
+        ''' The value may be a list of integers, or any object that
+            supports the buffer protocol, which is treated as an
+            array of size-byte elements.
+        '''
+        value = tdi_stream(value, size)
         self[True, size, len(value)]([space, addr], value)
 
     def writesingle(self, space, addr, value, size=1):
@@ -22,10 +22,30 @@ Currently, the file 'stringconvert.py' resides in this directory.  It can
 handle the current template conversion for digilent cables, and handles a
 lot of the template conversion for FTDI cables.
 
+The TMS data for a template is kept in a TmsRuns object, which is a
+run-length encoded list, so that the cost of building a template is
+proportional to the number of TMS changes rather than to the number
+of clocks.
+
+The file 'intconvert.py' also resides in this directory.  It converts templates
+into plans that operate on integers rather than strings, and is used by
+cables (such as xvc) that can accept TMS/TDI and return TDO as integers.
+
 Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
 License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
 '''
 
+import struct
+import weakref
+
+from ..lib import instrument
+
+# Device templates for each cable, indexed by template signature
+interned = weakref.WeakKeyDictionary()
+
+# memoryview formats for unsigned elements of each size in bytes
+unsigned_formats = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
 class TDIVariable(object):
     ''' TDIVariable is a place-holder for TDI bits that are supplied
         later (allowing us to make reusable templates).
@@ -41,6 +61,200 @@ class TDIVariable(object):
     def __init__(self, index=0):
         self.index = index
 
+class TDIDontCare(object):
+    ''' TDIDontCare marks TDI bits whose value does not matter (e.g.
+        while waiting in run/idle).  Unlike a string of '*' characters,
+        it is the same size for any number of bits, so a long wait
+        costs no more to build than a short one.  Use the dontcare
+        instance.
+    '''
+    def __repr__(self):
+        return 'dontcare'
+
+dontcare = TDIDontCare()
+
+def packed_stream(data, width=None, formats=unsigned_formats):
+    ''' Return a memoryview of an object that supports the buffer
+        protocol (bytes, bytearray, array.array, ctypes arrays,
+        NumPy arrays, etc.), cast to unsigned width-byte elements
+        in native byte order.  The width defaults to the item size
+        of the object, so it only needs to be given for things like
+        bytes objects that hold larger elements.
+
+        The result can be used as a TDI stream, or passed to
+        IOTemplate.into() to receive TDO data, and data moves in
+        and out of it without an integer object for each element.
+    '''
+    view = memoryview(data)
+    if width is None:
+        width = view.itemsize
+    code = formats.get(width)
+    if code is None:
+        raise ValueError('Unsupported stream element width of %s bytes' % width)
+    view = view.cast('B')
+    if len(view) % width:
+        raise ValueError('Stream length of %d bytes is not a multiple of %d' % (len(view), width))
+    return view.cast(code)
+
+def tdi_stream(data, width=None, sequences=(list, tuple, range)):
+    ''' Return a TDI stream in a form that all the template engines
+        can index.  Sequences of integers are returned unchanged,
+        and objects that support the buffer protocol are returned
+        as a packed_stream().
+    '''
+    if isinstance(data, sequences):
+        return data
+    try:
+        return packed_stream(data, width)
+    except TypeError:
+        return data
+
+def tdo_into(tdo, out, pack_into=struct.pack_into):
+    ''' Store the TDO data returned by a template into out, which
+        may be any writable object that supports the buffer protocol.
+        The element width is the item size of out; use packed_stream()
+        to give a different width (e.g. for a bytearray).  Returns out.
+
+        If the TDO result knows how to store itself (e.g. because the
+        template engine keeps the data packed into one integer), it
+        is asked to do so.  Otherwise, the values are packed into out
+        with struct.
+    '''
+    if tdo is None:
+        raise ValueError('Template does not return TDO data')
+    into = getattr(tdo, 'into', None)
+    if into is not None:
+        into(out)
+        return out
+    view = packed_stream(out)
+    values = list(tdo)
+    pack_into('=%d%s' % (len(values), view.format), view.cast('B'), 0, *values)
+    return out
+
+class TmsRuns(object):
+    ''' TmsRuns is a run-length encoded list of TMS values.
+
+        It supports enough of the list interface (len, iteration,
+        indexing, append, extend, +=, *=, copy) to be used in place of
+        a list of 0/1 integers, but long runs of the same value
+        (e.g. a long shift or a long wait in run/idle) only take a
+        single entry.
+
+        Attributes:
+
+            runs -- a list of (value, count) tuples.  Adjacent tuples
+                    always have different values.
+            length -- the total number of values in the list
+    '''
+
+    def __init__(self, values=()):
+        self.runs = []
+        self.length = 0
+        if values:
+            self.extend(values)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for value, count in self.runs:
+            for i in range(count):
+                yield value
+
+    def __reversed__(self):
+        for value, count in reversed(self.runs):
+            for i in range(count):
+                yield value
+
+    def __repr__(self):
+        return 'TmsRuns(%s)' % self.runs
+
+    def copy(self):
+        new = TmsRuns()
+        new.runs = list(self.runs)
+        new.length = self.length
+        return new
+
+    def add_run(self, value, count):
+        ''' Add count copies of value to the end of the list.
+        '''
+        assert count >= 0, count
+        if not count:
+            return
+        runs = self.runs
+        if runs and runs[-1][0] == value:
+            runs[-1] = value, runs[-1][1] + count
+        else:
+            runs.append((value, count))
+        self.length += count
+
+    def append(self, value):
+        self.add_run(value, 1)
+
+    def extend(self, values):
+        if isinstance(values, TmsRuns):
+            for value, count in list(values.runs):
+                self.add_run(value, count)
+        else:
+            for value in values:
+                self.add_run(value, 1)
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def __imul__(self, multiplier):
+        runs = self.runs
+        if multiplier <= 0:
+            runs[:] = []
+            self.length = 0
+        elif multiplier > 1 and runs:
+            if len(runs) == 1:
+                runs[0] = runs[0][0], runs[0][1] * multiplier
+            elif runs[0][0] == runs[-1][0]:
+                # Last run of each copy merges with first run of next copy
+                first, last = runs[0], runs[-1]
+                middle = [(first[0], first[1] + last[1])] + runs[1:-1]
+                runs[:] = runs[:-1] + (multiplier - 1) * middle + [last]
+            else:
+                runs *= multiplier
+            self.length *= multiplier
+        return self
+
+    def index_run(self, index):
+        ''' Return the run number and the offset within
+            that run for a given index.
+        '''
+        length = self.length
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('TmsRuns index out of range')
+        runs = self.runs
+        if index >= length - runs[-1][1]:
+            return len(runs) - 1, index - (length - runs[-1][1])
+        for runnum, (value, count) in enumerate(runs):
+            if index < count:
+                return runnum, index
+            index -= count
+
+    def __getitem__(self, index):
+        return self.runs[self.index_run(index)[0]][0]
+
+    def __setitem__(self, index, value):
+        runnum, offset = self.index_run(index)
+        oldvalue, count = self.runs[runnum]
+        if value == oldvalue:
+            return
+        tail = self.runs[runnum:]
+        del self.runs[runnum:]
+        self.length -= sum(x[1] for x in tail)
+        self.add_run(oldvalue, offset)
+        self.add_run(value, 1)
+        self.add_run(oldvalue, count - offset - 1)
+        for value, count in tail[1:]:
+            self.add_run(value, count)
+
 class IOTemplate(object):
     ''' The default template uses JTAG-specific identifiers for internal
         variables.  Should still work for SPI, although I haven't yet
@@ -51,7 +265,7 @@ class IOTemplate(object):
 
         Variable attributes:
 
-            tms -- A list of integer 1 and 0 values, one per clock
+            tms -- A TmsRuns list of integer 1 and 0 values, one per clock
             tdi -- A list of two different kinds of items:
                      - strings of ones and zeros
                           - output to the device rightmost character first
@@ -63,15 +277,25 @@ class IOTemplate(object):
             devtemplate -- Device-specific template
             loopstack -- used for building up a template by looping
                          back using loop() and endloop()
+            repeats -- a list of (template, count) nodes that come
+                       before the tms, tdi, and tdo data.
 
         Note:  tdo entries are maintained with offsets from previous
                entries to make it easier to splice templates together.
+
+        Loops are not expanded when endloop() is called.  Instead, the
+        template data before the loop and the loop body are each moved
+        into a node on the repeats list, and the tms, tdi, and tdo lists
+        start over empty.  Template compilers that understand repeats can
+        compile each node once; other compilers call expand() to get
+        an equivalent template with no repeats.
     '''
     prevread = 0          # Location of previous read
     devtemplate = None    # Translated device-specific template
                           # Clear this when modifying the object
 
     loopstack = None      # Nothing on the loop stack to start with
+    repeats = ()          # Nothing repeated to start with
 
     def __init__(self, cable=None, cmdname='', **kwds):
         ''' Initialize all our data.  cmdname is just for debugging.
@@ -79,7 +303,7 @@ class IOTemplate(object):
         '''
         self.cable=cable
         self.cmdname = cmdname
-        self.tms = []
+        self.tms = TmsRuns()
         self.tdi = []
         self.tdo = []
         self.protocol_init(kwds)
@@ -89,23 +313,99 @@ class IOTemplate(object):
         pass
 
     def __len__(self):
-        return len(self.tms)
+        return len(self.tms) + sum(len(node) * count for (node, count) in self.repeats)
 
     def copy(self):
         ''' Make a copy of the instance.
         '''
         new = type(self)(self.cable, self.cmdname)
-        new.tms = list(self.tms)
+        new.tms = self.tms.copy()
         new.tdi = list(self.tdi)
         new.tdo = list(self.tdo)
         new.prevread = self.prevread
         new.loopstack = self.loopstack
+        if self.repeats:
+            new.repeats = list(self.repeats)
         return self.protocol_copy(new)
     def protocol_copy(self, new):
         ''' To be overridden by protocol-specific subclass
         '''
         return new
 
+    def shell(self):
+        ''' Return a copy of the instance with only
+            the protocol-specific information.
+        '''
+        return self.protocol_copy(type(self)(self.cable, self.cmdname))
+
+    def tail(self):
+        ''' Return a plain IOTemplate with a copy of the
+            data that is not in the repeats list.
+        '''
+        new = IOTemplate(self.cable, self.cmdname)
+        new.tms = self.tms.copy()
+        new.tdi = list(self.tdi)
+        new.tdo = list(self.tdo)
+        new.prevread = self.prevread
+        return new
+
+    def expand(self):
+        ''' Return a template that has the same data as
+            this one, but with no repeats.  If there are
+            repeats, the result is a plain IOTemplate.
+        '''
+        if not self.repeats:
+            return self
+        result = IOTemplate(self.cable, self.cmdname)
+        for node, count in self.repeats:
+            result = result + count * node.expand().tail()
+        return result + self.tail()
+
+    def add_repeat(self, node, count):
+        ''' Move the current data into the repeats list,
+            followed by the given node and count.
+        '''
+        repeats = list(self.repeats)
+        if self.tms:
+            repeats.append((self.tail(), 1))
+        if count and len(node):
+            repeats.append((node, count))
+        self.repeats = repeats
+        self.tms = TmsRuns()
+        self.tdi = []
+        self.tdo = []
+        self.prevread = 0
+        self.devtemplate = None
+
+    def signature(self, isinstance=isinstance, tuple=tuple, int=int):
+        ''' Return a hashable description of the structure of the
+            template (the tms, tdi and tdo data, and any loop nodes).
+            Templates with the same signature are interchangeable
+            when they are applied to a cable.
+        '''
+        runs = getattr(self.tms, 'runs', None)
+        if runs is None:
+            runs = TmsRuns(self.tms).runs
+        return (tuple((node.signature(), count) for node, count in self.repeats),
+                tuple((int(value), count) for value, count in runs),
+                tuple((numbits, ('var', value.index) if isinstance(value, TDIVariable) else
+                                ('*',) if isinstance(value, TDIDontCare) else value)
+                      for numbits, value in self.tdi),
+                tuple(self.tdo), self.prevread)
+
+    def __eq__(self, other):
+        ''' Templates compare equal if they have the same structure.
+        '''
+        if not isinstance(other, IOTemplate):
+            return NotImplemented
+        return self is other or self.signature() == other.signature()
+
+    def __hash__(self):
+        ''' Templates are mutable, so a template should not be
+            modified while it is being used as a dictionary key.
+        '''
+        return hash(self.signature())
+
     def loop(self):
         ''' loop/endloop pairs mark a section of the template
             that is to be repeated a fixed number of times.
@@ -140,7 +440,16 @@ class IOTemplate(object):
         '''
         prev, self.loopstack = self.loopstack, None
         assert type(prev) is type(self)
-        self.__dict__ = (prev + count * self).__dict__
+        assert count >= 0 and int(count) == count, count
+        body = type(self).__new__(type(self))
+        body.__dict__ = self.__dict__
+        if count and len(body):
+            shell = body.shell()
+            if count > 1:
+                shell = shell.protocol_mul(count)
+            prev.protocol_add(shell)
+        prev.add_repeat(body, count)
+        self.__dict__ = prev.__dict__
         return self
 
     def __add__(self, other):
@@ -150,6 +459,14 @@ class IOTemplate(object):
             construct.
         '''
         self = self.copy()
+        if other.repeats:
+            self.add_repeat(None, 0)
+            self.repeats.extend(other.repeats)
+            self.tms = other.tms.copy()
+            self.tdi = list(other.tdi)
+            self.tdo = list(other.tdo)
+            self.prevread = other.prevread
+            return self.protocol_add(other)
         tms, tdi, tdo = self.tms, self.tdi, self.tdo
         otms, otdi, otdo = other.tms, other.tdi, other.tdo
         if not otms:
@@ -181,6 +498,10 @@ class IOTemplate(object):
         assert multiplier >= 0 and int(multiplier) == multiplier, multiplier
         if multiplier == 0:
             return type(self)(self.cable)
+        if self.repeats and multiplier > 1:
+            new = self.shell()
+            new.add_repeat(self.copy(), multiplier)
+            return new.protocol_mul(multiplier)
         self = self.copy()
         tms, tdi, tdo = self.tms, self.tdi, self.tdo
         if multiplier == 1:
@@ -222,10 +543,48 @@ class IOTemplate(object):
             The function is passed a list of tdi elements to apply
             the template to, and if the template had any tdo elements
             in it, the function will return an iterable for the tdo
-            data.
+            data.  Each tdi element is a sequence of integers, or any
+            object that supports the buffer protocol (see packed_stream).
         '''
         devtemplate = self.devtemplate
         if devtemplate is None:
-            devtemplate = self.devtemplate = self.cable.make_template(self)
+            devtemplate = self.devtemplate = self.intern_template()
             self.apply_template = self.cable.apply_template
+            if instrument.profiler is not None:
+                self.apply_template = instrument.profiler.wrap_apply(self, self.apply_template)
+        for stream in tdi:
+            if type(stream) is not list:
+                tdi = [tdi_stream(x) for x in tdi]
+                break
         return self.apply_template(devtemplate, tdi)
+
+    def into(self, out, *tdi):
+        ''' Call the template, and store the TDO data into out
+            (see tdo_into) rather than returning an iterator.
+            Returns out.
+        '''
+        return tdo_into(self(*tdi), out)
+
+    def intern_template(self, interned=interned):
+        ''' Return the cable-specific version of the template.
+            Each cable keeps a table of the templates that have
+            been made for it, indexed by template signature, so
+            that structurally identical templates (e.g. templates
+            that are built over and over inside a loop) share a
+            single device template.
+        '''
+        cable = self.cable
+        make_template = cable.make_template
+        if instrument.profiler is not None:
+            make_template = instrument.profiler.wrap_compile(self, make_template)
+        try:
+            table = interned.get(cable)
+            if table is None:
+                table = interned[cable] = {}
+        except TypeError:   # Cable cannot be weakly referenced
+            return make_template(self)
+        key = self.signature()
+        devtemplate = table.get(key)
+        if devtemplate is None:
+            devtemplate = table[key] = make_template(self)
+        return devtemplate
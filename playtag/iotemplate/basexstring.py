@@ -12,7 +12,7 @@ Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
 License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
 '''
 import re
-from ..iotemplate import TDIVariable
+from ..iotemplate import TDIVariable, TDIDontCare
 
 class BaseXString(object):
     ''' This class contains code to help compile device-independent template
@@ -36,7 +36,8 @@ class BaseXString(object):
 
     x_splitter = re.compile('(x+)').split
 
-    def set_tdi_xstring(self, tdi_template, isinstance=isinstance, str=str, len=len, TDIVariable=TDIVariable):
+    def set_tdi_xstring(self, tdi_template, isinstance=isinstance, str=str, len=len,
+                        TDIVariable=TDIVariable, TDIDontCare=TDIDontCare):
         ''' Create a string of '0', '1', and 'x' based on the
             template TDI.  This string might later be modified by
             driver-specific code to insert commands for the JTAG
@@ -50,6 +51,8 @@ class BaseXString(object):
             if isinstance(value, TDIVariable):
                 addbits((numbits, value.index))
                 value = numbits * 'x'
+            elif isinstance(value, TDIDontCare):
+                value = numbits * '*'
             elif not isinstance(value, str):
                 if value < 0:
                     assert value == -1, value
@@ -89,7 +92,13 @@ class BaseXString(object):
         assert len(self.tdo_xstring) == self.transaction_bit_length
 
     def __init__(self, base_template, str=str):
-        self.tms_string = ''.join(str(x) for x in reversed(base_template.tms))
+        base_template = base_template.expand()
+        tms = base_template.tms
+        runs = getattr(tms, 'runs', None)
+        if runs is None:
+            self.tms_string = ''.join(str(x) for x in reversed(tms))
+        else:
+            self.tms_string = ''.join(str(value) * count for value, count in reversed(runs))
         self.transaction_bit_length = len(self.tms_string)
         self.set_tdi_xstring(base_template.tdi)
         self.set_tdo_xstring(base_template.tdo)
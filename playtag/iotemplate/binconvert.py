@@ -4,12 +4,19 @@ drivers which expect binary data.  This module is based on stringconvert,
 but is modified to use ctypes structures for the transfer, instead
 of converting to strings and back on every I/O transaction.
 
-Copyright (C) 2011 by Patrick Maupin.  All rights reserved.
-License information at: http://playtag.googlecode.com/svn/trunk/LICENSE.txt
+The TDI data is built by copying a default (constant) buffer, and then
+setting ctypes bitfields for the variable data.  The TDO data is extracted
+by mapping a ctypes structure directly onto the read buffer from the driver,
+and reading bitfields.  No bitfield crosses a 64 bit boundary in its
+structure, so every field is mapped by one of two structures:  one that
+is aligned to the start of the buffer, and one that is offset by 32 bits.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
 '''
-from itertools import islice, izip
-import itertools
-from .stringconvert import TemplateStrings
+from itertools import islice
+import ctypes
+from .basexstring import BaseXString
 
 
 def initial_default(AllFields, default):
@@ -22,25 +29,29 @@ def initial_default(AllFields, default):
         return init(default)
     return func
 
-def makeunion(fieldinfo, default):
+def makeunion(fieldinfo, numbytes, halfsize):
     ''' Create a union given a list of two lists of fields,
-        and a default value.
+        and the size of the buffer in bytes.  The fields in
+        the second list are offset by halfsize bytes.
     '''
-    bytetype = ctypes.c_uint8 * len(default)
+    bytetype = ctypes.c_uint8 * numbytes
     class FieldA(ctypes.Structure):
         _fields_ = fieldinfo[0]
+    class FieldC(ctypes.Structure):
+        _fields_ = fieldinfo[1]
     class FieldB(ctypes.Structure):
         _pack_ = 1
-        _fields_ = fieldinfo[1]
+        _anonymous_ = 'c',
+        _fields_ = [('offset', ctypes.c_uint8 * halfsize),
+                    ('c', FieldC),
+                    ]
     class AllFields(ctypes.Union):
         _anonymous_ = 'ab'
         _fields_ = [('a', FieldA),
                     ('b', FieldB),
                     ('bytes', bytetype),
                     ]
-    get_default = initial_default(AllFields, bytetype(*default))
-    del fieldinfo, default, bytetype, FieldA, FieldB
-    return AllFields, get_default
+    return AllFields
 
 class BinTemplate(BaseXString):
     ''' This class contains code to help compile device-independent template
@@ -55,37 +66,42 @@ class BinTemplate(BaseXString):
           2) Then, a device-specific customize_template method is called.  This
              class expects that TMS will be consumed and the TDI and TDO strings
              will be modified to insert commands and spacers for extra expected data.
+             By default, the strings are just padded to a multiple of 8 bits.
           3) Then the strings are examined to create ctypes class templates.
           4) Finally, the template is applied (possibly multiple times) to
              send/receive data.
     '''
 
     inttype = ctypes.c_uint64
-    halfinttype = ctypes.c_uint32
     intbits = 64
-    resolution = intbits / 2
+    resolution = intbits // 2
 
-    def hw_fields(self, len=len):
+    def customize_template(self):
+        ''' Pad the TDI and TDO strings out to a byte boundary.
+            (Remember that the last bit sent is at the start
+            of the string.)
+        '''
+        padding = -len(self.tdi_xstring) % 8
+        self.tdi_xstring = padding * '0' + self.tdi_xstring
+        self.tdo_xstring = padding * '*' + self.tdo_xstring
+
+    def hw_fields(self, xstring, len=len):
         ''' Generate tuples of offset/length pairs based on
-            cable driver dependent information from the TDI
-            string.
+            cable driver dependent information from a TDI
+            or TDO string.
         '''
         total_offset = 0
-        total_bitlen = 0
-        lengths = [len(x) for x in self.x_splitter(self.tdi_xstring)]
+        lengths = [len(x) for x in self.x_splitter(xstring)]
         lengths.reverse()
-        for offset, bitlen in (izip(islice(lengths, 0, None, 2),
-                               izip(islice(lengths, 1, None, 2)):
+        for offset, bitlen in zip(islice(lengths, 0, None, 2),
+                                  islice(lengths, 1, None, 2)):
             total_offset += offset
             yield total_offset, bitlen
             total_offset += bitlen
-            total_bitlen += bitlen
-        assert total_offset + len(strings[0]) == len(self.tdi_xstring)
-        self.hw_bitlen = total_bitlen
-
+        assert total_offset + lengths[-1] == len(xstring)
 
-    def sw_fields(self, len=len):
-        ''' Generate tuples of (numbits, index, subindex) based on
+    def tdi_sw_fields(self, len=len):
+        ''' Generate tuples of (numbits, (index, subindex)) based on
             expected TDI values from higher layer when the template
             is applied.
         '''
@@ -94,95 +110,111 @@ class BinTemplate(BaseXString):
             missing = index + 1 - len(counts)
             if missing:
                 counts.extend(missing * [0])
-            yield numbits, index, counts[index]
+            yield numbits, (index, counts[index])
             counts[index] += 1
-            total_bits += numbits
-        self.sw_bitlen = total_bitlen
         self.tdi_counts = counts
 
-    def combine_fields(self):
+    def tdo_sw_fields(self):
+        ''' Generate tuples of (numbits, wordnum) based on
+            expected TDO values returned to the higher layer.
+        '''
+        return ((numbits, wordnum) for (wordnum, numbits) in enumerate(self.tdo_bits))
+
+    def combine_fields(self, hw_fields, sw_fields, prefix):
         ''' Combine the cable-driver hardware-specific fields
-            with the upper layer TDI information fields to
-            determine how to extract TDI information and
+            with the upper layer information fields to
+            determine how to extract information and
             where to put it in our structure.
             Return tuples of
                ( hw_field_name,    # unique name
-                 hw_offset,        # Bit offset into TDI output string
+                 hw_offset,        # Bit offset into hardware buffer
                  numbits,          # Number of bits in this (sub)field
-                 sw_index,         # first index into TDI data structure
-                 sw_subindex,      # second index into TDI data structure
-                 sw_shift)         # distance to shift TDI input
+                 sw_key,           # where the data comes from / goes to
+                 sw_shift)         # distance to shift data
         '''
         intbits = self.intbits
         resolution = self.resolution
-        sw_fields = list(self.sw_fields)
+        sw_fields = list(sw_fields)
         sw_field_index = 0
         sw_bits = 0
+        hw_bitlen = 0
         hw_field_index = 0
-        for hw_offset, hw_bits in self.hw_fields:
+        for hw_offset, hw_bits in hw_fields:
+            hw_bitlen += hw_bits
             while hw_bits:
                 if not sw_bits:
-                    sw_bits, sw_index, sw_subindex = sw_fields[sw_field_index]
+                    sw_bits, sw_key = sw_fields[sw_field_index]
                     sw_field_index += 1
                     sw_shift = 0
                 take = min(hw_bits, sw_bits, intbits - hw_offset % resolution)
-                hw_field_name = 'field%04d' % hw_field_index
+                hw_field_name = '%s%04d' % (prefix, hw_field_index)
                 hw_field_index += 1
-                yield hw_field_name, hw_offset, take, sw_index, sw_subindex, sw_shift
+                yield hw_field_name, hw_offset, take, sw_key, sw_shift
                 hw_offset += take
                 hw_bits -= take
                 sw_bits -= take
                 sw_shift += take
-        assert sw_field_index == len(sw_fields)
-        assert self.hw_bitlen == self.sw_bitlen
+        assert sw_field_index == len(sw_fields) and not sw_bits
+        assert hw_bitlen == sum(x[0] for x in sw_fields)
 
-    def structfields(self, fieldlists, index):
-        ''' Normalize one of our fieldlists
-            into a format that ctypes expects for _fields_.
+    def structfields(self, fieldlist):
+        ''' Normalize one of our fieldlists into a format
+            that ctypes expects for _fields_, adding dummy
+            fields as required.  Dummy fields never cross
+            a 64 bit boundary.
         '''
         inttype = self.inttype
         intbits = self.intbits
-        if index:
-            yield ('offset', halfinttype, self.resolution)
         offset = 0
         dummycount = 0
-        for fieldname, fieldoffset, fieldbits in fieldlists[index]:
-            delta = fieldoffset - offset
-            firstdummy = min(delta, -offset % intbits)
-            for dummybits in (firstdummy, delta - firstdummy):
-                if dummybits:
-                    yield 'dummy%d' % dummycount, inttype, dummybits
+        for fieldname, fieldoffset, fieldbits in fieldlist:
+            while offset < fieldoffset:
+                dummybits = min(fieldoffset - offset, intbits - offset % intbits)
+                yield 'dummy%d' % dummycount, inttype, dummybits
+                dummycount += 1
+                offset += dummybits
             yield fieldname, inttype, fieldbits
             offset = fieldoffset + fieldbits
 
+    def makeunion(self, fields, numbytes):
+        ''' Take (hw_field_name, hw_offset, numbits) field information,
+            split it into fields that belong to each of the two
+            structures, and create the ctypes union.
+        '''
+        resolution = self.resolution
+        fieldinfo = [], []
+        for hw_field_name, hw_offset, numbits in fields:
+            fieldsel = hw_offset & resolution
+            fieldinfo[bool(fieldsel)].append((hw_field_name, hw_offset - fieldsel, numbits))
+        fieldinfo = [list(self.structfields(x)) for x in fieldinfo]
+        return makeunion(fieldinfo, numbytes, resolution // 8)
+
     def setupfields(self):
         ''' Take combined hw/sw field info from combine_fields() and
             split it into hw structure field info, and sw conversion
-            info.  Then normalize the hw structure field info,
-            get our default output value (non-variable information),
-            and create our ctypes structure.  Finally, modify
-            the sw conversion info to directly access the correct
+            info.  Then get our default output value (non-variable
+            information), and create our ctypes structure.  Finally,
+            modify the sw conversion info to directly access the correct
             setter inside the ctypes structure.
         '''
-        resolution = self.resolution
-        fieldinfo = [], []
+        fields = []
         convert = []
-        for (hw_field_name, hw_offset, numbits,
-                sw_index, sw_subindex, sw_shift) in self.combine_fields():
-            convert.append((hw_field_name, sw_index, sw_subindex, sw_shift))
-            fieldsel = hw_offset & resolution
-            fieldinfo[bool(fieldsel)].append((hw_field_name, hw_offset - fieldsel, numbits))
-        fieldinfo = [list(self.structfields(fieldinfo, x)) for x in range(len(fieldinfo))]
-        default = self.tdi_xstring.replace('x', '0')
+        for (hw_field_name, hw_offset, numbits, sw_key, sw_shift) in self.combine_fields(
+                self.hw_fields(self.tdi_xstring), self.tdi_sw_fields(), 'tdi'):
+            fields.append((hw_field_name, hw_offset, numbits))
+            convert.append((hw_field_name, sw_key, sw_shift))
+        default = self.tdi_xstring.replace('x', '0').replace('*', '0')
         assert not len(default) % 8
-        default = [int(default[x:x+8] for x in range(len(default)-8, -1, -8)]
-        AllFields, get_default = makeunion(fieldinfo, default)
+        self.tdi_numbytes = numbytes = len(default) // 8
+        default = int(default or '0', 2).to_bytes(numbytes, 'little')
+        AllFields = self.makeunion(fields, numbytes)
+        default += bytes(ctypes.sizeof(AllFields) - numbytes)
+        get_default = initial_default(AllFields, default)
 
-        convert = [(getattr(AllFields, hw_field_name).__set__, sw_index, sw_subindex, sw_shift)
-                       for (hw_field_name, sw_index, sw_subindex, sw_shift) in convert]
+        convert = [(getattr(AllFields, hw_field_name).__set__, index, subindex, sw_shift)
+                       for (hw_field_name, (index, subindex), sw_shift) in convert]
         return get_default, convert
 
-
     def get_tdi_builder(self, len=len, sum=sum):
         ''' Create a closure function that will use
             the information from setupfields() to
@@ -191,7 +223,7 @@ class BinTemplate(BaseXString):
         '''
         get_default, convert = self.setupfields()
         counts = self.tdi_counts
-        def tdi_combiner(tdi):
+        def tdi_builder(tdi):
             lengths = [len(x) for x in tdi]
             if lengths != counts and (counts or sum(lengths)):
                 raise ValueError("Expected %s TDI elements; got %s" % (counts, lengths))
@@ -200,3 +232,60 @@ class BinTemplate(BaseXString):
                 setter(x, tdi[index][subindex] >> shift)
             return x
         return tdi_builder
+
+    def get_tdo_extractor(self, len=len):
+        ''' Create a closure function that maps a ctypes structure
+            onto the read buffer from the driver, and extracts
+            a list of integers.
+        '''
+        fields = []
+        convert = []
+        for (hw_field_name, hw_offset, numbits, wordnum, sw_shift) in self.combine_fields(
+                self.hw_fields(self.tdo_xstring), self.tdo_sw_fields(), 'tdo'):
+            fields.append((hw_field_name, hw_offset, numbits))
+            convert.append((hw_field_name, wordnum, sw_shift))
+        assert not len(self.tdo_xstring) % 8
+        self.tdo_numbytes = numbytes = len(self.tdo_xstring) // 8
+        AllFields = self.makeunion(fields, numbytes)
+        size = ctypes.sizeof(AllFields)
+        from_buffer = AllFields.from_buffer
+        from_buffer_copy = AllFields.from_buffer_copy
+        words = [[] for x in self.tdo_bits]
+        for hw_field_name, wordnum, sw_shift in convert:
+            words[wordnum].append((getattr(AllFields, hw_field_name).__get__, sw_shift))
+        single = None
+        if all(len(x) == 1 for x in words):
+            single = [x[0][0] for x in words]
+
+        def tdo_extractor(buffer):
+            ''' The buffer might be reused by the driver,
+                so extract all the data immediately.
+            '''
+            if len(buffer) < size:
+                x = from_buffer_copy(bytes(buffer) + bytes(size - len(buffer)))
+            else:
+                x = from_buffer(buffer)
+            if single is not None:
+                return iter([getter(x) for getter in single])
+            return iter([sum(getter(x) << shift for (getter, shift) in word) for word in words])
+        return tdo_extractor
+
+    def get_xfer_func(self):
+        ''' Create the transfer function.  The driver is called
+            with the ctypes TDI structure and the number of bytes
+            to write and read, and should return a writable
+            buffer that contains the read data.
+        '''
+        self.customize_template()
+        tdi_builder = self.get_tdi_builder()
+        tdi_length = self.tdi_numbytes
+        if self.tdo_bits:
+            tdo_extractor = self.get_tdo_extractor()
+            tdo_length = self.tdo_numbytes
+            def func(driver, tdi_array):
+                return tdo_extractor(driver.xfer_buffer(tdi_builder(tdi_array), tdi_length, tdo_length))
+        else:
+            def func(driver, tdi_array):
+                driver.xfer_buffer(tdi_builder(tdi_array), tdi_length, 0)
+        vars(self).clear()
+        return func
@@ -0,0 +1,49 @@
+'''
+This module compiles template-specific functions from generated
+Python source.
+
+The generic TDI combiners and TDO extractors loop over lists of
+fields on every call.  For small templates (e.g. register accesses
+that are called thousands of times) that overhead dominates, so the
+template compilers instead generate straight-line source for a
+function that is specialized to the field layout of the template,
+with all the offsets and masks written in as constants.
+
+Layouts repeat a lot (e.g. every 32 bit register read in a chain
+looks the same), so the compiled code is cached by source, and the
+function is created from the cached code with the objects it needs.
+Large templates have too many fields to unroll, so they keep using
+the generic functions.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+
+# Templates with more terms than this use the generic functions
+maxterms = 64
+
+# Code objects, indexed by source
+compiled = {}
+maxcompiled = 4096
+
+def make_function(name, lines, namespace=None, compiled=compiled):
+    ''' Compile source lines that define the function called
+        name, and return the function.  The namespace supplies
+        the globals the function uses.
+    '''
+    source = '\n'.join(lines) + '\n'
+    code = compiled.get(source)
+    if code is None:
+        if len(compiled) >= maxcompiled:
+            compiled.clear()
+        code = compiled[source] = compile(source, '<playtag %s>' % name, 'exec')
+    namespace = dict(namespace or ())
+    exec(code, namespace)
+    return namespace[name]
+
+def or_terms(terms, indent='        '):
+    ''' Return source for an expression that ORs the terms together.
+    '''
+    if not terms:
+        return '0'
+    return ('\n%s| ' % indent).join('(%s)' % x for x in terms)
@@ -0,0 +1,50 @@
+'''
+This module contains support for deferred template execution.
+
+Normally, when an IO template with TDO data is called, the cable
+driver performs the transfer and returns an iterator for the TDO data.
+A cable driver that supports batching may instead queue the transfer
+and return a DeferredTdo object.  The DeferredTdo object can be
+iterated (or passed to next()) just like the normal result, but
+doing so forces the cable driver to flush its queue, if it has
+not already done so.  It can also be passed to tdo_into().
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+from ..iotemplate import tdo_into
+
+class DeferredTdo(object):
+    ''' Lazy result for a queued template.  The cable driver
+        passes a flush function that will perform all queued
+        transfers, and calls resolve() with the TDO iterator
+        when the transfer for this template has completed.
+    '''
+    __slots__ = 'flush', 'result'
+
+    def __init__(self, flush):
+        self.flush = flush
+        self.result = None
+
+    def resolve(self, result):
+        self.result = result
+        self.flush = None
+
+    @property
+    def done(self):
+        return self.flush is None
+
+    def get_result(self):
+        if self.flush is not None:
+            self.flush()
+            assert self.flush is None, "Cable driver did not resolve deferred TDO"
+        return self.result
+
+    def __iter__(self):
+        return iter(self.get_result())
+
+    def __next__(self):
+        return next(iter(self))
+
+    def into(self, out):
+        return tdo_into(self.get_result(), out)
@@ -0,0 +1,150 @@
+'''
+This module contains a persistent on-disk cache for compiled templates.
+
+Compiling a template for a cable can take a significant amount of
+time for long templates, and programs such as tools/jtag/xilinx_xvc.py
+or fpgabus.BusDriver build the same templates every time they start.
+
+Compiled transfer functions are closures, which cannot be saved, so
+instead, template engines that support caching provide two methods:
+
+    get_cache_state() -- return a picklable object with the results
+                         of compiling the template
+    from_cache_state(state) -- a classmethod that recreates the engine
+                         instance, ready for get_xfer_func(), from
+                         a saved state
+
+The cache is content-addressed.  The key is a hash of the template
+structure (TMS runs, TDI and TDO lists, and loop nodes), the cable
+type, and the engine type and its cache_version.  An engine should
+change its cache_version whenever the format of its compiled data
+changes.
+
+The total size of the cache directory is bounded; when a new file
+would make it larger than the maximum size, the least recently used
+files are deleted.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import os
+import hashlib
+import pickle
+
+CACHE_SIZE = 64 * 1024 * 1024   # Default maximum bytes in the cache directory
+
+
+def typename(cls):
+    return '%s.%s' % (cls.__module__, cls.__qualname__)
+
+def template_key(cable, engine, template):
+    ''' Return the cache key for a template compiled by the
+        given engine for the given cable.
+    '''
+    digest = hashlib.sha1()
+    digest.update(('%s %s %s\n' % (typename(type(cable)), typename(engine),
+                                   getattr(engine, 'cache_version', 0))).encode())
+    digest.update(repr(template.signature()).encode())
+    return digest.hexdigest()
+
+
+class TemplateCache(object):
+    ''' A directory of pickled compiled template states.
+    '''
+
+    def __init__(self, directory, maxsize=CACHE_SIZE):
+        self.directory = os.path.expanduser(directory)
+        self.maxsize = maxsize
+        os.makedirs(self.directory, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        ''' Return a TemplateCache for the TEMPLATE_CACHE_DIR
+            configuration variable, or None if it is not set.
+        '''
+        directory = getattr(config, 'TEMPLATE_CACHE_DIR', None)
+        if not directory:
+            return None
+        return cls(directory, getattr(config, 'TEMPLATE_CACHE_SIZE', CACHE_SIZE))
+
+    def fname(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    def get(self, key):
+        ''' Return the cached state for the key, or None.
+            A file that cannot be read is treated as missing.
+        '''
+        fname = self.fname(key)
+        try:
+            with open(fname, 'rb') as f:
+                state = pickle.load(f)
+            os.utime(fname)   # Mark it as recently used
+        except FileNotFoundError:
+            return None
+        except Exception:
+            self.discard(fname)
+            return None
+        return state
+
+    def put(self, key, state):
+        ''' Save the state for the key.  The file is written
+            under a temporary name and then renamed, so that
+            several processes can share the cache directory.
+        '''
+        fname = self.fname(key)
+        tmpname = '%s.%d.tmp' % (fname, os.getpid())
+        try:
+            with open(tmpname, 'wb') as f:
+                pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, fname)
+        except OSError:
+            self.discard(tmpname)
+            return
+        self.evict()
+
+    def discard(self, fname):
+        try:
+            os.remove(fname)
+        except OSError:
+            pass
+
+    def evict(self):
+        ''' Delete the least recently used files until the
+            cache is no larger than maxsize.
+        '''
+        files = []
+        total = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.pickle'):
+                    continue
+                try:
+                    info = entry.stat()
+                except OSError:
+                    continue
+                files.append((info.st_mtime, info.st_size, entry.path))
+                total += info.st_size
+        if total <= self.maxsize:
+            return
+        files.sort()
+        for mtime, size, fname in files:
+            self.discard(fname)
+            total -= size
+            if total <= self.maxsize:
+                break
+
+    def compile(self, cable, engine, template):
+        ''' Return a transfer function for the template.  The
+            compiled state is retrieved from, or saved to, the
+            cache if the engine supports it.
+        '''
+        if not hasattr(engine, 'from_cache_state'):
+            return engine(template).get_xfer_func()
+        key = template_key(cable, engine, template)
+        state = self.get(key)
+        if state is not None:
+            compiled = engine.from_cache_state(state)
+        else:
+            compiled = engine(template)
+            self.put(key, compiled.get_cache_state())
+        return compiled.get_xfer_func()
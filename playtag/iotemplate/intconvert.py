@@ -0,0 +1,580 @@
+'''
+This module contains code to optimize application of I/O templates for
+drivers which can accept integer data.  Unlike stringconvert, nothing
+in here ever creates a string of '0' and '1' characters.  TMS, TDI and
+TDO are each kept as a single Python integer, where bit 0 is the first
+bit in time, and the template compiler precomputes a plan of shifts
+and masks to splice variable TDI data into the constant TDI integer,
+and to pull variable TDO data back out of the returned integer.
+
+Variable data is moved in runs -- a run is a sequence of consecutive
+elements from one TDI stream (or TDO result) that all have the same
+bit width.  Runs of 8, 16, 32 or 64 bit elements are packed and
+unpacked with the struct module, so that large block transfers do not
+require a Python operation per bit.  TDI streams that are packed_stream()
+memoryviews are converted without looking at each element, and TDO is
+returned as a TdoValues object that can be copied straight into a
+buffer by tdo_into().
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import sys
+import itertools
+import struct
+
+from ..iotemplate import TDIVariable, TDIDontCare, packed_stream, tdo_into
+from . import codegen
+
+structcodes = {8: 'B', 16: 'H', 32: 'I', 64: 'Q'}
+
+
+def join_bits(pieces):
+    ''' Concatenate a list of (value, numbits) pieces into
+        a single integer.  The first piece ends up in the
+        least significant bits.  Pieces are combined pairwise,
+        so that joining many small pieces into a large integer
+        does not become quadratic.
+    '''
+    while len(pieces) > 1:
+        merged = [(a | b << alen, alen + blen) for ((a, alen), (b, blen))
+                      in zip(pieces[0::2], pieces[1::2])]
+        if len(pieces) & 1:
+            merged.append(pieces[-1])
+        pieces = merged
+    return pieces[0][0] if pieces else 0
+
+def repeat_bits(value, numbits, count):
+    ''' Return an integer that contains count copies of
+        the numbits-wide value.  The number of copies is
+        doubled at each step, so this is fast even for
+        large counts.
+    '''
+    result = 0
+    position = 0
+    while count:
+        if count & 1:
+            result |= value << position
+            position += numbits
+        count >>= 1
+        if count:
+            value |= value << numbits
+            numbits *= 2
+    return result
+
+def repeat_fields(fields, numbits, count, start):
+    ''' Given a list of (offset, numbits) fields for a template
+        that is numbits long, return the list of fields for count
+        copies of the template, starting at bit start.  Fields
+        that touch across copies are merged.
+    '''
+    if not fields or not count:
+        return []
+    if len(fields) == 1 and fields[0] == (0, numbits):
+        return [(start, numbits * count)]
+    result = [(start + base + offset, length) for base in range(0, numbits * count, numbits)
+                                              for (offset, length) in fields]
+    first, last = fields[0], fields[-1]
+    if first[0] == 0 and sum(last) == numbits:
+        merged = result[:1]
+        for field in result[1:]:
+            prev = merged[-1]
+            if sum(prev) == field[0]:
+                merged[-1] = prev[0], prev[1] + field[1]
+            else:
+                merged.append(field)
+        result = merged
+    return result
+
+def field_mask(fields):
+    ''' Return an integer with all the bits set for a list
+        of (offset, numbits) fields, which must be in order.
+    '''
+    pieces = []
+    position = 0
+    for offset, numbits in fields:
+        pieces.append((0, offset - position))
+        pieces.append(((1 << numbits) - 1, numbits))
+        position = offset + numbits
+    return join_bits(pieces)
+
+def add_fields(fields, newfields):
+    ''' Add newfields to fields, merging the first new
+        field with the last old one if they touch.
+    '''
+    if fields and newfields and sum(fields[-1]) == newfields[0][0]:
+        fields[-1] = fields[-1][0], fields[-1][1] + newfields[0][1]
+        newfields = newfields[1:]
+    fields.extend(newfields)
+
+def pack_run(values, width, structcodes=structcodes, join_bits=join_bits,
+             memoryview=memoryview, little=sys.byteorder == 'little'):
+    ''' Pack a sequence of width-bit values into a single
+        integer, with values[0] in the least significant bits.
+        A packed stream (memoryview) of width-bit elements is
+        converted directly, without looking at each element.
+        Values are masked to width bits, as they are when a
+        template splices in a single value.
+    '''
+    code = structcodes.get(width)
+    if code is not None:
+        if type(values) is memoryview and values.itemsize * 8 == width and little:
+            return int.from_bytes(values, 'little')
+        try:
+            return int.from_bytes(struct.pack('<%d%s' % (len(values), code), *values), 'little')
+        except struct.error:
+            pass    # A value is negative or too wide, so mask them all
+    mask = (1 << width) - 1
+    return join_bits([(x & mask, width) for x in values])
+
+def unpack_run(value, count, width, structcodes=structcodes):
+    ''' Unpack count width-bit values from an integer, starting
+        at the least significant bit.  The integer must not have
+        any bits set above count * width.
+    '''
+    data = value.to_bytes((count * width + 7) // 8, 'little')
+    code = structcodes.get(width)
+    if code is not None:
+        return struct.unpack('<%d%s' % (count, code), data)
+    mask = (1 << width) - 1
+    from_bytes = int.from_bytes
+    return [from_bytes(data[x >> 3 : (x + width + 7) >> 3], 'little') >> (x & 7) & mask
+                for x in range(0, count * width, width)]
+
+class TdoFields(object):
+    ''' Describes the bit widths of the TDO values returned by a
+        template, and wraps the integer holding those values (with
+        the first value in the least significant bits) in a TdoValues
+        object when called.
+
+        If every value but the last is width bits, and the last is
+        not larger, then the integer has the same layout as an array
+        of width-bit elements, and can be copied straight into one.
+    '''
+
+    def __init__(self, widths):
+        runs = [(numbits, len(list(group))) for numbits, group in itertools.groupby(widths)]
+        self.runs = [(count, numbits, (1 << (count * numbits)) - 1) for numbits, count in runs]
+        self.count = len(widths)
+        self.width = None
+        if widths and all(x == widths[0] for x in widths[:-1]) and widths[-1] <= widths[0]:
+            self.width = widths[0]
+        if self.count <= codegen.maxterms:
+            self.unpack = self.make_unpacker(widths)
+
+    def make_unpacker(self, widths):
+        ''' Return a generated function that unpacks a short
+            list of values with a single list display.
+        '''
+        terms = []
+        offset = 0
+        for numbits in widths:
+            terms.append('value >> %d & %#x' % (offset, (1 << numbits) - 1))
+            offset += numbits
+        return codegen.make_function('unpack', [
+            'def unpack(value):',
+            '    return [%s]' % ', '.join(terms),
+        ])
+
+    def __call__(self, value):
+        return TdoValues(value, self)
+
+    def unpack(self, value, unpack_run=unpack_run):
+        result = []
+        for count, numbits, mask in self.runs:
+            result.extend(unpack_run(value & mask, count, numbits))
+            value >>= count * numbits
+        return result
+
+class TdoValues(object):
+    ''' An iterator over the TDO values from one template call.
+        The values are kept packed in a single integer until they
+        are needed, so that into() can copy them into a buffer
+        without creating an integer object for each value.
+    '''
+    __slots__ = 'value', 'fields', 'values'
+
+    def __init__(self, value, fields):
+        self.value = value
+        self.fields = fields
+        self.values = None
+
+    def __iter__(self):
+        values = self.values
+        if values is None:
+            values = self.values = iter(self.fields.unpack(self.value))
+        return values
+
+    def __next__(self):
+        return next(iter(self))
+
+    def into(self, out, little=sys.byteorder == 'little'):
+        ''' Store the values into out (see iotemplate.tdo_into).
+        '''
+        view = packed_stream(out)
+        fields = self.fields
+        if fields.width != view.itemsize * 8 or not little:
+            return tdo_into(iter(self), out)
+        numbytes = fields.count * view.itemsize
+        if numbytes > view.nbytes:
+            raise ValueError('%d TDO values do not fit in %d elements' % (fields.count, len(view)))
+        view.cast('B')[:numbytes] = self.value.to_bytes(numbytes, 'little')
+        return out
+
+def read_converter(reads, from_bytes=int.from_bytes, join_bits=join_bits):
+    ''' Return a function that takes the bytes read from the device,
+        and gathers the TDO data from them into a single integer.
+        reads is a list of (start, end, shift, offset, numbits) for
+        each piece, where the numbits data bits start at bit shift
+        of data[start:end], and belong at offset in the integer.
+    '''
+    if len(reads) <= codegen.maxterms:
+        terms = []
+        for start, end, shift, offset, numbits in reads:
+            if end == start + 1:
+                piece = 'data[%d]' % start
+            else:
+                piece = "from_bytes(data[%d:%d], 'little')" % (start, end)
+            terms.append('(%s >> %d & %#x) << %d' % (piece, shift, (1 << numbits) - 1, offset))
+        return codegen.make_function('converter', [
+            'def converter(data, from_bytes=from_bytes):',
+            '    return (%s)' % codegen.or_terms(terms),
+        ], dict(from_bytes=from_bytes))
+
+    plan = []
+    position = 0
+    for start, end, shift, offset, numbits in reads:
+        plan.append((start, end, shift, (1 << numbits) - 1, numbits, offset - position))
+        position = offset + numbits
+
+    def converter(data):
+        pieces = []
+        for start, end, shift, mask, numbits, gap in plan:
+            if gap:
+                pieces.append((0, gap))
+            pieces.append((from_bytes(data[start:end], 'little') >> shift & mask, numbits))
+        return join_bits(pieces)
+    return converter
+
+def check_lengths(tdi, counts):
+    ''' Raise an exception if the TDI streams do not have
+        the number of elements the template expects.
+    '''
+    lengths = [len(x) for x in tdi]
+    if lengths != counts and (counts or sum(lengths)):
+        raise ValueError("Expected %s TDI elements; got %s" % (counts, lengths))
+
+def group_runs(fields):
+    ''' Given a list of (numbits, index) tuples in time order,
+        return a list of (index, firstsub, count, numbits) runs, and
+        a list of counts of elements used in each index.
+    '''
+    counts = []
+    runs = []
+    for (numbits, index), group in itertools.groupby(fields):
+        missing = index + 1 - len(counts)
+        if missing:
+            counts.extend(missing * [0])
+        count = len(list(group))
+        runs.append((index, counts[index], count, numbits))
+        counts[index] += count
+    return runs, counts
+
+
+class TemplateInts(object):
+    ''' This class compiles device-independent template information
+        into an integer-based transfer function:
+
+          1) The TMS list is turned into an integer, and the TDI list
+             is turned into a constant integer, plus a list of places
+             where variable data is spliced in.  The TDO list is turned
+             into a list of places where variable data is gathered from.
+          2) Subclasses may modify those (e.g. to insert cable commands
+             into the TDI data) before the transfer function is created.
+          3) A transfer function is created that calls the driver with
+             (tms, tdi, numbits, usetdo), where tms and tdi are integers,
+             and that converts the integer returned by the driver into
+             the TDO data for the caller.
+
+        Attributes used by the combiner and extractor:
+
+            tdi_const -- integer with all the constant TDI bits
+            tdi_dontcare -- integer with a bit set for each TDI bit
+                            that the template does not care about
+            tdi_splice -- list of (offset, numbits) locations in the
+                          TDI integer where variable bits are placed,
+                          in the same order as the variable data
+            tdi_bits -- list of (numbits, index) for each TDIVariable,
+                        in time order
+            tdo_gather -- list of (offset, numbits) locations in the
+                          integer returned from the driver where TDO
+                          data is found, in time order
+            tdo_bits -- list of numbits for each TDO value returned
+
+        The compiled attributes may be saved and restored by the
+        template disk cache (see diskcache.py).  cache_version must
+        be changed whenever the meaning of the attributes changes.
+    '''
+    cache_version = 1
+
+    def __init__(self, base_template):
+        if base_template.repeats:
+            self.set_repeats(base_template)
+        else:
+            self.set_tms(base_template.tms)
+            self.set_tdi(base_template.tdi)
+            self.set_tdo(base_template.tdo)
+
+    def set_repeats(self, base_template):
+        ''' Build our attributes for a template that has
+            repeated nodes.  Each node is only compiled
+            once, and then its results are replicated.
+        '''
+        tms = []
+        tdi = []
+        dontcare = []
+        self.tdi_bits = []
+        self.tdi_splice = []
+        self.tdo_bits = []
+        self.tdo_gather = []
+        offset = 0
+        nodes = list(base_template.repeats)
+        nodes.append((base_template.tail(), 1))
+        for node, count in nodes:
+            node = TemplateInts(node)
+            numbits = node.transaction_bit_length
+            if not numbits or not count:
+                continue
+            total = numbits * count
+            tms.append((repeat_bits(node.tms, numbits, count), total))
+            tdi.append((repeat_bits(node.tdi_const, numbits, count), total))
+            dontcare.append((repeat_bits(node.tdi_dontcare, numbits, count), total))
+            self.tdi_bits.extend(node.tdi_bits * count)
+            self.tdo_bits.extend(node.tdo_bits * count)
+            add_fields(self.tdi_splice, repeat_fields(node.tdi_splice, numbits, count, offset))
+            add_fields(self.tdo_gather, repeat_fields(node.tdo_gather, numbits, count, offset))
+            offset += total
+        self.transaction_bit_length = offset
+        self.tms = join_bits(tms)
+        self.tdi_const = join_bits(tdi)
+        self.tdi_dontcare = join_bits(dontcare)
+
+    def get_cache_state(self):
+        ''' Return a picklable copy of our compiled attributes.
+        '''
+        return dict(vars(self))
+
+    @classmethod
+    def from_cache_state(cls, state):
+        ''' Recreate a compiled instance from get_cache_state() data.
+        '''
+        self = cls.__new__(cls)
+        vars(self).update(state)
+        return self
+
+    def set_tms(self, tms_template):
+        self.transaction_bit_length = len(tms_template)
+        runs = getattr(tms_template, 'runs', None)
+        if runs is None:
+            runs = ((x, len(list(y))) for x, y in itertools.groupby(tms_template))
+        self.tms = join_bits([(value and (1 << numbits) - 1, numbits) for value, numbits in runs])
+
+    def set_tdi(self, tdi_template, isinstance=isinstance, str=str,
+                TDIVariable=TDIVariable, TDIDontCare=TDIDontCare):
+        ''' Create the constant TDI integer, and the list of locations
+            in it that must be filled in with variable data.
+        '''
+        self.tdi_bits = tdi_bits = []
+        self.tdi_splice = splice = []
+        pieces = []
+        dontcare = 0
+        offset = 0
+        for numbits, value in tdi_template:
+            if isinstance(value, TDIVariable):
+                tdi_bits.append((numbits, value.index))
+                if splice and sum(splice[-1]) == offset:
+                    splice[-1] = splice[-1][0], splice[-1][1] + numbits
+                else:
+                    splice.append((offset, numbits))
+                value = 0
+            elif isinstance(value, TDIDontCare):
+                dontcare |= ((1 << numbits) - 1) << offset
+                value = 0
+            elif isinstance(value, str):
+                assert len(value) == numbits, (value, numbits)
+                if '*' in value:
+                    dontcare |= int(value.replace('1', '0').replace('*', '1'), 2) << offset
+                value = int(value.replace('*', '0') or '0', 2)
+            elif value < 0:
+                assert value == -1, value
+                value = (1 << numbits) - 1
+            assert 0 <= value < (1 << numbits) or not numbits, (value, numbits)
+            pieces.append((value, numbits))
+            offset += numbits
+        assert offset == self.transaction_bit_length, (offset, self.transaction_bit_length)
+        self.tdi_const = join_bits(pieces)
+        self.tdi_dontcare = dontcare
+
+    def set_tdo(self, tdo_template):
+        ''' Create the list of locations where TDO data is retrieved.
+            Adjacent locations are merged into a single location.
+        '''
+        self.tdo_bits = []
+        self.tdo_gather = gather = []
+        start = 0
+        prevlen = 0
+        for offset, numbits in tdo_template:
+            assert offset >= prevlen or not gather, (offset, prevlen)
+            start += offset
+            self.tdo_bits.append(numbits)
+            if gather and sum(gather[-1]) == start:
+                gather[-1] = gather[-1][0], gather[-1][1] + numbits
+            else:
+                gather.append((start, numbits))
+            prevlen = numbits
+        assert start + prevlen <= self.transaction_bit_length
+
+    def tdi_segments(self):
+        ''' Return a list of (index, firstsub, count, numbits, offset)
+            segments of variable TDI data, where each segment holds
+            elements from one stream that are consecutive both in the
+            stream and in the TDI integer, and a list of the number of
+            elements used from each stream.  Returns None if there are
+            too many segments to generate code for.
+        '''
+        splice = iter(self.tdi_splice)
+        segments = []
+        counts = []
+        offset = end = 0
+        for numbits, index in self.tdi_bits:
+            if not numbits:
+                return None
+            if offset == end:
+                offset, length = next(splice)
+                end = offset + length
+            missing = index + 1 - len(counts)
+            if missing:
+                counts.extend(missing * [0])
+            sub = counts[index]
+            counts[index] += 1
+            if segments:
+                previndex, prevsub, prevcount, prevbits, prevoffset = segments[-1]
+                if (previndex == index and prevbits == numbits and prevsub + prevcount == sub and
+                        prevoffset + prevcount * numbits == offset):
+                    segments[-1] = previndex, prevsub, prevcount + 1, numbits, prevoffset
+                    offset += numbits
+                    continue
+            if len(segments) == codegen.maxterms:
+                return None
+            segments.append((index, sub, 1, numbits, offset))
+            offset += numbits
+        return segments, counts
+
+    def make_tdi_combiner(self, segments, counts):
+        ''' Return a generated combiner that splices each
+            segment directly into the constant TDI data.
+        '''
+        lines = ['def tdi_combiner(tdi, len=len, pack_run=pack_run):']
+        tests = ['len(tdi) != %d' % len(counts)]
+        tests.extend('len(tdi[%d]) != %d' % x for x in enumerate(counts))
+        lines.append('    if %s:' % ' or '.join(tests))
+        lines.append('        check_lengths(tdi, %r)' % counts)
+        lines.extend('    t%d = tdi[%d]' % (x, x) for x, count in enumerate(counts) if count)
+        terms = ['%#x' % self.tdi_const] if self.tdi_const else []
+        for index, sub, count, numbits, offset in segments:
+            if count == 1:
+                terms.append('(t%d[%d] & %#x) << %d' % (index, sub, (1 << numbits) - 1, offset))
+            else:
+                terms.append('pack_run(t%d[%d:%d], %d) << %d' % (index, sub, sub + count, numbits, offset))
+        lines.append('    return (%s)' % codegen.or_terms(terms))
+        return codegen.make_function('tdi_combiner', lines,
+                                     dict(pack_run=pack_run, check_lengths=check_lengths))
+
+    def get_tdi_combiner(self, len=len, sum=sum, pack_run=pack_run, join_bits=join_bits):
+        ''' Create a combiner function that will merge the
+            variable TDI data with the constant TDI data,
+            and return the result as a single integer.
+        '''
+        layout = self.tdi_segments()
+        if layout is not None:
+            return self.make_tdi_combiner(*layout)
+        runs, counts = group_runs(self.tdi_bits)
+        const = self.tdi_const
+        splice = []
+        source = 0
+        for offset, numbits in self.tdi_splice:
+            splice.append((source, (1 << numbits) - 1, offset))
+            source += numbits
+        single = splice[0][2] if len(splice) == 1 else None
+
+        def tdi_combiner(tdi):
+            lengths = [len(x) for x in tdi]
+            if lengths != counts and (counts or sum(lengths)):
+                raise ValueError("Expected %s TDI elements; got %s" % (counts, lengths))
+            if not runs:
+                return const
+            variables = join_bits([(pack_run(tdi[index][start:start+count], numbits), count * numbits)
+                                      for (index, start, count, numbits) in runs])
+            if single is not None:
+                return const | variables << single
+            result = const
+            for source, mask, offset in splice:
+                result |= (variables >> source & mask) << offset
+            return result
+        return tdi_combiner
+
+    def get_tdo_extractor(self, join_bits=join_bits):
+        ''' Define a function that will extract an iterator of
+            integers from the integer returned by the driver.
+        '''
+        gather = [(offset, (1 << numbits) - 1, numbits) for offset, numbits in self.tdo_gather]
+        tdo_fields = TdoFields(self.tdo_bits)
+        if len(gather) <= codegen.maxterms:
+            terms = []
+            position = 0
+            for offset, mask, numbits in gather:
+                terms.append('(value >> %d & %#x) << %d' % (offset, mask, position))
+                position += numbits
+            return codegen.make_function('tdo_extractor', [
+                'def tdo_extractor(value):',
+                '    return tdo_fields(%s)' % codegen.or_terms(terms),
+            ], dict(tdo_fields=tdo_fields))
+        single = gather[0] if len(gather) == 1 else None
+
+        def tdo_extractor(value):
+            if single is not None:
+                value = value >> single[0] & single[1]
+            else:
+                value = join_bits([(value >> offset & mask, numbits) for (offset, mask, numbits) in gather])
+            return tdo_fields(value)
+        return tdo_extractor
+
+    def get_xfer_func(self):
+        tms = self.tms
+        numbits = self.transaction_bit_length
+        tdi_combiner = self.get_tdi_combiner()
+
+        if self.tdo_bits:
+            tdo_extractor = self.get_tdo_extractor()
+            def func(driver, tdi_array):
+                return tdo_extractor(driver(tms, tdi_combiner(tdi_array), numbits, True))
+        else:
+            def func(driver, tdi_array):
+                driver(tms, tdi_combiner(tdi_array), numbits, False)
+
+        vars(self).clear()
+        return func
+
+    @classmethod
+    def mix_me_in(cls):
+        class IntMixin(object):
+            ''' This is designed to be a mix-in class.  It assumes that
+                it can simply call self() with integer TMS and TDI in
+                order to transfer data to/from the underlying driver.
+                It is used, e.g. by the xvc driver.
+            '''
+            def make_template(self, base_template):
+                return cls(base_template).get_xfer_func()
+            def apply_template(self, template, tdi_array):
+                return template(self, tdi_array)
+        return IntMixin
@@ -14,6 +14,7 @@ Examples:
 
   jtagstates.states.reset.cyclestate(2) returns [1,1] as the TMS value that is required to
   keep the state machine in that state for two cycles.
+  jtagstates.states.reset.cyclevalue returns 1, the TMS value for staying in that state.
 
 A TMS path that is returned may be modified by calling its pad method to define a minimum length
 or a boundary condition for the number of bits modulo some number.
@@ -77,12 +78,18 @@ class OneState(str):
     def __getattr__(self, name):
         return TMSPath(self, name)
 
-    def cyclestate(self, count=1):
+    @property
+    def cyclevalue(self):
+        ''' The TMS value required to stay in this state
+        '''
         for value in range(2):
             if self[value] == self:
-                return count * [value]
+                return value
         raise ValueError("%s is not a valid cycle state" % self)
 
+    def cyclestate(self, count=1):
+        return count * [self.cyclevalue]
+
 
 class TMSPath(list):
     ''' Define a list of TMS transitions required to get from one state to another.
@@ -0,0 +1,148 @@
+'''
+This module provides streaming JTAG shifts.
+
+A streaming shift sends an arbitrarily long sequence of TDI bytes
+through the JTAG data (or instruction) register, and optionally
+returns the TDO bytes.  The data is broken into chunks, and the
+TAP controller is kept in the shift state between chunks, so the
+whole operation looks like one long shift to the device, but only
+one chunk at a time is ever held in memory.
+
+A template is built for each distinct chunk configuration (first,
+middle, last, read/write), and then reused for every chunk, so
+the template cost does not grow with the length of the scan.
+
+Each byte is shifted least significant bit first, unless msbfirst
+is set (which is useful e.g. for Xilinx configuration bitstreams).
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import itertools
+
+from .template import JtagTemplate, TDIVariable
+from .states import states
+
+CHUNKSIZE = 16384   # Default number of bytes per chunk
+
+reverse_bits = bytes(int('{0:08b}'.format(x)[::-1], 2) for x in range(256))
+
+
+def read_chunks(source, chunksize, islice=itertools.islice, bytes=bytes):
+    ''' Yield successive byte strings of up to chunksize bytes from
+        a file-like object, a buffer (bytes, bytearray, memoryview,
+        array, etc.), or an iterable of integers.
+    '''
+    read = getattr(source, 'read', None)
+    if read is not None:
+        while 1:
+            chunk = read(chunksize)
+            if not chunk:
+                return
+            yield chunk
+    try:
+        source = memoryview(source).cast('B')
+    except TypeError:
+        source = iter(source)
+        while 1:
+            chunk = bytes(islice(source, chunksize))
+            if not chunk:
+                return
+            yield chunk
+    for offset in range(0, len(source), chunksize):
+        yield source[offset:offset + chunksize]
+
+
+class JtagStream(object):
+    ''' A JtagStream object shifts streams of bytes through a JTAG
+        register, using templates that are cached in the object.
+
+            cable      -- the cable driver
+            chunksize  -- number of bytes per template call.  If not
+                          given, the cable's stream_chunksize attribute
+                          is used, if it has one.
+            state      -- the shift state (shift_dr or shift_ir)
+            startstate -- the state the TAP is in before the first chunk.
+                          If it is not shift_dr or shift_ir, the first chunk
+                          will navigate from here to the shift state.
+            adv        -- advance out of the shift state after the last
+                          chunk.  If this is False, the TAP is left in
+                          the shift state, and another stream (or template
+                          with a startstate of the shift state) may follow.
+            msbfirst   -- shift each byte most significant bit first
+            bypass_info -- passed through to JtagTemplate
+    '''
+
+    def __init__(self, cable, chunksize=None, state=states.shift_dr,
+                 startstate=states.unknown, adv=True, msbfirst=False, bypass_info=None):
+        self.cable = cable
+        self.chunksize = chunksize or getattr(cable, 'stream_chunksize', CHUNKSIZE)
+        self.state = state
+        self.startstate = startstate
+        self.adv = adv
+        self.msbfirst = msbfirst
+        self.bypass_info = bypass_info
+        self.templates = {}
+
+    def template(self, numbytes, read, first, last):
+        ''' Return a (possibly cached) template for one chunk.
+        '''
+        key = numbytes, read, first, last
+        template = self.templates.get(key)
+        if template is None:
+            startstate = self.startstate if first else self.state
+            template = JtagTemplate(self.cable, 'stream_%d' % numbytes,
+                                    startstate=startstate, bypass_info=self.bypass_info)
+            template.readwrite(self.state, numbytes * 8, TDIVariable(), last and self.adv, read)
+            self.templates[key] = template
+        return template
+
+    def chunks(self, source):
+        ''' Yield (chunk, first, last) for each chunk of the source.
+            We read ahead by one chunk in order to know which
+            chunk is the last one.
+        '''
+        chunks = read_chunks(source, self.chunksize)
+        msbfirst = self.msbfirst
+        first = True
+        chunk = next(chunks, None)
+        while chunk is not None:
+            following = next(chunks, None)
+            if msbfirst:
+                chunk = bytes(chunk).translate(reverse_bits)
+            yield chunk, first, following is None
+            chunk = following
+            first = False
+
+    def write(self, source):
+        ''' Shift the source data into the register, discarding TDO.
+            Returns the number of bytes written.
+        '''
+        total = 0
+        from_bytes = int.from_bytes
+        for chunk, first, last in self.chunks(source):
+            numbytes = len(chunk)
+            self.template(numbytes, False, first, last)([from_bytes(chunk, 'little')])
+            total += numbytes
+        return total
+
+    def readwrite(self, source):
+        ''' Shift the source data into the register, and
+            yield the TDO data, as a bytes object per chunk.
+        '''
+        from_bytes = int.from_bytes
+        msbfirst = self.msbfirst
+        for chunk, first, last in self.chunks(source):
+            numbytes = len(chunk)
+            tdo = self.template(numbytes, True, first, last)([from_bytes(chunk, 'little')])
+            tdo = next(iter(tdo)).to_bytes(numbytes, 'little')
+            if msbfirst:
+                tdo = tdo.translate(reverse_bits)
+            yield tdo
+
+def shift_stream(cable, source, **kwds):
+    ''' Shift the source (a file-like object, a buffer, or an iterable
+        of integers) through a JTAG register, and yield TDO bytes
+        objects.  Keywords are passed to JtagStream.
+    '''
+    return JtagStream(cable, **kwds).readwrite(source)
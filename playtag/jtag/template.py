@@ -14,6 +14,7 @@ from .states import states as jtagstates
 from .. import iotemplate
 
 TDIVariable = iotemplate.TDIVariable
+dontcare = iotemplate.dontcare
 defaultvar = TDIVariable()
 
 class JtagTemplate(iotemplate.IOTemplate):
@@ -107,15 +108,15 @@ class JtagTemplate(iotemplate.IOTemplate):
             state = len(tdi)
         if isinstance(state, int):
             numbits = state
-            tmslist.extend(oldstate.cyclestate(numbits))
+            tmslist.add_run(oldstate.cyclevalue, numbits)
             if adv:
                 tmslist[-1] ^= 1
                 states.append(oldstate[tmslist[-1]])
             if not oldstate.shifting:
                 # Handle run/idle
                 assert not read
-                assert tdi is defaultvar
-                tdi = 0
+                if tdi is defaultvar:
+                    tdi = 0
         else:
             assert adv is None, state
             newtms = oldstate[state]
@@ -144,6 +145,18 @@ class JtagTemplate(iotemplate.IOTemplate):
             self.update(self.select_dr)
         return self
 
+    def runtest(self, clocks):
+        ''' Go to run/idle, and stay there for the given
+            number of clocks (e.g. for an SVF RUNTEST).
+            TDI is don't care, so the high speed FTDI
+            parts can clock without sending any data.
+        '''
+        if self.states[-1] != self.idle:
+            self.update(self.idle)
+        if clocks:
+            self.update(clocks, dontcare)
+        return self
+
     def writei(self, numbits, tdi=defaultvar, adv=True):
         ''' Write to the JTAG instruction register
         '''
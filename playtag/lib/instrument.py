@@ -0,0 +1,233 @@
+'''
+Instrumentation for templates and cables.
+
+When profiling is enabled (by setting any of the PROFILE configuration
+options below), the profiler records, for each template (by cmdname):
+
+    - the number of calls and the number of clocks shifted
+    - the time spent compiling the template for the cable
+    - the time spent applying it (including the cable I/O)
+    - the number of bytes written to and read from the cable,
+      the number of I/O calls, and the time spent waiting on them
+
+I/O that happens outside of any template (e.g. when a cable flushes
+coalesced writes from a timer) is recorded under '<no template>'.
+
+When the program exits, a summary table is printed, and the statistics
+and trace are written to the PROFILE_OUTPUT and PROFILE_TRACE files,
+if given.  The trace is in Chrome trace event format, which can be
+viewed with chrome://tracing or https://ui.perfetto.dev.
+
+Options:
+
+    PROFILE=1              -- print the summary table at exit
+    PROFILE_OUTPUT=<file>  -- write the statistics as JSON
+    PROFILE_TRACE=<file>   -- write a Chrome trace of every
+                              template call and cable I/O call
+    PROFILE_TRACE_LIMIT=n  -- maximum number of trace events
+
+The profiler hooks in when a template is first used, and when a cable
+is opened, by wrapping the functions it measures.  When profiling is
+disabled nothing is wrapped, so there is no overhead.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import os
+import sys
+import time
+import json
+import atexit
+import threading
+
+profiler = None     # The active Profiler, if profiling is enabled
+
+class ProfileDefaults(object):
+    PROFILE = False
+    PROFILE_OUTPUT = None
+    PROFILE_TRACE = None
+    PROFILE_TRACE_LIMIT = 1000000
+
+
+class TemplateStats(object):
+    ''' Statistics for all the templates with one name.
+    '''
+    fields = ('calls', 'compiles', 'compile_time', 'apply_time', 'bits',
+              'written', 'read', 'io_calls', 'wait_time')
+
+    def __init__(self, name):
+        self.name = name
+        for field in self.fields:
+            setattr(self, field, 0)
+
+    def as_dict(self):
+        result = dict(name=self.name)
+        for field in self.fields:
+            result[field] = getattr(self, field)
+        return result
+
+
+class Profiler(object):
+    ''' Records template and cable statistics, and an optional trace.
+    '''
+
+    def __init__(self, config, timer=time.perf_counter):
+        self.timer = timer
+        self.start = timer()
+        self.summary = bool(config.PROFILE)
+        self.output = config.PROFILE_OUTPUT
+        self.tracing = bool(config.PROFILE_TRACE)
+        self.trace_file = config.PROFILE_TRACE
+        self.trace_limit = config.PROFILE_TRACE_LIMIT
+        self.events = []
+        self.templates = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def get_stats(self, name):
+        stats = self.templates.get(name)
+        if stats is None:
+            with self.lock:
+                stats = self.templates.setdefault(name, TemplateStats(name))
+        return stats
+
+    def template_stats(self, template):
+        return self.get_stats(template.cmdname or 'unnamed_%d' % len(template))
+
+    def trace(self, name, category, start, end, args=None):
+        ''' Record a trace event, if tracing.
+        '''
+        events = self.events
+        if self.tracing and len(events) < self.trace_limit:
+            events.append((name, category, start, end, threading.get_ident(), args))
+
+    def wrap_compile(self, template, make_template):
+        ''' Return a version of the cable's make_template
+            that records the compile time for the template.
+        '''
+        stats = self.template_stats(template)
+        timer = self.timer
+
+        def profiled_make(base_template):
+            start = timer()
+            result = make_template(base_template)
+            end = timer()
+            stats.compiles += 1
+            stats.compile_time += end - start
+            self.trace(stats.name, 'compile', start, end)
+            return result
+        return profiled_make
+
+    def wrap_apply(self, template, apply_template):
+        ''' Return a version of the cable's apply_template
+            that records each call of the template.  I/O done
+            during the call is attributed to the template.
+        '''
+        stats = self.template_stats(template)
+        numbits = len(template)
+        local = self.local
+        timer = self.timer
+
+        def profiled_apply(devtemplate, tdi):
+            previous = getattr(local, 'stats', None)
+            local.stats = stats
+            start = timer()
+            try:
+                return apply_template(devtemplate, tdi)
+            finally:
+                end = timer()
+                local.stats = previous
+                stats.calls += 1
+                stats.bits += numbits
+                stats.apply_time += end - start
+                self.trace(stats.name, 'apply', start, end)
+        return profiled_apply
+
+    def wrap_io(self, kind, func, size):
+        ''' Return a version of a cable I/O function that records
+            the number of bytes and the time spent waiting.  kind
+            is 'write' or 'read', and size is a function that returns
+            the number of bytes from the arguments to the call.
+        '''
+        local = self.local
+        timer = self.timer
+        written = kind == 'write'
+
+        def profiled_io(*args):
+            start = timer()
+            try:
+                return func(*args)
+            finally:
+                end = timer()
+                numbytes = size(args)
+                stats = getattr(local, 'stats', None) or self.get_stats('<no template>')
+                stats.io_calls += 1
+                stats.wait_time += end - start
+                if written:
+                    stats.written += numbytes
+                else:
+                    stats.read += numbytes
+                self.trace(stats.name, kind, start, end, dict(bytes=numbytes))
+        return profiled_io
+
+    def results(self):
+        ''' Return a list of result dicts, most expensive first.
+        '''
+        results = [x.as_dict() for x in self.templates.values()]
+        results.sort(key=lambda x: x['apply_time'] + x['compile_time'] +
+                                   (x['wait_time'] if x['name'] == '<no template>' else 0),
+                     reverse=True)
+        return results
+
+    def format_summary(self):
+        lines = ['\nTemplate profile:\n',
+                 '%-32s %8s %10s %10s %8s %12s %10s %10s %8s %9s' % (
+                     'Template', 'Calls', 'Compile ms', 'Apply ms', 'us/call',
+                     'Clocks', 'Written', 'Read', 'I/O', 'Wait ms')]
+        for x in self.results():
+            lines.append('%-32s %8d %10.2f %10.2f %8.1f %12d %10d %10d %8d %9.2f' % (
+                x['name'][:32], x['calls'], x['compile_time'] * 1e3, x['apply_time'] * 1e3,
+                x['apply_time'] * 1e6 / x['calls'] if x['calls'] else 0.0,
+                x['bits'], x['written'], x['read'], x['io_calls'], x['wait_time'] * 1e3))
+        lines.append('')
+        return '\n'.join(lines)
+
+    def trace_events(self):
+        ''' Return the trace in Chrome trace event format.
+        '''
+        pid = os.getpid()
+        origin = self.start
+        events = []
+        for name, category, start, end, tid, args in self.events:
+            event = dict(name=name, cat=category, ph='X', pid=pid, tid=tid,
+                         ts=(start - origin) * 1e6, dur=(end - start) * 1e6)
+            if args:
+                event['args'] = args
+            events.append(event)
+        return dict(traceEvents=events, displayTimeUnit='ms')
+
+    def report(self):
+        ''' Print the summary and write the output files.
+        '''
+        if self.summary:
+            print(self.format_summary(), file=sys.stderr)
+        if self.output:
+            with open(self.output, 'wt') as f:
+                json.dump(dict(elapsed=self.timer() - self.start,
+                               templates=self.results()), f, indent=1)
+        if self.trace_file:
+            with open(self.trace_file, 'wt') as f:
+                json.dump(self.trace_events(), f)
+
+
+def from_config(config):
+    ''' Enable profiling if the configuration asks for it, and
+        return the active profiler (or None).  Called by cables
+        when they are opened.
+    '''
+    global profiler
+    config.add_defaults(ProfileDefaults)
+    if profiler is None and (config.PROFILE or config.PROFILE_OUTPUT or config.PROFILE_TRACE):
+        profiler = Profiler(config)
+        atexit.register(profiler.report)
+    return profiler
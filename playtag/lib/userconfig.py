@@ -15,6 +15,8 @@ class UserConfig(object):
     SHOW_CABLE = True
     SHOW_CONFIG = True
     SOCKET_ADDRESS = 2222
+    TEMPLATE_CACHE_DIR = None
+    TEMPLATE_CACHE_SIZE = 64 * 1024 * 1024
     root = None
 
     def loadfile(self, fname):
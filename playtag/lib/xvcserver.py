@@ -0,0 +1,326 @@
+'''
+This module provides an asyncio server for the Xilinx XVC protocol.
+
+Unlike transport.connection, which serves a single client and then
+closes and rebinds its listening socket, the server keeps listening
+for as long as it runs, so clients may connect (and reconnect) at any
+time, and any number of clients may be connected at once.
+
+There is only one cable, so all cable work is done in a dedicated
+worker thread, fed by an Arbiter.  Each client session has its own
+queue of shift commands, and the worker takes one command at a time
+from each session that has work pending, in turn, so a client that
+is downloading a bitstream cannot lock out the others.
+
+Each shift command is executed atomically, but the JTAG chain itself
+is shared.  Clients that use it at the same time must leave the TAP
+in a state the others expect between commands.
+
+A client may send several commands before reading the replies.
+The session keeps reading commands while earlier ones are queued
+or executing, and the replies are sent in order.  Commands are
+parsed in place in a ring buffer (see XvcSession).
+
+Call serve() with a function that executes a complete shift command
+(a memoryview with the header, TMS and TDI) and returns the TDO data.
+The memoryview is part of the ring, so it must not be kept.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import time
+import socket
+import asyncio
+import threading
+import collections
+
+from .transport import logger
+
+MAXVECTOR = 120000      # Bytes of TMS (and of TDI) reported by getinfo:
+RINGCOMMANDS = 4        # Maximum size commands that fit in a session's ring
+MINCOMMAND = 11         # Enough bytes to identify any command and its length
+
+
+class Arbiter(object):
+    ''' Round-robin queue of cable work from client sessions.
+        The work is executed by a dedicated thread, and the
+        results are returned to the event loop in futures.
+    '''
+
+    def __init__(self, execute):
+        self.execute = execute
+        self.queues = {}                    # Pending work for each session
+        self.ready = collections.deque()    # Sessions with work, in turn order
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name='xvc-cable', daemon=True)
+        self.thread.start()
+
+    def submit(self, session, *args):
+        ''' Queue a call to execute(*args) on behalf of a session,
+            and return a future for the result.
+        '''
+        future = asyncio.get_running_loop().create_future()
+        with self.condition:
+            queue = self.queues.get(session)
+            if queue is None:
+                queue = self.queues[session] = collections.deque()
+                self.ready.append(session)
+            queue.append((args, future))
+            self.condition.notify()
+        return future
+
+    def discard(self, session):
+        ''' Drop any work that has not started for a session
+            (e.g. because the client disconnected).
+        '''
+        with self.condition:
+            queue = self.queues.pop(session, None)
+            if queue is not None:
+                self.ready.remove(session)
+
+    def run(self):
+        condition = self.condition
+        ready = self.ready
+        while True:
+            with condition:
+                while not ready:
+                    condition.wait()
+                session = ready.popleft()
+                queue = self.queues[session]
+                args, future = queue.popleft()
+                if queue:
+                    ready.append(session)
+                else:
+                    del self.queues[session]
+            try:
+                result = self.execute(*args)
+            except BaseException as exc:
+                future.get_loop().call_soon_threadsafe(self.resolve, future, None, exc)
+            else:
+                future.get_loop().call_soon_threadsafe(self.resolve, future, result, None)
+
+    @staticmethod
+    def resolve(future, result, exc):
+        if future.cancelled():
+            return
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+
+
+class XvcSession(asyncio.BufferedProtocol):
+    ''' One client connection.
+
+        Data is received straight into a preallocated ring buffer
+        (the event loop does a recv_into() the free space), and the
+        commands are parsed in place.  Each shift command is passed
+        to the cable thread as a memoryview of the ring, so the TMS
+        and TDI data are never copied, and that part of the ring
+        is not reused until the reply has been sent.
+
+        A command is never split across the end of the ring.  If
+        the rest of one will not fit, the part that has been received
+        is moved to the start of the ring, once there is room for it.
+        When there is no room, we stop reading from the socket.
+    '''
+    transport = None
+    commands = b'shift:', b'getinfo:', b'settck:'
+
+    def __init__(self, server):
+        self.server = server
+        self.submit = server.arbiter.submit
+        self.size = server.ringsize
+        self.ring = bytearray(self.size)
+        self.view = memoryview(self.ring)
+        self.start = 0      # Start of the first command not yet parsed
+        self.end = 0        # End of the data received
+        self.need = MINCOMMAND  # Length of that command, if known
+        self.busy = collections.deque()     # (start, end) of shifts in progress
+        self.replies = collections.deque()  # Replies not sent yet, in order
+        self.paused = False
+        self.blocked = False    # The transport's write buffer is full
+        self.shifts = 0
+        self.numbits = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.address = transport.get_extra_info('peername')[:2]
+        sock = transport.get_extra_info('socket')
+        # Ask the network driver to send packets and acks immediately
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connecttime = time.time()
+        logger("Connected to %s:%s -- now serving %s" % (self.address + (self.server.procname,)))
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self.server.arbiter.discard(self)
+        logger('Client %s:%s disconnected: time = %0.1f, shifts = %d, bits = %d' %
+               (self.address + (time.time() - self.connecttime, self.shifts, self.numbits)))
+
+    def close(self, msg):
+        logger('Closing connection: %s' % msg)
+        self.transport.close()
+
+    def limit(self):
+        ''' Return the end of the free space that follows the data
+            received.  If the command being received cannot be
+            completed where it is, it is moved to the start of the
+            ring when there is room for it there.
+        '''
+        start = self.start
+        busy = self.busy
+        if busy and busy[0][0] >= start:
+            return busy[0][0]   # Wrapped, so the older commands follow
+        if start + self.need > self.size:
+            front = busy[0][0] if busy else self.size
+            if self.need <= front:
+                partial = self.end - start
+                self.ring[:partial] = self.view[start:self.end].tobytes()
+                self.start, self.end = 0, partial
+                return front
+        return self.size
+
+    def get_buffer(self, sizehint):
+        return self.view[self.end:self.limit()]
+
+    def buffer_updated(self, nbytes):
+        self.end += nbytes
+        try:
+            self.parse()
+        except ValueError as exc:
+            self.close(exc)
+            return
+        self.update_reading()
+
+    def parse(self):
+        ''' Parse and dispatch all the complete commands received.
+        '''
+        view = self.view
+        busy = self.busy
+        start = self.start
+        end = self.end
+        need = MINCOMMAND
+        while start < end:
+            avail = end - start
+            prefix = view[start:start + min(avail, 8)].tobytes()
+            if prefix.startswith(b'shift:'):
+                if avail < 10:
+                    break
+                numbits = int.from_bytes(view[start + 6:start + 10], 'little')
+                length = 10 + (numbits + 7) // 8 * 2
+                if length > self.size:
+                    raise ValueError('Shift of %d bits is too long' % numbits)
+                if avail < length:
+                    need = length
+                    break
+                busy.append((start, start + length))
+                self.queue_reply(self.submit(self, view[start:start + length]))
+                self.shifts += 1
+                self.numbits += numbits
+                start += length
+            elif prefix == b'getinfo:':
+                self.queue_reply(self.server.info)
+                start += 8
+            elif prefix.startswith(b'settck:'):
+                if avail < 11:
+                    break
+                # We do not change the cable speed; report the requested period.
+                self.queue_reply(view[start + 7:start + 11].tobytes())
+                start += 11
+            elif any(x.startswith(prefix) for x in self.commands):
+                break
+            else:
+                raise ValueError('Unknown XVC command %r' % prefix)
+        if start == end and not busy:
+            start = end = 0
+        self.start, self.end, self.need = start, end, need
+
+    def queue_reply(self, reply):
+        ''' Queue a reply, which is either the data, or a future
+            for the result of a shift command.
+        '''
+        if isinstance(reply, bytes) and not self.replies:
+            self.transport.write(reply)
+            return
+        self.replies.append(reply)
+        if not isinstance(reply, bytes):
+            reply.add_done_callback(self.send_replies)
+
+    def send_replies(self, future=None):
+        ''' Send the replies in order, as each shift command
+            completes, and free its part of the ring.
+        '''
+        replies = self.replies
+        while replies:
+            reply = replies[0]
+            if not isinstance(reply, bytes):
+                if not reply.done():
+                    break
+                self.busy.popleft()
+                try:
+                    reply = reply.result()
+                except Exception as exc:
+                    replies.clear()
+                    if self.transport is not None:
+                        self.close(exc)
+                    return
+            replies.popleft()
+            if self.transport is not None:
+                self.transport.write(reply)
+        self.update_reading()
+
+    def pause_writing(self):
+        self.blocked = True
+        self.update_reading()
+
+    def resume_writing(self):
+        self.blocked = False
+        self.update_reading()
+
+    def update_reading(self):
+        ''' Stop reading from the socket if there is no room in the
+            ring, or the client is not reading the replies.
+        '''
+        transport = self.transport
+        if transport is None or transport.is_closing():
+            return
+        paused = self.blocked or self.limit() <= self.end
+        if paused != self.paused:
+            self.paused = paused
+            if paused:
+                transport.pause_reading()
+            else:
+                transport.resume_reading()
+
+
+class XvcServer(object):
+    ''' Listens for XVC clients, and serves them concurrently.
+    '''
+
+    def __init__(self, execute, procname='xvc', maxvector=MAXVECTOR):
+        self.procname = procname
+        self.info = b'xvcServer_v1.0:%d\n' % maxvector
+        self.ringsize = RINGCOMMANDS * (10 + 2 * maxvector)
+        self.arbiter = Arbiter(execute)
+
+    async def serve(self, address, host=None):
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: XvcSession(self), host, address,
+                                          reuse_address=True)
+        logger("Waiting for %s connections on port %s  (Ctrl-C to exit)" %
+               (self.procname, address))
+        async with server:
+            await server.serve_forever()
+
+
+def serve(execute, address, procname='xvc', maxvector=MAXVECTOR, host=None):
+    ''' Run an XVC server on the given port until interrupted.
+        execute is called in the cable thread with each complete
+        shift command, and returns the TDO bytes.
+    '''
+    try:
+        asyncio.run(XvcServer(execute, procname, maxvector).serve(address, host))
+    except KeyboardInterrupt:
+        logger("\nKeyboard Interrupt received; exiting...\n")
@@ -0,0 +1,96 @@
+'''
+Tests for batched template execution on the simulated FTDI cable.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import pytest
+
+from playtag.cables import sim
+from playtag.bench.templates import sim_config
+from playtag.iotemplate import TDIVariable
+from playtag.iotemplate.deferred import DeferredTdo
+from playtag.jtag.template import JtagTemplate
+from playtag.jtag.states import states
+
+IDCODE = 0x13636093     # Simulated nexys_video part
+
+
+def make_cable(engine='bytes'):
+    ''' Return a cable, and a list that gets the
+        size of each write to the simulated device.
+    '''
+    cable = sim.Jtagger(sim_config(engine, FTDI_FLUSH_TIMEOUT=0))
+    cable.flush()
+    writes = []
+    mpsse = cable.sim.mpsse
+    write = mpsse.write
+    def record(data):
+        writes.append(len(data))
+        return write(data)
+    mpsse.write = record
+    return cable, writes
+
+def echo_template(cable):
+    ''' Reset, and shift a variable through the IDCODE register.
+        Returns the IDCODE, and then the variable.
+    '''
+    template = JtagTemplate(cable).update(states.shift_dr)
+    template.readd(32, tdi=TDIVariable(), adv=False)
+    template.readd(32, adv=False)
+    return template.update(states.idle)
+
+def test_batch_is_deferred():
+    cable, writes = make_cable()
+    template = echo_template(cable)
+    with cable.batch():
+        results = [template([x]) for x in range(100)]
+        assert not writes
+        assert all(isinstance(x, DeferredTdo) and not x.done for x in results)
+    assert all(x.done for x in results)
+    assert len(writes) < 5
+    assert [list(x) for x in results] == [[IDCODE, x] for x in range(100)]
+
+def test_result_flushes_batch():
+    cable, writes = make_cable()
+    template = echo_template(cable)
+    with cable.batch():
+        first = template([1])
+        second = template([2])
+        assert next(second) == IDCODE
+        assert first.done and len(writes) == 1
+        third = template([3])
+        assert not third.done and len(writes) == 1
+        assert list(first) == [IDCODE, 1]
+    assert list(third) == [IDCODE, 3]
+    assert len(writes) == 2
+
+def test_nested_batches():
+    cable, writes = make_cable()
+    template = echo_template(cable)
+    with cable.batch():
+        with cable.batch():
+            first = template([1])
+        assert not first.done and not writes
+        second = template([2])
+    assert first.done and second.done and len(writes) == 1
+    assert list(first) + list(second) == [IDCODE, 1, IDCODE, 2]
+
+def test_batch_fills_buffer():
+    ''' A batch bigger than the USB buffer is sent in pieces.
+    '''
+    cable, writes = make_cable()
+    template = echo_template(cable)
+    count = 2 * cable.maxread // 8 + 1
+    with cable.batch():
+        results = [template([x]) for x in range(count)]
+    assert len(writes) > 2 and max(writes) < cable.maxwrite
+    assert [list(x) for x in results] == [[IDCODE, x] for x in range(count)]
+
+@pytest.mark.parametrize('engine', ['strings', 'binary'])
+def test_other_engines_run_immediately(engine):
+    cable, writes = make_cable(engine)
+    template = echo_template(cable)
+    with cable.batch():
+        assert list(template([5])) == [IDCODE, 5]
+        assert len(writes) == 1
@@ -0,0 +1,59 @@
+'''
+Smoke tests for the benchmark package, which runs
+against the simulated cable.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+from playtag import bench
+from playtag.lib.userconfig import UserConfig
+
+topdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def quick_config(**kwds):
+    config = UserConfig()
+    config.BENCH_QUICK = True
+    config.BENCH_REPEAT = 1
+    vars(config).update(kwds)
+    return config
+
+def test_all_benchmarks(tmp_path):
+    output = str(tmp_path / 'results.json')
+    info = bench.run(quick_config(BENCH_OUTPUT=output))
+    results = info['results']
+    assert not [x for x in results if x['seconds'] is None]
+    names = set(x['name'].split('.')[0] for x in results)
+    assert names >= set(['build', 'compile', 'apply', 'discover', 'bus', 'xvc'])
+    with open(output, 'rt') as f:
+        assert json.load(f) == json.loads(json.dumps(info))
+
+def test_compare(tmp_path, capsys):
+    output = str(tmp_path / 'results.json')
+    bench.run(quick_config(BENCH_OUTPUT=output), ['discover'])
+    capsys.readouterr()
+    info = bench.run(quick_config(BENCH_COMPARE=output), ['discover'])
+    assert [x['name'] for x in info['results']] == ['discover.strings', 'discover.binary',
+                                                    'discover.bytes']
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 3 and all(x.endswith('x)') for x in lines)
+
+def test_unknown_benchmark():
+    with pytest.raises(SystemExit):
+        bench.run(quick_config(), ['nonexistent'])
+
+def test_command_line(tmp_path):
+    output = str(tmp_path / 'results.json')
+    subprocess.check_call([sys.executable, '-m', 'playtag.bench', 'build',
+                           'BENCH_QUICK=1', 'BENCH_REPEAT=1', 'BENCH_OUTPUT=%s' % output],
+                          cwd=topdir, stdout=subprocess.DEVNULL)
+    with open(output, 'rt') as f:
+        results = json.load(f)['results']
+    assert results and all(x['name'].startswith('build.') for x in results)
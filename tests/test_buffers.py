@@ -0,0 +1,94 @@
+'''
+Tests for TDI streams that support the buffer protocol, and for
+storing TDO data into buffers.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import array
+import random
+
+import pytest
+
+from playtag.cables import sim
+from playtag.bench.templates import sim_config
+from playtag.fpga.fpgabus import BusDriver
+from playtag.iotemplate import TDIVariable, packed_stream, tdi_stream
+from playtag.iotemplate.intconvert import pack_run
+from playtag.jtag.template import JtagTemplate
+from playtag.jtag.states import states
+
+IDCODE = 0x13636093     # Simulated nexys_video part
+engines = ['strings', 'binary', 'bytes']
+
+
+def echo_template(cable, count, width):
+    ''' Shift count width-bit values through the IDCODE register
+        after a reset.  The first 32 bits read are the IDCODE, and
+        then the TDI data comes back out.
+    '''
+    template = JtagTemplate(cable).update(states.shift_dr)
+    template.readd(32, adv=False)
+    template.loop()
+    template.readd(width, tdi=TDIVariable(), adv=False)
+    template.endloop(count)
+    return template.update(states.idle)
+
+def echoed(values, width):
+    ''' Return the values read by echo_template, after the IDCODE.
+        The TDI data is delayed by the 32 bit IDCODE register.
+    '''
+    mask = (1 << width) - 1
+    bits = sum((x & mask) << (32 + i * width) for i, x in enumerate(values))
+    return [bits >> (i * width) & mask for i in range(len(values))]
+
+@pytest.mark.parametrize('width', [8, 12, 16, 32, 64])
+def test_pack_run_masks(width):
+    mask = (1 << width) - 1
+    values = [1, mask + 2, -1, mask]
+    assert pack_run(values, width) == pack_run([x & mask for x in values], width)
+    assert pack_run(values[:1], width) == 1
+
+@pytest.mark.parametrize('engine', engines)
+def test_buffer_streams(engine):
+    cable = sim.Jtagger(sim_config(engine))
+    rnd = random.Random(18)
+    values = [rnd.getrandbits(32) for i in range(100)]
+    template = echo_template(cable, len(values), 32)
+    expected = [IDCODE] + echoed(values, 32)
+    for stream in (values, array.array('I', values), memoryview(array.array('I', values)),
+                   packed_stream(array.array('I', values).tobytes(), 4)):
+        assert list(template(stream)) == expected
+        out = array.array('I', bytes(4 * len(expected)))
+        assert template.into(out, stream) is out
+        assert list(out) == expected
+
+def test_tdi_stream():
+    values = [1, 2, 3]
+    assert tdi_stream(values) is values
+    assert list(tdi_stream(b'\x01\x00\x02\x00', 2)) == [1, 2]
+    with pytest.raises(ValueError):
+        packed_stream(b'\x01\x00\x02', 2)
+    with pytest.raises(ValueError):
+        packed_stream(b'\x01\x00\x02', 3)
+
+@pytest.mark.parametrize('width', [8, 12, 32])
+def test_wide_values_are_masked(width):
+    ''' The integer engines mask TDI values to the field width,
+        whether or not the width has a struct code.
+    '''
+    cable = sim.Jtagger(sim_config('bytes'))
+    mask = (1 << width) - 1
+    values = [mask + 2, 5, -1, mask, 7]
+    template = echo_template(cable, len(values), width)
+    assert list(template(values))[1:] == echoed(values, width)
+
+@pytest.mark.parametrize('size', [1, 2, 4])
+def test_bus_buffers(size):
+    cable = sim.Jtagger(sim_config('bytes'))
+    busdriver = BusDriver(cable)
+    data = bytes(random.Random(size).getrandbits(8) for i in range(1024))
+    busdriver.writemultiple(1, 0x100, data, size)
+    out = array.array({1: 'B', 2: 'H', 4: 'I'}[size], bytes(len(data)))
+    assert busdriver.readmultiple(1, 0x100, len(data) // size, size, out) is out
+    assert out.tobytes() == data
@@ -0,0 +1,77 @@
+'''
+Tests for coalescing write-only transfers on the simulated FTDI cable.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import time
+
+import pytest
+
+from playtag.cables import sim
+from playtag.bench.templates import sim_config
+from playtag.fpga.fpgabus import BusDriver
+
+USER4 = 0b100011
+engines = ['strings', 'binary', 'bytes']
+
+
+def make_cable(engine, **kwds):
+    ''' Return a cable, a BusDriver for it, the simulated memory,
+        and a list that gets the size of each write to the device.
+    '''
+    cable = sim.Jtagger(sim_config(engine, **kwds))
+    busdriver = BusDriver(cable)
+    cable.flush()
+    writes = []
+    mpsse = cable.sim.mpsse
+    write = mpsse.write
+    def record(data):
+        writes.append(len(data))
+        return write(data)
+    mpsse.write = record
+    return cable, busdriver, cable.chain.devices[0].registers[USER4].spaces[0], writes
+
+@pytest.mark.parametrize('engine', engines)
+def test_writes_wait_for_read(engine):
+    cable, busdriver, memory, writes = make_cable(engine, FTDI_FLUSH_TIMEOUT=0)
+    for i in range(50):
+        busdriver.writesingle(0, 4 * i, i, 4)
+    assert not writes and not any(memory[:200])
+    assert busdriver.readsingle(0, 4 * 49, 4) == 49
+    # The bytes engine sends the queue in the same write as the read
+    assert len(writes) == (1 if engine == 'bytes' else 2)
+    assert memory[:200] == b''.join(x.to_bytes(4, 'little') for x in range(50))
+
+@pytest.mark.parametrize('engine', engines)
+def test_coalescing_disabled(engine):
+    cable, busdriver, memory, writes = make_cable(engine, FTDI_COALESCE_WRITES=False)
+    for i in range(5):
+        busdriver.writesingle(0, 4 * i, i + 1, 4)
+        assert len(writes) == i + 1
+    assert memory[16:20] == (5).to_bytes(4, 'little')
+
+def test_flush_timeout():
+    cable, busdriver, memory, writes = make_cable('bytes', FTDI_FLUSH_TIMEOUT=200)
+    busdriver.writesingle(0, 8, 0x1234, 4)
+    busdriver.writesingle(0, 12, 0x5678, 4)
+    deadline = time.time() + 10
+    while not writes and time.time() < deadline:
+        time.sleep(0.01)
+    assert writes == [writes[0]]
+    assert memory[8:16] == bytes.fromhex('3412000078560000')
+
+def test_full_queue_is_sent():
+    cable, busdriver, memory, writes = make_cable('bytes', FTDI_FLUSH_TIMEOUT=0)
+    data = bytes(range(256)) * 256
+    for offset in range(0, len(data), 256):
+        busdriver.writemultiple(0, offset, data[offset:offset + 256])
+    assert writes and max(writes) < cable.maxwrite
+    cable.flush()
+    assert memory[:len(data)] == data
+
+def test_close_sends_queue():
+    cable, busdriver, memory, writes = make_cable('bytes', FTDI_FLUSH_TIMEOUT=0)
+    busdriver.writesingle(0, 0, 0xAB)
+    cable.close()
+    assert len(writes) == 1 and memory[0] == 0xAB
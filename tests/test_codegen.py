@@ -0,0 +1,96 @@
+'''
+Tests that the generated TDI combiners and TDO extractors give the
+same results as the generic functions that larger templates use.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import random
+
+import pytest
+
+from playtag.cables import sim, xvc
+from playtag.bench.cables import XvcServer
+from playtag.bench.templates import sim_config
+from playtag.iotemplate import codegen, TDIVariable
+from playtag.jtag.template import JtagTemplate
+from playtag.jtag.states import states
+
+IDCODE = 0x13636093     # Simulated nexys_video part
+widths = [3, 8, 13, 32, 1, 64]
+
+
+@pytest.fixture(scope='module')
+def server():
+    return XvcServer(sim.make_chain(sim_config(None, SIM_IR_LENGTH=6, SIM_MEMORY_SIZE=65536)))
+
+def make_cable(kind, server):
+    if kind == 'ftdi':
+        return sim.Jtagger(sim_config('bytes'))
+    return xvc.Jtagger(sim_config(None, CABLE_NAME='127.0.0.1:%d' % server.port,
+                                  XVC_TEMPLATE_ENGINE=kind))
+
+def field_test(cable, numfields):
+    ''' Build a template that shifts numfields variable fields, with
+        constant bits between them, through the IDCODE register, and
+        reads every other field (and whatever comes out with it).  Return the template, its data, and
+        the expected TDO data.
+    '''
+    rnd = random.Random(numfields)
+    template = JtagTemplate(cable).update(states.shift_dr)
+    data = []
+    tdi = 0
+    offset = 0
+    reads = []
+    for i in range(numfields):
+        width = widths[i % len(widths)]
+        value = rnd.getrandbits(width)
+        data.append(value)
+        if i & 1:
+            template.readd(width, tdi=TDIVariable(), adv=False)
+            reads.append((offset, width))
+        else:
+            template.writed(width, TDIVariable(), adv=False)
+        tdi |= value << offset
+        template.writed(3, '101', adv=False)
+        tdi |= 0b101 << (offset + width)
+        offset += width + 3
+    template.update(states.idle)
+    # The IDCODE comes out first, and then the TDI delayed by 32 bits
+    bits = IDCODE | tdi << 32
+    return template, data, [bits >> start & ((1 << width) - 1) for start, width in reads]
+
+@pytest.mark.parametrize('kind', ['ftdi', 'ints', 'bytes'])
+def test_generated_matches_generic(kind, server, monkeypatch):
+    sizes = [2, 3, 31, 32, 33, 100]     # Both sides of maxterms
+    generated = make_cable(kind, server)
+    monkeypatch.setattr(codegen, 'maxterms', 0)
+    generic = make_cable(kind, server)
+    count = len(codegen.compiled)
+    for numfields in sizes:
+        template, data, expected = field_test(generic, numfields)
+        assert list(template(data)) == expected
+    assert len(codegen.compiled) == count
+    monkeypatch.undo()
+    for numfields in sizes:
+        template, data, expected = field_test(generated, numfields)
+        assert list(template(data)) == expected
+
+def test_code_is_cached():
+    cable = sim.Jtagger(sim_config('bytes'))
+    count = len(codegen.compiled)
+    template, data, expected = field_test(cable, 7)
+    assert list(template(data)) == expected
+    assert len(codegen.compiled) > count
+    count = len(codegen.compiled)
+    # The same layout on another cable reuses the code
+    template, data, expected = field_test(sim.Jtagger(sim_config('bytes')), 7)
+    assert list(template(data)) == expected
+    assert len(codegen.compiled) == count
+
+def test_make_function():
+    function = codegen.make_function('add', ['def add(x):', '    return x + offset'],
+                                     dict(offset=3))
+    assert function(4) == 7
+    assert codegen.or_terms([]) == '0'
+    assert eval('(%s)' % codegen.or_terms(['1', '2', '4'])) == 7
@@ -0,0 +1,78 @@
+'''
+Tests for the on-disk cache of compiled templates,
+using the simulated cable.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import os
+import random
+
+import pytest
+
+from playtag.cables import sim
+from playtag.bench.templates import sim_config
+from playtag.fpga.fpgabus import BusDriver
+from playtag.iotemplate.diskcache import TemplateCache, template_key
+from playtag.jtag.template import JtagTemplate
+
+
+def cache_files(directory):
+    return sorted(x for x in os.listdir(directory) if x.endswith('.pickle'))
+
+def round_trip(cable, seed):
+    busdriver = BusDriver(cable)
+    values = [random.Random(seed).getrandbits(32) for i in range(300)]
+    busdriver.writemultiple(1, 0x40, values, 4)
+    assert list(busdriver.readmultiple(1, 0x40, len(values), 4)) == values
+    assert busdriver.readsingle(1, 0x44, 4) == values[1]
+
+def test_warm_start(tmp_path, monkeypatch):
+    directory = str(tmp_path / 'cache')
+    round_trip(sim.Jtagger(sim_config('bytes', TEMPLATE_CACHE_DIR=directory)), 1)
+    files = cache_files(directory)
+    assert files
+    # A new cable finds everything in the cache, and compiles nothing
+    cable = sim.Jtagger(sim_config('bytes', TEMPLATE_CACHE_DIR=directory))
+    def compile_template(self, template):
+        raise AssertionError('Template was compiled')
+    monkeypatch.setattr(cable.engine, '__init__', compile_template)
+    round_trip(cable, 2)
+    assert cache_files(directory) == files
+
+def test_engines_without_cache(tmp_path):
+    directory = str(tmp_path / 'cache')
+    round_trip(sim.Jtagger(sim_config('strings', TEMPLATE_CACHE_DIR=directory)), 3)
+    assert not cache_files(directory)
+
+def test_keys():
+    cable = sim.Jtagger(sim_config('bytes'))
+    other = sim.Jtagger(sim_config('strings'))
+    template = JtagTemplate(cable).readd(32)
+    same = JtagTemplate(other).readd(32)
+    different = JtagTemplate(cable).readd(33)
+    key = template_key(cable, cable.engine, template)
+    assert key == template_key(cable, cable.engine, same)
+    assert key != template_key(cable, cable.engine, different)
+    assert key != template_key(cable, other.engine, template)
+
+def test_bad_file(tmp_path):
+    directory = str(tmp_path / 'cache')
+    round_trip(sim.Jtagger(sim_config('bytes', TEMPLATE_CACHE_DIR=directory)), 4)
+    files = cache_files(directory)
+    for fname in files:
+        with open(os.path.join(directory, fname), 'wb') as f:
+            f.write(b'junk')
+    round_trip(sim.Jtagger(sim_config('bytes', TEMPLATE_CACHE_DIR=directory)), 5)
+    assert cache_files(directory) == files
+    cache = TemplateCache(directory)
+    assert all(cache.get(x[:-len('.pickle')]) is not None for x in files)
+
+def test_eviction(tmp_path):
+    cache = TemplateCache(str(tmp_path), maxsize=2500)
+    for i in range(5):
+        cache.put('key%d' % i, bytes(1000))
+        os.utime(cache.fname('key%d' % i), (i, i))
+    assert cache_files(str(tmp_path)) == ['key3.pickle', 'key4.pickle']
+    assert cache.get('key3') == bytes(1000)
+    assert cache.get('key0') is None
@@ -0,0 +1,59 @@
+'''
+Tests that FTDI GPIO writes stay in order with the JTAG commands
+that are queued around them, using the simulated cable.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import pytest
+
+from playtag.cables import sim
+from playtag.bench.templates import sim_config
+from playtag.jtag.template import JtagTemplate
+from playtag.jtag.states import states
+
+
+@pytest.fixture(params=['strings', 'binary', 'bytes'])
+def cable(request):
+    cable = sim.Jtagger(sim_config(request.param, FTDI_FLUSH_TIMEOUT=0))
+    cable.flush()
+    return cable
+
+def record_gpio(cable):
+    ''' Return a list that gets the GPIO value for each
+        bit the simulated chain is clocked.
+    '''
+    gpio = []
+    mpsse = cable.sim.mpsse
+    clock = cable.chain.clock
+    def record(tms, tdi, numbits):
+        gpio.extend(numbits * [mpsse.gpio])
+        return clock(tms, tdi, numbits)
+    cable.chain.clock = record
+    return gpio
+
+def test_gpio_between_jtag_writes(cable):
+    gpio = record_gpio(cable)
+    before = JtagTemplate(cable).runtest(20)
+    after = JtagTemplate(cable, startstate=states.idle).runtest(30)
+    read = JtagTemplate(cable, startstate=states.idle).readd(32)
+    cable.write_gpio(0x0100)
+    before()
+    cable.write_gpio(0x0800)
+    after()
+    cable.write_gpio(0x0400)
+    assert not gpio     # Everything is still queued
+    next(read())
+    assert len(gpio) == len(before.tms) + len(after.tms) + len(read.tms)
+    assert gpio[:len(before.tms)] == len(before.tms) * [0x0100]
+    gpio = gpio[len(before.tms):]
+    assert gpio[:len(after.tms)] == len(after.tms) * [0x0800]
+    assert gpio[len(after.tms):] == len(read.tms) * [0x0400]
+
+def test_setspeed_is_queued(cable):
+    gpio = record_gpio(cable)
+    JtagTemplate(cable).runtest(10)()
+    cable.setspeed(1e6)
+    assert cable.sim.speed == 1e6 and not gpio
+    cable.flush()
+    assert len(gpio) > 10 and not cable.sim.mpsse.pending
@@ -0,0 +1,81 @@
+'''
+Tests for the FTDI background reader thread.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import threading
+
+import pytest
+
+from playtag.cables import sim
+from playtag.cables.ftdi.d2xx_reader import RingReader
+from playtag.bench.templates import sim_config
+from playtag.jtag.discover import Chain
+from playtag.fpga.fpgabus import BusDriver
+
+
+class Device(object):
+    ''' Returns the low byte of the number of bytes read so far.
+    '''
+    total = 0
+
+    def read(self, ref, numbytes, countref):
+        dest = memoryview(ref._obj).cast('B')
+        dest[:numbytes] = bytes(x & 0xFF for x in range(self.total, self.total + numbytes))
+        self.total += numbytes
+        countref._obj.value = numbytes
+
+def test_ring_wraps():
+    reader = RingReader(Device().read, size=64, chunksize=16)
+    try:
+        dest = bytearray(1024)
+        for i in range(8):
+            reader.expect(128)
+        reader.read_into(memoryview(dest))
+        assert dest == 4 * bytes(range(256))
+    finally:
+        reader.stop()
+
+def test_read_after_stop():
+    reader = RingReader(Device().read)
+    reader.stop()
+    with pytest.raises(SystemExit):
+        reader.read_into(bytearray(1))
+
+def test_stop_wakes_reader():
+    reader = RingReader(Device().read)
+    errors = []
+    def read():
+        try:
+            reader.read_into(bytearray(1))
+        except SystemExit as exc:
+            errors.append(exc)
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    thread.join(0.1)
+    assert thread.is_alive()    # Nothing was expected
+    reader.stop()
+    thread.join(5)
+    assert not thread.is_alive() and len(errors) == 1
+
+def test_read_error():
+    def broken(ref, numbytes, countref):
+        raise IOError('unplugged')
+    reader = RingReader(broken)
+    reader.expect(1)
+    with pytest.raises(SystemExit, match='unplugged'):
+        reader.read_into(bytearray(1))
+
+@pytest.mark.parametrize('engine', ['strings', 'binary', 'bytes'])
+def test_sim_cable(engine):
+    cable = sim.Jtagger(sim_config(engine, FTDI_READER_THREAD=True, FTDI_READER_BUFFER=4096))
+    try:
+        assert Chain(cable).dev_ids == [0x13636093]
+        busdriver = BusDriver(cable)
+        values = list(range(256)) * 40     # Bigger than the ring
+        busdriver.writemultiple(0, 0, values)
+        assert list(busdriver.readmultiple(0, 0, len(values))) == values
+    finally:
+        cable.close()
+    assert cable.reader is None
@@ -0,0 +1,75 @@
+'''
+Tests for the template and cable profiler, using the simulated cable.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import json
+
+import pytest
+
+from playtag.cables import sim
+from playtag.bench.templates import sim_config
+from playtag.lib import instrument
+from playtag.jtag.template import JtagTemplate
+from playtag.jtag.states import states
+
+IDCODE = 0x13636093     # Simulated nexys_video part
+
+
+@pytest.fixture(autouse=True)
+def no_profiler(monkeypatch):
+    ''' Each test starts without a profiler, and the report
+        is not written again when the tests exit.
+    '''
+    monkeypatch.setattr(instrument, 'profiler', None)
+    monkeypatch.setattr(instrument.atexit, 'register', lambda func: None)
+
+@pytest.mark.parametrize('engine', ['strings', 'binary', 'bytes'])
+def test_profile(engine, tmp_path):
+    output = str(tmp_path / 'profile.json')
+    trace = str(tmp_path / 'trace.json')
+    cable = sim.Jtagger(sim_config(engine, PROFILE_OUTPUT=output, PROFILE_TRACE=trace,
+                                   FTDI_FLUSH_TIMEOUT=0))
+    profiler = instrument.profiler
+    assert profiler is not None
+    read = JtagTemplate(cable, 'idcode').readd(32).update(states.idle)
+    wait = JtagTemplate(cable, 'wait', startstate=states.idle).runtest(100)
+    for i in range(10):
+        wait()
+        assert next(read()) == IDCODE
+    cable.flush()
+    profiler.report()
+    with open(output, 'rt') as f:
+        stats = dict((x['name'], x) for x in json.load(f)['templates'])
+    idcode = stats['idcode']
+    assert idcode['calls'] == 10 and idcode['compiles'] == 1
+    assert idcode['bits'] == 10 * len(read)
+    assert idcode['read'] >= 40 and idcode['written'] > 0 and idcode['io_calls'] >= 20
+    assert idcode['apply_time'] > 0 and idcode['compile_time'] > 0
+    # The waits are written along with the reads
+    assert stats['wait']['calls'] == 10 and stats['wait']['read'] == 0
+    with open(trace, 'rt') as f:
+        events = json.load(f)['traceEvents']
+    categories = set((x['name'], x['cat']) for x in events)
+    assert categories >= set([('idcode', 'compile'), ('idcode', 'apply'), ('idcode', 'write'),
+                              ('idcode', 'read'), ('wait', 'apply')])
+    assert all(x['dur'] >= 0 for x in events)
+    assert 'idcode' in profiler.format_summary()
+
+def test_trace_limit(tmp_path):
+    trace = str(tmp_path / 'trace.json')
+    cable = sim.Jtagger(sim_config('bytes', PROFILE_TRACE=trace, PROFILE_TRACE_LIMIT=5))
+    read = JtagTemplate(cable, 'idcode').readd(32)
+    for i in range(10):
+        next(read())
+    instrument.profiler.report()
+    with open(trace, 'rt') as f:
+        assert len(json.load(f)['traceEvents']) == 5
+
+def test_disabled():
+    cable = sim.Jtagger(sim_config('bytes'))
+    assert instrument.profiler is None
+    read = JtagTemplate(cable, 'idcode').readd(32)
+    assert next(read()) == IDCODE
+    assert read.apply_template == cable.apply_template
@@ -0,0 +1,246 @@
+'''
+Tests for the MPSSE command Scheduler in cables/ftdi/mpsse_jtag_bytes.py.
+
+Seeded random templates are run through each FTDI template engine on
+the simulated cable, for both high speed and low speed parts.  The TDO
+data is checked against a copy of the simulated chain that is clocked
+directly, and the number of bytes each command stream writes and
+reads is checked against the greedy generator that the Scheduler
+replaced.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import random
+
+import pytest
+
+from playtag.cables import sim
+from playtag.bench.templates import sim_config
+from playtag.cables.ftdi.mpsse_template import MpsseBytesTemplate
+from playtag.cables.ftdi.mpsse_jtag_bytes import mpsse_jtag_bytes
+from playtag.iotemplate import TDIVariable, TDIDontCare
+from playtag.iotemplate.intconvert import field_mask
+from playtag.jtag.template import JtagTemplate
+from playtag.jtag.states import states
+
+CHAIN = '0x0362d093,bypass,0x13631093'
+engines = ['strings', 'binary', 'bytes']
+
+
+class LowSpeedJtagger(sim.Jtagger):
+    ''' A simulated FT2232D, which cannot clock without data.
+    '''
+    def device_class(self, config):
+        device = sim.Jtagger.device_class(self, config)
+        device.hispeed = False
+        return device
+
+def make_cable(engine, hispeed):
+    jtagger = sim.Jtagger if hispeed else LowSpeedJtagger
+    # Pipelining adds send_immediate commands; count only the template's stream
+    cable = jtagger(sim_config(engine, CABLE_NAME=CHAIN, FTDI_FLUSH_TIMEOUT=0,
+                               FTDI_PIPELINE_SIZE=0))
+    cable.flush()
+    return cable
+
+def bitmask(numbits):
+    return (1 << numbits) - 1
+
+def zero_run(value, offset, numbits):
+    value >>= offset
+    if not value:
+        return numbits - offset
+    return min((value & -value).bit_length() - 1, numbits - offset)
+
+def greedy_length(numbits, tms, tdi, tdi_var, tdi_dontcare, tdo_mask):
+    ''' Return the number of bytes written and read by the command
+        stream from the greedy generator that the Scheduler replaced.
+        (That generator left out the data bytes for runs of don't care
+        data with no reads, which the device would have taken as
+        commands, so they are counted here.)
+    '''
+    def use_data(offset, count):
+        if count >= 8:
+            return True
+        mask = bitmask(count) << offset
+        variable = bin(tdi_var & mask).count('1')
+        constant = mask & ~tdi_dontcare & ~tdi_var
+        if variable:
+            return variable > 1 or bool(constant)
+        return tdi & constant not in (0, constant)
+
+    def tms_bits(offset):
+        value = None
+        count = 0
+        for index in range(offset, min(offset + 7, numbits)):
+            if count and not (tms >> (index - 1) & 1) and not (tms >> index & 1):
+                if use_data(index, zero_run(tms, index, numbits)):
+                    break
+            bit = 1 << index
+            if tdi_var & bit:
+                if value is not None:
+                    break
+                value = index, None
+            elif not tdi_dontcare & bit:
+                if value is None:
+                    value = None, bool(tdi & bit)
+                elif value != (None, bool(tdi & bit)):
+                    break
+            count += 1
+        return count
+
+    written = read = 0
+    offset = 0
+    tms_pin = 0
+    while offset < numbits:
+        count = zero_run(tms, offset, numbits)
+        if count and not tms_pin and use_data(offset, count):
+            mask = bitmask(count) << offset
+            reading = bool(tdo_mask & mask)
+            writing = bool(mask & ~tdi_dontcare) or not reading
+            numbytes, extra = divmod(count, 8)
+            if numbytes == 1 and not extra:
+                numbytes, extra = 0, 8
+            while numbytes:
+                chunk = min(numbytes, 65536)
+                written += 3 + writing * chunk
+                read += reading * chunk
+                numbytes -= chunk
+            if extra:
+                written += 2 + writing
+                read += reading
+        else:
+            count = tms_bits(offset)
+            written += 3
+            read += bool(tdo_mask & bitmask(count) << offset)
+            tms_pin = tms >> (offset + count - 1) & 1
+        offset += count
+    return written + bool(read), read
+
+def stream_length(template, clock_only):
+    ''' Return the number of bytes written and read by the
+        Scheduler's command stream for the template, and by
+        the greedy generator.
+    '''
+    plan = MpsseBytesTemplate(template)
+    inputs = (plan.transaction_bit_length, plan.tms, plan.tdi_const,
+              field_mask(plan.tdi_splice), plan.tdi_dontcare, field_mask(plan.tdo_gather))
+    commands = mpsse_jtag_bytes(*inputs, clock_only=clock_only)
+    return (len(commands.cmds), commands.readlen), greedy_length(*inputs)
+
+def expected_tdo(chain, template, data):
+    ''' Clock the template's bits through the chain,
+        and return the TDO fields it should read.
+    '''
+    template = template.expand()
+    tms = 0
+    offset = 0
+    for value, count in template.tms.runs:
+        tms |= (value and bitmask(count)) << offset
+        offset += count
+    streams = [iter(x) for x in data]
+    tdi = 0
+    offset = 0
+    for numbits, value in template.tdi:
+        if isinstance(value, TDIVariable):
+            value = next(streams[value.index]) & bitmask(numbits)
+        elif isinstance(value, TDIDontCare):
+            value = 0
+        elif isinstance(value, str):
+            value = int(value.replace('*', '0') or '0', 2)
+        elif value < 0:
+            value = bitmask(numbits)
+        tdi |= value << offset
+        offset += numbits
+    tdo = chain.clock(tms, tdi, len(template.tms))
+    result = []
+    start = 0
+    for offset, numbits in template.tdo:
+        start += offset
+        result.append(tdo >> start & bitmask(numbits))
+    return result
+
+def random_template(cable, rnd):
+    ''' Return a random template, and the data for its variable TDI.
+        Each template starts by resetting the chain.
+    '''
+    template = JtagTemplate(cable)
+    data = [[], []]
+    for i in range(rnd.randint(1, 10)):
+        kind = rnd.random()
+        numbits = rnd.choice([1, 2, 3, 5, 7, 8, 9, 13, 16, 31, 32, 33, 64, 65, 100, 2000])
+        adv = rnd.random() < 0.3
+        instr = rnd.random() < 0.2
+        write = template.writei if instr else template.writed
+        read = template.readi if instr else template.readd
+        if kind < 0.3:
+            index = rnd.randrange(2)
+            write(numbits, TDIVariable(index), adv=adv)
+            data[index].append(rnd.getrandbits(numbits))
+        elif kind < 0.5:
+            read(numbits, adv=adv, tdi=rnd.choice([0, -1, rnd.getrandbits(numbits)]))
+        elif kind < 0.65:
+            read(numbits, adv=adv, tdi=TDIVariable(0))
+            data[0].append(rnd.getrandbits(numbits))
+        elif kind < 0.75:
+            write(numbits, ''.join(rnd.choice('01') for i in range(numbits)), adv=adv)
+        elif kind < 0.85:
+            template.runtest(rnd.choice([0, 1, 5, 8, 9, 16, 17, 100, 2048, 3000]))
+        elif template.states[-1] == states.shift_dr:
+            template.loop()
+            numbits = rnd.choice([8, 12, 16, 32])
+            if rnd.random() < 0.5:
+                template.readd(numbits, adv=False, tdi=TDIVariable(1))
+            else:
+                template.writed(numbits, TDIVariable(1), adv=False)
+            count = rnd.randint(0, 4)
+            template.endloop(count)
+            data[1].extend(rnd.getrandbits(numbits) for i in range(count))
+    # A variable TDI bit on the last clock
+    numbits = rnd.randint(1, 9)
+    template.writed(numbits, TDIVariable(0), adv=True)
+    data[0].append(rnd.getrandbits(numbits))
+    while not data[-1]:
+        data.pop()
+    return template, data
+
+def run_template(cable, chain, template, data):
+    ''' Run the template on the cable, check the TDO data, and
+        return the number of bytes written to the cable.
+    '''
+    written = cable.sim.mpsse.written
+    result = template(*data)
+    result = [] if result is None else list(result)
+    cable.flush()
+    assert result == expected_tdo(chain, template, data)
+    return cable.sim.mpsse.written - written
+
+
+@pytest.mark.parametrize('hispeed', [True, False])
+@pytest.mark.parametrize('engine', engines)
+def test_random_templates(engine, hispeed):
+    cable = make_cable(engine, hispeed)
+    chain = sim.make_chain(sim_config(None, CABLE_NAME=CHAIN, SIM_IR_LENGTH=6))
+    rnd = random.Random(13)
+    for trial in range(150):
+        template, data = random_template(cable, random.Random(rnd.random()))
+        new, old = stream_length(template, hispeed)
+        assert run_template(cable, chain, template, data) == new[0]
+        assert sum(new) <= sum(old), (trial, new, old)
+
+@pytest.mark.parametrize('hispeed', [True, False])
+@pytest.mark.parametrize('engine', engines)
+def test_long_shift(engine, hispeed):
+    ''' Shifts that need more than one 64K byte data command.
+    '''
+    cable = make_cable(engine, hispeed)
+    chain = sim.make_chain(sim_config(None, CABLE_NAME=CHAIN, SIM_IR_LENGTH=6))
+    rnd = random.Random(64)
+    numbits = 8 * 65536 + 8 * 300 + 5
+    template = JtagTemplate(cable).readd(numbits, tdi=TDIVariable())
+    template.writed(numbits, TDIVariable(), adv=True)
+    data = [rnd.getrandbits(numbits), rnd.getrandbits(numbits)]
+    new, old = stream_length(template, hispeed)
+    assert run_template(cable, chain, template, [data]) == new[0]
+    assert sum(new) <= sum(old), (new, old)
@@ -0,0 +1,99 @@
+'''
+Tests for pipelined transfers on the simulated FTDI cable.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import array
+import random
+
+import pytest
+
+from playtag.cables import sim
+from playtag.bench.templates import sim_config
+from playtag.fpga.fpgabus import BusDriver
+from playtag.jtag.template import JtagTemplate
+from playtag.jtag.states import states
+
+IDCODE = 0x13636093     # Simulated nexys_video part
+USER4 = 0b100011
+
+
+class RecordingJtagger(sim.Jtagger):
+    ''' Records ('write', numbytes) and ('read', numbytes)
+        for each call to the simulated device.
+    '''
+    def device_class(self, config):
+        device = sim.Jtagger.device_class(self, config)
+        self.events = events = []
+        write, read = device.Write, device.Read
+        def Write(ref, numbytes, countref):
+            events.append(('write', numbytes))
+            return write(ref, numbytes, countref)
+        def Read(ref, numbytes, countref):
+            events.append(('read', numbytes))
+            return read(ref, numbytes, countref)
+        device.Write, device.Read = Write, Read
+        return device
+
+def make_cable(pipeline_size):
+    cable = RecordingJtagger(sim_config('bytes', FTDI_FLUSH_TIMEOUT=0,
+                                        FTDI_PIPELINE_SIZE=pipeline_size))
+    memory = cable.chain.devices[0].registers[USER4].spaces[0]
+    memory[:] = random.Random(5).randbytes(len(memory))
+    busdriver = BusDriver(cable)    # Discovers the chain
+    cable.flush()
+    del cable.events[:]
+    return cable, busdriver, memory
+
+def test_pipelined_read():
+    ''' A template with many commands is split between them.
+    '''
+    cable, busdriver, memory = make_cable(1024)
+    template = JtagTemplate(cable).update(states.idle)
+    template.loop()
+    template.readd(32).update(states.idle)
+    template.endloop(1000)
+    assert list(template()) == 1000 * [IDCODE]
+    events = cable.events
+    writes = [x for x in events if x[0] == 'write']
+    assert len(writes) > 4 and max(x[1] for x in writes) <= 1024
+    # Each chunk is written before the reply to the previous chunk is read
+    kinds = [x[0] for x in events]
+    assert kinds == ['write'] + (len(writes) - 1) * ['write', 'read'] + ['read']
+    assert sum(x[1] for x in events if x[0] == 'read') >= 4 * 1000
+
+def test_long_command_is_not_split():
+    ''' A single data command bigger than the pipeline size.
+    '''
+    cable, busdriver, memory = make_cable(4096)
+    data = bytearray(32768)
+    busdriver.readmultiple(0, 0, len(data) // 4, 4, data)
+    assert data == memory[:len(data)]
+    assert max(cable.events) >= ('write', len(data))
+    assert [x[0] for x in cable.events].count('read') == 1
+
+def test_pipeline_disabled():
+    cable, busdriver, memory = make_cable(0)
+    length = 8192
+    data = bytearray(4 * length)
+    busdriver.readmultiple(0, 0, length, 4, data)
+    assert data == memory[:4 * length]
+    assert [x[0] for x in cable.events] == ['write', 'read']
+
+def test_small_transfers_are_not_split():
+    cable, busdriver, memory = make_cable(4096)
+    assert busdriver.readsingle(0, 4, 4) == int.from_bytes(memory[4:8], 'little')
+    assert [x[0] for x in cable.events] == ['write', 'read']
+
+def test_pipelined_batch():
+    ''' Large templates keep their command boundaries in a batch.
+    '''
+    cable, busdriver, memory = make_cable(4096)
+    with cable.batch():
+        results = [busdriver[False, 4, 1024]([0, 4096 * i]) for i in range(4)]
+        assert not cable.events
+    assert len(cable.events) > 8
+    for i, result in enumerate(results):
+        offset = 4096 * i
+        assert result.into(array.array('I', bytes(4096))).tobytes() == memory[offset:offset + 4096]
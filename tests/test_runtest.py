@@ -0,0 +1,82 @@
+'''
+Tests for JtagTemplate.runtest, which waits in run/idle with
+don't care TDI data.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import pytest
+
+from playtag.cables import sim
+from playtag.bench.templates import sim_config
+from playtag.jtag.template import JtagTemplate
+from playtag.jtag.states import states
+
+IDCODE = 0x13636093     # Simulated nexys_video part
+engines = ['strings', 'binary', 'bytes']
+
+
+class LowSpeedJtagger(sim.Jtagger):
+    ''' A simulated FT2232D, which cannot clock without data.
+    '''
+    def device_class(self, config):
+        device = sim.Jtagger.device_class(self, config)
+        device.hispeed = False
+        return device
+
+def record_clocks(cable):
+    ''' Return a list that gets the number
+        of bits for each clock of the chain.
+    '''
+    clocks = []
+    clock = cable.chain.clock
+    def record(tms, tdi, numbits):
+        clocks.append(numbits)
+        return clock(tms, tdi, numbits)
+    cable.chain.clock = record
+    return clocks
+
+
+def test_long_wait_is_compact():
+    template = JtagTemplate(None, startstate=states.idle).runtest(10 ** 12)
+    assert len(template) == 10 ** 12
+    assert len(template.tms.runs) == 1 and len(template.tdi) == 1
+    assert hash(template) == hash(JtagTemplate(None, startstate=states.idle).runtest(10 ** 12))
+
+@pytest.mark.parametrize('engine', engines)
+def test_runtest_matches_string(engine):
+    cable = sim.Jtagger(sim_config(engine, FTDI_FLUSH_TIMEOUT=0))
+    clocks = record_clocks(cable)
+    read = JtagTemplate(cable, startstate=states.idle).readd(32)
+    wait = JtagTemplate(cable).runtest(1000)
+    string = JtagTemplate(cable).update(states.idle).update(1000, 1000 * '*')
+    assert wait != string
+    for template in wait, string:
+        del clocks[:]
+        template()
+        assert next(read()) == IDCODE
+        assert sum(clocks) == len(template) + len(read)
+
+@pytest.mark.parametrize('hispeed', [True, False])
+@pytest.mark.parametrize('engine', engines)
+def test_clock_only_commands(engine, hispeed):
+    ''' High speed parts wait with the clock-only commands;
+        older parts clock out data bytes.
+    '''
+    jtagger = sim.Jtagger if hispeed else LowSpeedJtagger
+    cable = jtagger(sim_config(engine, FTDI_FLUSH_TIMEOUT=0))
+    read = JtagTemplate(cable, startstate=states.idle).readd(32)
+    JtagTemplate(cable).update(states.idle)()
+    cable.flush()
+    clocks = record_clocks(cable)
+    mpsse = cable.sim.mpsse
+    written = mpsse.written
+    JtagTemplate(cable, startstate=states.idle).runtest(10 ** 6)()
+    cable.flush()
+    numbytes = mpsse.written - written
+    assert sum(clocks) == 10 ** 6
+    if hispeed:
+        assert numbytes < 20
+    else:
+        assert numbytes > 10 ** 6 // 8
+    assert next(read()) == IDCODE
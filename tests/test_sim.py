@@ -0,0 +1,83 @@
+'''
+Tests for the simulated cable:  chain discovery, and
+fpgabus memory reads and writes.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import random
+
+import pytest
+
+from playtag.cables import sim
+from playtag.bench.templates import sim_config
+from playtag.jtag.discover import Chain
+from playtag.fpga.fpgabus import BusDriver
+from playtag.iotemplate import TDIVariable
+from playtag.jtag.template import JtagTemplate
+from playtag.jtag.states import states
+
+engines = ['strings', 'binary', 'bytes']
+IDCODE = 0x13636093     # Simulated nexys_video part
+USER4 = 0b100011
+
+
+@pytest.mark.parametrize('engine', engines)
+def test_discover_chain(engine):
+    cable = sim.Jtagger(sim_config(engine, CABLE_NAME='nexys_video,bypass,0x0362d093'))
+    chain = Chain(cable)
+    # dev_ids is in order from TDO; the chain itself from TDI
+    assert chain.dev_ids == [0x0362d093, 0, 0x13636093]
+    assert [part.name for part in chain] == ['xc7a200t/xq7a200t', '(unknown part)',
+                                             'xa7a35t/xc7a35t']
+    assert [len(part.ir_capture) for part in chain] == [6, 6, 6]
+
+@pytest.mark.parametrize('engine', engines)
+@pytest.mark.parametrize('size', [1, 2, 4])
+def test_bus_round_trip(engine, size):
+    cable = sim.Jtagger(sim_config(engine))
+    memory = cable.chain.devices[0].registers[USER4].spaces[2]
+    busdriver = BusDriver(cable)
+    rnd = random.Random(size)
+    length = 300 // size        # More than one 256 byte command
+    values = [rnd.getrandbits(8 * size) for i in range(length)]
+    busdriver.writemultiple(2, 0x1234, values, size)
+    expected = b''.join(x.to_bytes(size, 'little') for x in values)
+    cable.flush()       # Writes are queued until a read
+    assert memory[0x1234:0x1234 + len(expected)] == expected
+    assert list(busdriver.readmultiple(2, 0x1234, length, size)) == values
+    assert busdriver.readsingle(2, 0x1234 + size, size) == values[1]
+    out = bytearray(len(expected))
+    assert busdriver.readmultiple(2, 0x1234, length, size, out) is out
+    assert out == expected
+
+@pytest.mark.parametrize('engine', engines)
+def test_block_read(engine):
+    ''' Read all 64K bytes of a memory space in one template.
+    '''
+    cable = sim.Jtagger(sim_config(engine))
+    memory = cable.chain.devices[0].registers[USER4].spaces[1]
+    memory[:] = random.Random(17).randbytes(len(memory))
+    data = bytearray(len(memory))
+    assert BusDriver(cable).readmultiple(1, 0, len(data) // 4, 4, data) is data
+    assert data == memory
+
+@pytest.mark.parametrize('engine', engines)
+def test_unaligned_fields(engine):
+    ''' Fields that start and end in the middle of bytes.
+    '''
+    cable = sim.Jtagger(sim_config(engine))
+    widths = [5, 1, 3, 7, 9, 13, 33, 64, 65, 127]
+    template = JtagTemplate(cable).update(states.shift_dr)
+    for width in widths:
+        template.readd(width, tdi=TDIVariable(), adv=False)
+    template.update(states.idle)
+    values = [random.Random(width).getrandbits(width) for width in widths]
+    # The IDCODE comes out first, and then the TDI delayed by 32 bits
+    bits = IDCODE | sum(x << (32 + sum(widths[:i])) for i, x in enumerate(values))
+    expected = []
+    offset = 0
+    for width in widths:
+        expected.append(bits >> offset & ((1 << width) - 1))
+        offset += width
+    assert list(template(values)) == expected
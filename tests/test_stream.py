@@ -0,0 +1,69 @@
+'''
+Tests for streaming shifts (jtag/stream.py) on the simulated cable.
+The data is shifted through the 32 bit IDCODE register, so it comes
+back out delayed by four bytes.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import io
+import random
+
+import pytest
+
+from playtag.cables import sim
+from playtag.bench.templates import sim_config
+from playtag.jtag.stream import JtagStream, shift_stream, reverse_bits
+from playtag.jtag.template import JtagTemplate
+from playtag.jtag.states import states
+
+IDCODE = (0x13636093).to_bytes(4, 'little')     # Simulated nexys_video part
+engines = ['strings', 'binary', 'bytes']
+
+
+def make_cable(engine):
+    ''' Return a cable that has been reset, so
+        that IDCODE is the data register.
+    '''
+    cable = sim.Jtagger(sim_config(engine))
+    JtagTemplate(cable).update(states.idle)()
+    return cable
+
+@pytest.mark.parametrize('engine', engines)
+def test_sources(engine):
+    data = random.Random(6).randbytes(10001)
+    for source in (data, bytearray(data), memoryview(data), io.BytesIO(data), iter(data)):
+        cable = make_cable(engine)
+        stream = JtagStream(cable, chunksize=1000, startstate=states.idle)
+        assert b''.join(stream.readwrite(source)) == IDCODE + data[:-4]
+        # First, middle and last chunks, however long the stream is
+        assert len(stream.templates) == 3
+
+@pytest.mark.parametrize('engine', engines)
+def test_msbfirst(engine):
+    data = random.Random(7).randbytes(3000)
+    cable = make_cable(engine)
+    tdo = b''.join(shift_stream(cable, data, chunksize=1024, startstate=states.idle,
+                                msbfirst=True))
+    assert tdo == IDCODE.translate(reverse_bits) + data[:-4]
+
+@pytest.mark.parametrize('engine', engines)
+def test_stay_in_shift(engine):
+    ''' Streams that do not advance out of the shift state
+        can be followed by more streams.
+    '''
+    data = random.Random(8).randbytes(5000)
+    cable = make_cable(engine)
+    stream = JtagStream(cable, chunksize=512, startstate=states.idle, adv=False)
+    assert stream.write(data) == len(data)
+    following = JtagStream(cable, chunksize=512, startstate=states.shift_dr)
+    assert b''.join(following.readwrite(bytes(8))) == data[-4:] + bytes(4)
+
+def test_cable_chunksize():
+    cable = make_cable('bytes')
+    stream = JtagStream(cable)
+    assert stream.chunksize == cable.stream_chunksize
+    data = random.Random(9).randbytes(2 * stream.chunksize + 10)
+    stream.startstate = states.idle
+    assert b''.join(stream.readwrite(data)) == IDCODE + data[:-4]
+    assert sorted(key[0] for key in stream.templates) == [10, stream.chunksize, stream.chunksize]
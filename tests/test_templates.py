@@ -0,0 +1,159 @@
+'''
+Tests for the cable-independent IO templates.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import random
+
+import pytest
+
+from playtag.cables import sim
+from playtag.bench.templates import sim_config
+from playtag.iotemplate import TmsRuns, TDIVariable
+from playtag.iotemplate.intconvert import TemplateInts
+from playtag.jtag.template import JtagTemplate
+from playtag.jtag.states import states
+
+IDCODE = 0x13636093     # Simulated nexys_video part
+
+
+def check_runs(runs, values):
+    assert list(runs) == values
+    assert list(reversed(runs)) == values[::-1]
+    assert len(runs) == len(values)
+    assert all(x[0] != y[0] for x, y in zip(runs.runs, runs.runs[1:]))
+    assert all(count > 0 for value, count in runs.runs)
+
+def test_tms_runs():
+    ''' TmsRuns acts like a list of 0/1 values.
+    '''
+    rnd = random.Random(7)
+    for trial in range(200):
+        values = [rnd.randrange(2) for i in range(rnd.randrange(20))]
+        runs = TmsRuns(values)
+        check_runs(runs, values)
+        for i in range(10):
+            op = rnd.randrange(5)
+            if op == 0:
+                more = [rnd.randrange(2) for i in range(rnd.randrange(10))]
+                runs += TmsRuns(more) if rnd.randrange(2) else more
+                values += more
+            elif op == 1:
+                value = rnd.randrange(2)
+                runs.append(value)
+                values.append(value)
+            elif op == 2:
+                multiplier = rnd.randrange(4)
+                runs *= multiplier
+                values *= multiplier
+            elif op == 3 and values:
+                index = rnd.randrange(-len(values), len(values))
+                assert runs[index] == values[index]
+                value = rnd.randrange(2)
+                runs[index] = values[index] = value
+            else:
+                copy = runs.copy()
+                copy.append(1)
+                check_runs(runs, values)
+                runs = copy
+                values = values + [1]
+            check_runs(runs, values)
+    with pytest.raises(IndexError):
+        TmsRuns([0, 1])[2]
+
+def test_long_shift_is_compact():
+    template = JtagTemplate(None).readd(10 ** 9, tdi=TDIVariable())
+    template.runtest(10 ** 9)
+    assert len(template) > 2 * 10 ** 9
+    assert len(template.tms.runs) < 20
+    repeated = JtagTemplate(None, startstate=states.shift_dr).writed(10 ** 6, adv=False)
+    repeated *= 1000
+    assert len(repeated) == 10 ** 9
+    assert repeated.tms.runs == [(0, 10 ** 9)]
+
+@pytest.mark.parametrize('engine', ['strings', 'binary', 'bytes'])
+def test_runs_match_list(engine):
+    ''' A template built from a plain list of TMS values
+        runs the same as one built from runs.
+    '''
+    cable = sim.Jtagger(sim_config(engine))
+    template = JtagTemplate(cable).readd(32, tdi=TDIVariable(), adv=False).readd(32)
+    template.update(states.idle)
+    assert isinstance(template.tms, TmsRuns)
+    listed = template.copy()
+    listed.tms = list(template.tms)
+    assert listed == template
+    assert list(template([5])) == list(listed([5])) == [IDCODE, 5]
+
+def loop_templates(cable, count, unroll=True):
+    ''' Return a template with nested loops, and the same
+        template built by calling the methods in a loop.
+    '''
+    looped = JtagTemplate(cable).update(states.shift_dr)
+    unrolled = JtagTemplate(cable).update(states.shift_dr)
+    looped.loop()
+    looped.readd(12, tdi=TDIVariable(), adv=False)
+    looped.loop()
+    looped.writed(4, '1001', adv=False)
+    looped.endloop(3)
+    looped.endloop(count)
+    for i in range(count if unroll else 0):
+        unrolled.readd(12, tdi=TDIVariable(), adv=False)
+        for j in range(3):
+            unrolled.writed(4, '1001', adv=False)
+    return looped.update(states.idle), unrolled.update(states.idle)
+
+def test_loops_are_lazy():
+    looped, unrolled = loop_templates(None, 10 ** 6, unroll=False)
+    assert looped.repeats and not looped.tdo
+    assert len(looped) == 24 * 10 ** 6 + len(unrolled)
+    assert TemplateInts(looped).transaction_bit_length == len(looped)
+    small, unrolled = loop_templates(None, 5)
+    expanded = small.expand()
+    assert not expanded.repeats
+    assert list(expanded.tms) == list(unrolled.tms)
+    assert expanded.tdo == unrolled.tdo
+    compiled = [TemplateInts(x) for x in (small, expanded, unrolled)]
+    for name in 'tms', 'tdi_const', 'tdi_splice', 'tdo_gather', 'tdo_bits':
+        assert len(set(repr(getattr(x, name)) for x in compiled)) == 1, name
+
+@pytest.mark.parametrize('engine', ['strings', 'binary', 'bytes'])
+def test_loops_on_cable(engine):
+    cable = sim.Jtagger(sim_config(engine))
+    looped, unrolled = loop_templates(cable, 100)
+    data = [random.Random(8).getrandbits(12) for i in range(100)]
+    # The IDCODE comes out first, and then the TDI delayed by 32 bits
+    bits = IDCODE | sum((x | 0x999 << 12) << (32 + 24 * i) for i, x in enumerate(data))
+    expected = [bits >> (24 * i) & 0xFFF for i in range(100)]
+    assert list(looped(data)) == list(unrolled(data)) == expected
+
+@pytest.mark.parametrize('engine', ['strings', 'binary', 'bytes'])
+def test_interning(engine):
+    ''' Structurally identical templates share one device template.
+    '''
+    cable = sim.Jtagger(sim_config(engine))
+    compiled = []
+    make_template = cable.make_template
+    def record(template):
+        compiled.append(template)
+        return make_template(template)
+    cable.make_template = record
+    def build(name):
+        template = JtagTemplate(cable, name).readd(32, tdi=TDIVariable(), adv=False)
+        return template.readd(32).update(states.idle)
+    templates = [build('read_%d' % i) for i in range(50)]
+    assert len(set(templates)) == 1
+    assert [next(iter(x([i]))) for i, x in enumerate(templates)] == 50 * [IDCODE]
+    assert len(compiled) == 1
+    assert all(x.devtemplate is templates[0].devtemplate for x in templates)
+    different = JtagTemplate(cable).readd(31, tdi=TDIVariable(), adv=False).readd(32)
+    assert different != templates[0]
+    assert list(different([7])) == [IDCODE & 0x7FFFFFFF, 7 << 1 | IDCODE >> 31]
+    assert len(compiled) == 2
+    # Each cable has its own table
+    other = sim.Jtagger(sim_config(engine))
+    template = build('other')
+    template.cable = other
+    assert list(template([3])) == [IDCODE, 3]
+    assert template.devtemplate is not templates[0].devtemplate
@@ -0,0 +1,78 @@
+'''
+Tests for the XVC server in tools/jtag/xilinx_xvc.py, running
+against the simulated cable.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import os
+import sys
+import time
+import socket
+import subprocess
+
+import pytest
+
+tooldir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools', 'jtag')
+
+IDCODE = 0x13636093     # Simulated nexys_video part
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def shift(tms, tdi, numbits):
+    numbytes = (numbits + 7) // 8
+    return (b'shift:' + numbits.to_bytes(4, 'little') +
+            tms.to_bytes(numbytes, 'little') + tdi.to_bytes(numbytes, 'little'))
+
+def recv_exactly(sock, numbytes):
+    data = b''
+    while len(data) < numbytes:
+        received = sock.recv(numbytes - len(data))
+        if not received:
+            raise EOFError('Server closed the connection')
+        data += received
+    return data
+
+
+@pytest.fixture(params=['strings', 'binary', 'bytes'])
+def server(request):
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, 'xilinx_xvc.py', 'sim', 'nexys_video', 'SOCKET_ADDRESS=%d' % port,
+         'SHOW_CONFIG=0', 'FTDI_TEMPLATE_ENGINE=%s' % request.param],
+        cwd=tooldir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                sock = socket.create_connection(('127.0.0.1', port))
+                break
+            except ConnectionRefusedError:
+                if proc.poll() is not None or time.time() > deadline:
+                    raise RuntimeError(proc.stdout.read().decode())
+                time.sleep(0.1)
+        sock.settimeout(30)
+        with sock:
+            yield sock
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def test_tdi_padding_bits_ignored(server):
+    ''' Bits of the last TDI byte past the end of the shift
+        are junk, and must not reach the template.
+    '''
+    # Reset, then go to shift_dr, with IDCODE in the data register
+    server.sendall(shift(0b001011111, 0, 9))
+    recv_exactly(server, 2)
+    # Five bits, with all the padding bits set
+    server.sendall(shift(0, 0xff, 5))
+    assert recv_exactly(server, 1)[0] == IDCODE & 0x1f
+    # The five ones follow the rest of IDCODE out
+    server.sendall(shift(0, 0, 40))
+    tdo = int.from_bytes(recv_exactly(server, 5), 'little')
+    assert tdo == IDCODE >> 5 | 0x1f << 27
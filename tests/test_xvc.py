@@ -0,0 +1,212 @@
+'''
+Tests for the XVC client cable, connected over loopback to
+the benchmark XVC server, which shifts data through a
+simulated chain.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import random
+import select
+
+import pytest
+
+from playtag.cables import sim, xvc
+from playtag.bench.cables import XvcServer
+from playtag.bench.templates import sim_config
+from playtag.jtag.discover import Chain
+from playtag.fpga.fpgabus import BusDriver
+from playtag.iotemplate import TDIVariable
+from playtag.iotemplate.deferred import DeferredTdo
+from playtag.jtag.template import JtagTemplate
+from playtag.jtag.states import states
+
+IDCODE = 0x13636093     # Simulated nexys_video part
+CHAIN = 'nexys_video,bypass,0x0362d093'
+USER4 = 0b100011
+engines = ['ints', 'binary', 'bytes']
+
+
+class WindowServer(XvcServer):
+    ''' Holds its replies until the client stops sending, and
+        records the most shift commands waiting for replies.
+    '''
+    idle = 0.02     # Seconds without a command before replying
+    most = 0
+
+    def shift_commands(self, sock):
+        data = bytearray()
+        replies = []
+        clock = self.chain.clock
+        while True:
+            while True:
+                if data.startswith(b'getinfo:'):
+                    sock.sendall(b'xvcServer_v1.0:%d\n' % (self.maxbits // 8))
+                    del data[:8]
+                elif data.startswith(b'shift:') and len(data) >= 10:
+                    numbytes = (int.from_bytes(data[6:10], 'little') + 7) // 8
+                    end = 10 + 2 * numbytes
+                    if len(data) < end:
+                        break
+                    tms = int.from_bytes(data[10:10 + numbytes], 'little')
+                    tdi = int.from_bytes(data[10 + numbytes:end], 'little')
+                    numbits = int.from_bytes(data[6:10], 'little')
+                    replies.append(clock(tms, tdi, numbits).to_bytes(numbytes, 'little'))
+                    del data[:end]
+                else:
+                    break
+            self.most = max(self.most, len(replies))
+            if replies and not select.select([sock], [], [], self.idle)[0]:
+                sock.sendall(b''.join(replies))
+                replies = []
+                continue
+            received = sock.recv(65536)
+            if not received:
+                return
+            data += received
+
+def make_server(chain='nexys_video', server_class=XvcServer):
+    return server_class(sim.make_chain(sim_config(None, CABLE_NAME=chain, SIM_IR_LENGTH=6,
+                                                  SIM_MEMORY_SIZE=65536)))
+
+def make_cable(server, engine='bytes', **kwds):
+    return xvc.Jtagger(sim_config(None, CABLE_NAME='127.0.0.1:%d' % server.port,
+                                  XVC_TEMPLATE_ENGINE=engine, **kwds))
+
+@pytest.fixture(scope='module')
+def server():
+    return make_server()
+
+
+@pytest.mark.parametrize('engine', engines)
+def test_discover_chain(engine):
+    chain = Chain(make_cable(make_server(CHAIN), engine))
+    assert chain.dev_ids == [0x0362d093, 0, 0x13636093]
+
+@pytest.mark.parametrize('engine', engines)
+def test_bus_round_trip(server, engine):
+    cable = make_cable(server, engine)
+    memory = server.chain.devices[0].registers[USER4].spaces[3]
+    busdriver = BusDriver(cable)
+    rnd = random.Random(len(engine))
+    values = [rnd.getrandbits(32) for i in range(5000)]     # More than one shift command
+    busdriver.writemultiple(3, 0x100, values, 4)
+    assert list(busdriver.readmultiple(3, 0x100, len(values), 4)) == values
+    assert memory[0x100:0x104] == values[0].to_bytes(4, 'little')
+    assert busdriver.readsingle(3, 0x104, 4) == values[1]
+
+def idcode_template(cable):
+    return JtagTemplate(cable).readd(32, tdi=TDIVariable(), adv=False).readd(32)
+
+@pytest.mark.parametrize('window', [1, 3])
+@pytest.mark.parametrize('engine', engines)
+def test_window(engine, window):
+    ''' Commands that do not read stay in flight, up to the window.
+    '''
+    server = make_server(server_class=WindowServer)
+    cable = make_cable(server, engine, XVC_WINDOW=window)
+    wait = JtagTemplate(cable).runtest(100)
+    read = idcode_template(cable)
+    for i in range(10):
+        wait()
+    assert list(read([5])) == [IDCODE, 5]
+    assert server.most == window
+
+@pytest.mark.parametrize('engine', engines)
+def test_long_shift_in_flight(engine):
+    ''' A shift split into many commands keeps the window full.
+    '''
+    server = make_server(server_class=WindowServer)
+    cable = make_cable(server, engine, XVC_WINDOW=4, XVC_MAX_BITS=8000)
+    numbits = 100000
+    data = random.Random(22).getrandbits(numbits)
+    template = JtagTemplate(cable).readd(numbits + 32, tdi=TDIVariable())
+    assert list(template([data])) == [IDCODE | data << 32]
+    assert server.most == 4
+
+def test_pending_replies_fit():
+    ''' Unread replies never exceed the socket receive buffer.
+    '''
+    server = make_server(server_class=WindowServer)
+    cable = make_cable(server, 'ints', XVC_WINDOW=100, XVC_MAX_BITS=8000)
+    cable.maxpending = 3000
+    numbits = 100000
+    data = random.Random(23).getrandbits(numbits)
+    template = JtagTemplate(cable).readd(numbits + 32, tdi=TDIVariable())
+    assert list(template([data])) == [IDCODE | data << 32]
+    assert server.most == 3
+
+def test_batch():
+    server = make_server(server_class=WindowServer)
+    cable = make_cable(server, 'bytes', XVC_WINDOW=4)
+    read = idcode_template(cable)
+    with cable.batch():
+        results = [read([i]) for i in range(6)]
+        assert all(isinstance(x, DeferredTdo) for x in results)
+        assert list(results.pop(1)) == [IDCODE, 1]
+        assert results[0].done and not results[-1].done
+    assert [list(x) for x in results] == [[IDCODE, i] for i in (0, 2, 3, 4, 5)]
+    assert server.most == 4
+
+class SmallServer(XvcServer):
+    maxbits = 800
+
+class BadServer(XvcServer):
+    def shift_commands(self, sock):
+        sock.recv(8)
+        sock.sendall(b'not an xvc server\n')
+
+def record_shifts(server):
+    ''' Return a list that gets the number of bits in each shift.
+    '''
+    shifts = []
+    clock = server.chain.clock
+    def record(tms, tdi, numbits):
+        shifts.append(numbits)
+        return clock(tms, tdi, numbits)
+    server.chain.clock = record
+    return shifts
+
+@pytest.mark.parametrize('engine', engines)
+def test_negotiated_size(engine):
+    server = make_server(server_class=SmallServer)
+    shifts = record_shifts(server)
+    cable = make_cable(server, engine)
+    assert cable.maxbits == 800
+    busdriver = BusDriver(cable)
+    values = list(range(1000))
+    busdriver.writemultiple(0, 0, values, 4)
+    assert list(busdriver.readmultiple(0, 0, len(values), 4)) == values
+    assert max(shifts) == 800
+    assert sum(shifts) > 64000
+
+@pytest.mark.parametrize('limit, maxbits', [(1001, 1000), (10 ** 6, 4000)])
+def test_max_bits(limit, maxbits):
+    ''' XVC_MAX_BITS is rounded down to whole bytes,
+        and cannot raise the server's limit.
+    '''
+    server = make_server()
+    server.maxbits = 4000
+    shifts = record_shifts(server)
+    cable = make_cable(server, XVC_MAX_BITS=limit)
+    assert cable.maxbits == maxbits and cable.stream_chunksize == cable.maxbits // 8
+    data = random.Random(limit).getrandbits(5000)
+    template = JtagTemplate(cable).readd(5032, tdi=TDIVariable())
+    assert list(template([data])) == [IDCODE | data << 32]
+    assert max(shifts) == cable.maxbits
+
+def test_too_small():
+    with pytest.raises(SystemExit):
+        make_cable(make_server(), XVC_MAX_BITS=5)
+
+def test_bad_server():
+    with pytest.raises(SystemExit):
+        make_cable(make_server(server_class=BadServer))
+
+def test_speed(server):
+    assert make_cable(server).getspeed() is None
+    cable = make_cable(server, XVC_JTAG_FREQ=3e6)
+    # The server reports the period it used, in nanoseconds
+    assert cable.getspeed() == 1e9 / 333
+    assert cable.setspeed(1e6) == 1e6
+    assert list(idcode_template(cable)([9])) == [IDCODE, 9]
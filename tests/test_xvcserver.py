@@ -0,0 +1,216 @@
+'''
+Tests for the asyncio XVC server in playtag/lib/xvcserver.py,
+with the simulated chain as the cable.
+
+Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
+License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
+'''
+import time
+import socket
+import asyncio
+import threading
+
+import pytest
+
+from playtag.cables import sim
+from playtag.bench.templates import sim_config
+from playtag.lib import xvcserver
+
+IDCODE = 0x13636093     # Simulated nexys_video part
+SHIFT_DR = 0b001011111  # Reset, then go to shift_dr with IDCODE in the data register
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def shift(tms, tdi, numbits):
+    numbytes = (numbits + 7) // 8
+    return (b'shift:' + numbits.to_bytes(4, 'little') +
+            tms.to_bytes(numbytes, 'little') + tdi.to_bytes(numbytes, 'little'))
+
+def echo(value, width=32):
+    ''' Return a shift command that reads IDCODE, and then
+        value (delayed by the 32 bit register), and leaves
+        the TAP in idle, and the expected reply.  TDO is
+        high outside the shift states.
+    '''
+    numbits = 9 + 32 + width + 2
+    tms = SHIFT_DR | 0b011 << (numbits - 3)
+    tdo = 0x1ff | (IDCODE | value << 32) << 9 | 0b11 << (numbits - 2)
+    return shift(tms, value << 9, numbits), tdo.to_bytes((numbits + 7) // 8, 'little')
+
+def recv_exactly(sock, numbytes):
+    data = b''
+    while len(data) < numbytes:
+        received = sock.recv(numbytes - len(data))
+        if not received:
+            raise EOFError('Server closed the connection')
+        data += received
+    return data
+
+def start_server(maxvector=1000, execute=None):
+    ''' Run a server in its own thread and event loop, and return
+        a function that connects a client to it.
+    '''
+    chain = sim.make_chain(sim_config(None, SIM_IR_LENGTH=6, SIM_MEMORY_SIZE=65536))
+    if execute is None:
+        def execute(data):
+            assert isinstance(data, memoryview)
+            numbits = int.from_bytes(data[6:10], 'little')
+            numbytes = (numbits + 7) // 8
+            tms = int.from_bytes(data[10:10 + numbytes], 'little')
+            tdi = int.from_bytes(data[10 + numbytes:], 'little') & ((1 << numbits) - 1)
+            return chain.clock(tms, tdi, numbits).to_bytes(numbytes, 'little')
+    port = free_port()
+    server = xvcserver.XvcServer(execute, 'test', maxvector)
+    threading.Thread(target=asyncio.run, args=(server.serve(port, '127.0.0.1'),),
+                     daemon=True).start()
+    def connect():
+        deadline = time.time() + 10
+        while True:
+            try:
+                sock = socket.create_connection(('127.0.0.1', port))
+                break
+            except ConnectionRefusedError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.01)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(30)
+        return sock
+    connect.server = server
+    return connect
+
+@pytest.fixture(scope='module')
+def connect():
+    return start_server()
+
+def test_getinfo_and_settck(connect):
+    with connect() as sock:
+        sock.sendall(b'getinfo:')
+        assert recv_exactly(sock, 20) == b'xvcServer_v1.0:1000\n'
+        sock.sendall(b'settck:' + (100).to_bytes(4, 'little'))
+        assert recv_exactly(sock, 4) == (100).to_bytes(4, 'little')
+
+def test_pipelined_commands(connect):
+    ''' Commands sent before any replies are read are answered in order,
+        even when they arrive a byte at a time.
+    '''
+    commands = [b'getinfo:']
+    replies = [b'xvcServer_v1.0:1000\n']
+    for i in range(20):
+        command, reply = echo(i * 0x01010101)
+        commands += [command, b'settck:' + i.to_bytes(4, 'little')]
+        replies += [reply, i.to_bytes(4, 'little')]
+    data = b''.join(commands)
+    expected = b''.join(replies)
+    with connect() as sock:
+        sock.sendall(data)
+        assert recv_exactly(sock, len(expected)) == expected
+        for i in range(len(data)):
+            sock.sendall(data[i:i + 1])
+        assert recv_exactly(sock, len(expected)) == expected
+
+def test_concurrent_clients(connect):
+    ''' Each command resets the TAP, so clients that are connected
+        at the same time all get the right replies.
+    '''
+    errors = []
+    def client(index):
+        try:
+            with connect() as sock:
+                for i in range(50):
+                    command, reply = echo(index << 24 | i)
+                    sock.sendall(command)
+                    assert recv_exactly(sock, len(reply)) == reply
+        except BaseException as exc:
+            errors.append(exc)
+    threads = [threading.Thread(target=client, args=(x,)) for x in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+def test_reconnect(connect):
+    ''' The server keeps listening, so a client can reconnect at once.
+    '''
+    start = time.time()
+    for i in range(20):
+        with connect() as sock:
+            command, reply = echo(i)
+            sock.sendall(command)
+            assert recv_exactly(sock, len(reply)) == reply
+    assert time.time() - start < 5
+
+@pytest.mark.parametrize('command', [b'bogus:', b'shift:' + (100000).to_bytes(4, 'little')])
+def test_bad_command_closes(connect, command):
+    with connect() as sock:
+        sock.sendall(command)
+        assert sock.recv(100) == b''
+    # The server still takes new clients
+    with connect() as sock:
+        command, reply = echo(0x5a5a5a5a)
+        sock.sendall(command)
+        assert recv_exactly(sock, len(reply)) == reply
+
+def test_round_robin():
+    ''' A client with a lot of queued work does not lock out another one.
+    '''
+    release = threading.Event()
+    order = []
+    def execute(data):
+        release.wait(30)
+        order.append(data[-1])
+        return bytes((len(data) - 10) // 2)
+    connect = start_server(execute=execute)
+    queues = connect.server.arbiter.queues
+    def queued(count):
+        deadline = time.time() + 10
+        while sum(len(x) for x in list(queues.values())) < count:
+            assert time.time() < deadline
+            time.sleep(0.01)
+    with connect() as first, connect() as second:
+        first.sendall(b''.join(shift(0, 1, 8) for i in range(10)))
+        queued(9)       # The first one is executing
+        second.sendall(shift(0, 2, 8))
+        queued(10)
+        release.set()
+        assert recv_exactly(first, 10) == bytes(10)
+        assert recv_exactly(second, 1) == bytes(1)
+    assert order.index(2) <= 2 and order.count(1) == 10
+
+@pytest.mark.parametrize('maxvector', [12, 13, 40])
+def test_ring_wraps(maxvector):
+    ''' Pipelined commands of assorted sizes, up to the maximum, wrap
+        around a small ring, and are moved to its start when they do
+        not fit at the end.
+    '''
+    connect = start_server(maxvector)
+    assert connect.server.ringsize < 500
+    commands = []
+    replies = []
+    for i in range(200):
+        width = (i * 7) % (maxvector * 8 - 43) + 1
+        command, reply = echo(i * 0x9e3779b9 % (1 << width), width)
+        commands.append(command)
+        replies.append(reply)
+    data = b''.join(commands)
+    expected = b''.join(replies)
+    with connect() as sock:
+        sock.sendall(data)
+        assert recv_exactly(sock, len(expected)) == expected
+        # Commands that arrive in pieces
+        for command, reply in zip(commands[:20], replies):
+            for i in range(1, len(command), 5):
+                sock.sendall(command[:i])
+                time.sleep(0.001)
+                sock.sendall(command[i:])
+                assert recv_exactly(sock, len(reply)) == reply
+        command, reply = echo(1, maxvector * 8 - 43)
+        info = b'xvcServer_v1.0:%d\n' % maxvector
+        sock.sendall(command + b'getinfo:')
+        assert len(command) == 10 + 2 * maxvector
+        assert recv_exactly(sock, len(reply) + len(info)) == reply + info
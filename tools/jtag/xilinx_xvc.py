@@ -1,11 +1,9 @@
 #! /usr/bin/env python3
-import sys
-import ctypes
 import time
 
 from playtag.lib.userconfig import UserConfig, basic_startup
 from playtag.jtag.discover import Chain
-from playtag.lib.transport import connection
+from playtag.lib.xvcserver import serve
 from playtag.iotemplate import IOTemplate, TDIVariable
 
 '''
@@ -30,57 +28,34 @@ Copyright (C) 2011, 2022 by Patrick Maupin.  All rights reserved.
 License information at: https://github.com/pmaupin/playtag/blob/master/LICENSE.txt
 '''
 
-def getcmdinfo(data, numbytes, tdivar=TDIVariable()):
-
-    class CmdStruct(ctypes.LittleEndianStructure):
-        _pack_ = 1
-        _fields_ = (
-                ("cmdstr",   ctypes.c_char * 6),
-                ("numbits",  ctypes.c_uint32),
-                ("tmsbytes", ctypes.c_uint8 * numbytes),
-        )
-    headersize = ctypes.sizeof(CmdStruct)
-    assert headersize == len(data)
-
-    class TdioStruct(ctypes.LittleEndianStructure):
-        _pack_ = 1
-        _fields_ = (
-                ("data",    (numbytes + 7) // 8 * ctypes.c_uint64),
-        )
-
-    cmdinfo = CmdStruct.from_buffer_copy(data)
-
-    numbits = cmdinfo.numbits
-    tmsbuf = cmdinfo.tmsbytes
-    bitmap = [min(numbits-i, 64) for i in range(0, numbits, 64)]
-
-    assert cmdinfo.cmdstr == b'shift:', cmdinfo.cmdstr
-    assert (numbits + 7) // 8 == numbytes, (numbits, numbytes)
+def getcmdinfo(header_and_tms, tdivar=TDIVariable(), lastvar=TDIVariable(1)):
+    ''' Return a function that runs shift commands that have this
+        header and TMS data.  TDI and TDO are handled as bytes, so
+        the TDI is taken straight from the command buffer, and the
+        TDO is stored straight into the reply.
+
+        The last TDI byte may have junk in the bits past the end of
+        the shift, so it is a separate stream, and it is masked
+        (without writing into the command buffer).
+    '''
+    numbits = int.from_bytes(header_and_tms[6:10], 'little')
+    numbytes = (numbits + 7) // 8
+    tmsbuf = header_and_tms[10:]
+    assert len(tmsbuf) == numbytes, (numbits, len(tmsbuf))
+    if not numbits:
+        return lambda data: b''
+    bytemap = [min(numbits-i, 8) for i in range(0, numbits, 8)]
 
     template = IOTemplate(config.driver)
     template.tms = [((tmsbuf[i//8] >> (i % 8)) & 1) for i in range(numbits)]
-    template.tdi = [(j, tdivar) for j in bitmap]
-    template.tdo = [(i>0 and 64 or 0, j) for (i,j) in enumerate(bitmap)]
-
-    StrClass = ctypes.c_char * numbytes
-    tdodata = TdioStruct()
-    tdidata = TdioStruct()
-    tdodata64 = tdodata.data
-    tdidata64 = tdidata.data
-    tdodata_ch = StrClass.from_buffer(tdodata)
-    tdidata_ch = StrClass.from_buffer(tdidata)
-
-    tdimask = (2 << ((numbits-1) % 64)) - 1
+    template.tdi = [(j, tdivar) for j in bytemap[:-1]] + [(bytemap[-1], lastvar)]
+    template.tdo = [(i>0 and 8 or 0, j) for (i,j) in enumerate(bytemap)]
 
-    tdi_slice = slice(headersize, headersize + numbytes)
+    tdi_slice = slice(10 + numbytes, 9 + 2 * numbytes)
+    last = 9 + 2 * numbytes
+    lastmask = (1 << bytemap[-1]) - 1
     def run_jtag(data):
-        tdidata_ch.value = data[tdi_slice]
-        tdidata64[-1] &= tdimask
-        processtime = -time.time()
-        result = template(tdidata64)
-        processtime += time.time()
-        tdodata64[:] = list(result)
-        return tdodata_ch.raw, processtime
+        return template.into(bytearray(numbytes), data[tdi_slice], [data[last] & lastmask])
 
     return run_jtag
 
@@ -89,90 +64,29 @@ def printbytes(header, data):
     data = '\n    '.join(data[x:x+64] for x in range(0, len(data), 64))
     print('%s: %s' % (header, data), file=dumpf)
 
-def cmdproc(read, write):
-    maxdata = 120000
-    class CmdStruct(ctypes.LittleEndianStructure):
-        _pack_ = 1
-        _fields_ = (
-                ("cmdstr",   ctypes.c_char * 6),
-                ("numbits",  ctypes.c_uint32),
-        )
-    headersize = ctypes.sizeof(CmdStruct)
-
-    cmdcache = {}
-    cmdcacheget = cmdcache.get
-    connecttime = -time.time()
-    readtime = 0.0
-    writetime = 0.0
-    processtime = 0.0
-    data = b''
-    while True:
-        if len(data) < headersize:
-            readtime -= time.time()
-            newdata = read()
-            readtime += time.time()
-            if not newdata:
-                break
-            data += newdata
-
-        if data.startswith(b'getinfo:'):
-            writetime -= time.time()
-            write(b"xvcServer_v1.0:%d\n" % maxdata)
-            writetime += time.time()
-            data = b''
-            continue
-
-        if data.startswith(b'settck:'):
-            writetime -= time.time()
-            write(data[7:])
-            writetime += time.time()
-            data = b''
-            continue
-
-        while len(data) < headersize:
-            readtime -= time.time()
-            newdata = read()
-            readtime += time.time()
-            if not newdata:
-                break
-            data += newdata
-
-        cmdinfo = CmdStruct.from_buffer_copy(data)
-        assert cmdinfo.cmdstr == b'shift:', cmdinfo.cmdstr
-        numbits = cmdinfo.numbits
-        numbytes = (cmdinfo.numbits + 7) // 8
-        while len(data) < headersize + 2 * numbytes:
-            readtime -= time.time()
-            newdata = read()
-            readtime += time.time()
-            if not newdata:
-                break
-            data += newdata
-
-        header_and_tms = data[:headersize + numbytes]
-        run_jtag = cmdcacheget(header_and_tms)
-        if run_jtag is None:
-            run_jtag = cmdcache[header_and_tms] = getcmdinfo(header_and_tms, numbytes)
-        result, _ = run_jtag(data)
-        processtime += _
-        writetime -= time.time()
-        write(result)
-        writetime += time.time()
-        if dumpf:
-            global now
-            prev, now = now, time.time()
-            print('DLY: %0.1f' % (now-prev), file=dumpf)
-            print('NUM: %d' % numbits, file=dumpf)
-            printbytes('TMS', data[headersize:headersize + numbytes], file=dumpf)
-            printbytes('TDI', data[headersize + numbytes:headersize + 2*numbytes], file=dumpf)
-            printbytes('TDO', result, file=dumpf)
-            print('', file=dumpf)
-            dumpf.flush()
-        data = data[headersize + 2 * numbytes:]
-    connecttime += time.time()
-    print('Connection finished: time = %0.1f reading = %0.1f writing = %0.1f processing = %0.1f, jtag = %0.1f' %
-          (connecttime, readtime, writetime, connecttime-readtime-writetime, processtime))
-    sys.stdout.flush()
+def shift_command(data, cmdcache={}):
+    ''' Execute a complete XVC shift command (a memoryview of the
+        header, TMS and TDI), and return the TDO bytes.  This is
+        called by the server's cable thread, one command at a time.
+    '''
+    numbits = int.from_bytes(data[6:10], 'little')
+    numbytes = (numbits + 7) // 8
+    header_and_tms = data[:10 + numbytes].tobytes()
+    run_jtag = cmdcache.get(header_and_tms)
+    if run_jtag is None:
+        run_jtag = cmdcache[header_and_tms] = getcmdinfo(header_and_tms)
+    result = run_jtag(data)
+    if dumpf:
+        global now
+        prev, now = now, time.time()
+        print('DLY: %0.1f' % (now-prev), file=dumpf)
+        print('NUM: %d' % numbits, file=dumpf)
+        printbytes('TMS', data[10:10 + numbytes])
+        printbytes('TDI', data[10 + numbytes:10 + 2*numbytes])
+        printbytes('TDO', result)
+        print('', file=dumpf)
+        dumpf.flush()
+    return result
 
 # Default the socket to standard Xilinx XVC address, then get our cable
 UserConfig.SOCKET_ADDRESS = 2542
@@ -185,4 +99,4 @@ print(Chain(config.driver))
 
 dumpf = config.LOG_PACKETS and open('log_xvc.txt', 'wt')
 now = time.time()
-connection(cmdproc, 'xvc', config.SOCKET_ADDRESS, readsize=4096, logpackets=config.LOG_PACKETS)
+serve(shift_command, config.SOCKET_ADDRESS)